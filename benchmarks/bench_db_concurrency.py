@@ -0,0 +1,150 @@
+"""
+Concurrent latency benchmark for the database layer.
+
+Runs the same workload twice against one database: first through a sync Session called
+from coroutines (the way the repositories worked before), then through an AsyncSession.
+Requests arrive at a fixed ``--rate`` (open loop) and latency is measured from the scheduled
+arrival, so time spent waiting for a blocked event loop is counted. Every request runs a cheap
+query; every ``--slow-every`` request runs a slow one instead. The p99 of the cheap queries
+shows how much a slow query stalls everything else on the worker.
+
+Usage:
+    python -m benchmarks.bench_db_concurrency --uri sqlite:///./bench.db --requests 400 --rate 200
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+from src.database.db import get_async_uri
+
+FAST_QUERY = text("SELECT 1")
+SLOW_QUERIES = {
+    "postgresql": text("SELECT pg_sleep(0.05)"),
+    "sqlite": text("WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c WHERE x < 300000) "
+                   "SELECT count(*) FROM c"),
+}
+
+
+def percentile(values: list, pct: float) -> float:
+    """
+    The percentile function returns the pct-th percentile of values using the nearest-rank method.
+
+    :param values: list: Latencies in seconds
+    :param pct: float: Percentile between 0 and 100
+    :return: The percentile value in milliseconds
+    """
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index] * 1000
+
+
+def summary(name: str, latencies: list, elapsed: float) -> dict:
+    """
+    The summary function turns the raw latencies of one run into a report row.
+
+    :param name: str: Name of the run
+    :param latencies: list: Latencies of the cheap queries in seconds
+    :param elapsed: float: Wall time of the whole run in seconds
+    :return: A dict with p50/p95/p99 in milliseconds and throughput
+    """
+    return {
+        "run": name,
+        "requests": len(latencies),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 2),
+        "rps": round(len(latencies) / elapsed, 1),
+    }
+
+
+async def run_sync(uri: str, slow_query, requests: int, rate: float, concurrency: int,
+                   slow_every: int) -> dict:
+    """
+    The run_sync function drives the workload through a blocking Session from inside coroutines.
+
+    :param uri: str: Sync database URI
+    :param slow_query: The statement used for slow requests
+    :param requests: int: Total number of requests
+    :param rate: float: Arrival rate in requests per second
+    :param concurrency: int: Size of the connection pool
+    :param slow_every: int: Every n-th request is a slow one
+    :return: A summary dict
+    """
+    engine = create_engine(uri, pool_size=concurrency, max_overflow=0, pool_timeout=60)
+    session_factory = sessionmaker(bind=engine)
+    latencies = []
+
+    async def handler(number: int):
+        arrival = started + number / rate
+        await asyncio.sleep(max(0.0, arrival - time.perf_counter()))
+        with session_factory() as db:
+            db.execute(slow_query if number % slow_every == 0 else FAST_QUERY).fetchall()
+        if number % slow_every:
+            latencies.append(time.perf_counter() - arrival)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(handler(number) for number in range(1, requests + 1)))
+    elapsed = time.perf_counter() - started
+    engine.dispose()
+    return summary("sync Session", latencies, elapsed)
+
+
+async def run_async(uri: str, slow_query, requests: int, rate: float, concurrency: int,
+                    slow_every: int) -> dict:
+    """
+    The run_async function drives the same workload through an AsyncSession.
+
+    :param uri: str: Sync database URI, converted to its async driver
+    :param slow_query: The statement used for slow requests
+    :param requests: int: Total number of requests
+    :param rate: float: Arrival rate in requests per second
+    :param concurrency: int: Size of the connection pool
+    :param slow_every: int: Every n-th request is a slow one
+    :return: A summary dict
+    """
+    engine = create_async_engine(get_async_uri(uri), pool_size=concurrency, max_overflow=0, pool_timeout=60)
+    session_factory = async_sessionmaker(engine)
+    latencies = []
+
+    async def handler(number: int):
+        arrival = started + number / rate
+        await asyncio.sleep(max(0.0, arrival - time.perf_counter()))
+        async with session_factory() as db:
+            result = await db.execute(slow_query if number % slow_every == 0 else FAST_QUERY)
+            result.fetchall()
+        if number % slow_every:
+            latencies.append(time.perf_counter() - arrival)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(handler(number) for number in range(1, requests + 1)))
+    elapsed = time.perf_counter() - started
+    await engine.dispose()
+    return summary("AsyncSession", latencies, elapsed)
+
+
+async def main(args):
+    backend = make_url(args.uri).get_backend_name()
+    slow_query = SLOW_QUERIES[backend]
+    results = [
+        await run_sync(args.uri, slow_query, args.requests, args.rate, args.concurrency, args.slow_every),
+        await run_async(args.uri, slow_query, args.requests, args.rate, args.concurrency, args.slow_every),
+    ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default="sqlite:///./bench.db", help="sync database URI")
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--rate", type=float, default=200, help="arrivals per second")
+    parser.add_argument("--concurrency", type=int, default=20, help="connection pool size")
+    parser.add_argument("--slow-every", type=int, default=10)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,103 @@
+"""
+Per-row cost of serving a contact list, before and after the fast path.
+
+Loads one page of contacts the way GET /api/contacts/ does and serializes it, in two ways:
+"orm" hydrates Contact objects and validates them through List[ContactResponse] before encoding
+with the json module (what FastAPI does with response_model); "rows" selects only the
+ContactResponse columns and encodes the plain rows with orjson (settings.contacts_fast_path).
+Query and serialization are timed separately and reported per row in microseconds.
+
+Usage:
+    python -m benchmarks.bench_serialization --uri sqlite:///./bench.db --contacts 1000 --limit 200 --repeat 200
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from datetime import date, timedelta
+from typing import List
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from src.database.db import get_async_uri
+from src.database.models import Base, Contact, User
+from src.repository.contacts import get_contacts
+from src.schemas import ContactResponse
+from src.services.response_cache import ResponseCache
+
+
+def seed(uri: str, contacts: int) -> None:
+    """
+    The seed function recreates the tables and inserts one user with the given number of contacts.
+
+    :param uri: str: Sync database URI
+    :param contacts: int: The number of contacts
+    :return: None
+    """
+    engine = create_engine(uri)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(insert(User), [{"id": 1, "username": "bench", "email": "bench@example.com",
+                                           "password": "x", "confirmed": True}])
+        connection.execute(insert(Contact), [
+            {"first_name": f"First{i}", "last_name": f"Last{i}", "email": f"contact{i}@example.com",
+             "phone": f"+380{i:09d}", "birthday": date(1990, 1, 1) + timedelta(days=i % 365),
+             "description": "benchmark contact", "user_id": 1}
+            for i in range(contacts)
+        ])
+    engine.dispose()
+
+
+async def measure(uri: str, limit: int, repeat: int, rows: bool) -> dict:
+    """
+    The measure function loads and serializes one page repeat times.
+
+    :param uri: str: Sync database URI
+    :param limit: int: The page size
+    :param repeat: int: How many times the page is served
+    :param rows: bool: Use the fast path
+    :return: A dict with the median query and serialization time per row in microseconds
+    """
+    engine = create_async_engine(get_async_uri(uri))
+    session = async_sessionmaker(engine, expire_on_commit=False)
+    user = User(id=1)
+    query, serialize = [], []
+    async with session() as db:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            contacts = await get_contacts(limit, 0, user, db, rows=rows)
+            loaded = time.perf_counter()
+            response = ResponseCache.render(List[ContactResponse], contacts, trusted=rows)
+            done = time.perf_counter()
+            query.append(loaded - start)
+            serialize.append(done - loaded)
+            db.expunge_all()
+    await engine.dispose()
+    per_row = 1_000_000 / len(contacts)
+    return {
+        "path": "rows+orjson" if rows else "orm+pydantic",
+        "rows": len(contacts),
+        "bytes": len(response.body),
+        "query_us_per_row": round(statistics.median(query) * per_row, 2),
+        "serialize_us_per_row": round(statistics.median(serialize) * per_row, 2),
+        "total_us_per_row": round((statistics.median(query) + statistics.median(serialize)) * per_row, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default="sqlite:///./bench.db", help="sync database URI; the tables are recreated")
+    parser.add_argument("--contacts", type=int, default=1000)
+    parser.add_argument("--limit", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+    seed(args.uri, args.contacts)
+    results = [asyncio.run(measure(args.uri, args.limit, args.repeat, rows)) for rows in (False, True)]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+Outbound email worker.
+
+Drains the Redis Stream that the API appends email jobs to (see src.services.email_queue)
+and sends them through the pooled SMTP sender. Run as many workers as needed; each one
+needs its own consumer name.
+
+Usage:
+    python email_worker.py --consumer worker-1 --concurrency 4
+"""
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import socket
+
+from src.conf.config import settings
+from src.services.email_queue import email_queue
+from src.services.resources import resources
+
+
+async def run(consumer: str, concurrency: int) -> None:
+    """
+    The run function drains the queue until the process gets SIGINT or SIGTERM,
+        then finishes the current batch and closes the SMTP and Redis connections.
+
+    :param consumer: str: The name of this worker in the consumer group
+    :param concurrency: int: The maximum number of emails sent at once
+    :return: None
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await email_queue.run(consumer, concurrency, stop)
+    finally:
+        await resources.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--consumer", default=f"{socket.gethostname()}-{os.getpid()}")
+    parser.add_argument("--concurrency", type=int, default=settings.email_worker_concurrency)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run(args.consumer, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
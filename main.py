@@ -1,16 +1,44 @@
+import os
 import time
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, Depends, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
-from sqlalchemy.orm import Session
+from fastapi.responses import HTMLResponse, PlainTextResponse
+from fastapi.staticfiles import StaticFiles
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 
-from src.database.db import get_db
+from src.conf.config import settings
+from src.database.db import get_db, get_pool_stats, replica_router
 from src.routes import contacts, auth, users
+from src.services.auth import auth_service
+from src.services.email import mailer
+from src.services.email_queue import email_queue
+from src.services.metrics import http_metrics, render_stats
+from src.services.rate_limit import rate_limiter
+from src.services.resources import resources
+from src.services.response_cache import response_cache
+from src.services.sessions import session_store
+from src.services.upload_limit import UploadLimitMiddleware
+from src.services.workers import image_pool, password_pool, upload_pool
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    The lifespan function warms up the shared resources before the first request
+        and closes them when the server stops.
+
+    :param app: FastAPI: The application
+    :return: An async context manager
+    """
+    await resources.startup()
+    yield
+    await resources.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "http://localhost:3000"
@@ -23,25 +51,51 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(UploadLimitMiddleware, limits={"/api/users/avatar": settings.avatar_max_bytes})
+
+if settings.avatar_storage == "local":
+    os.makedirs(settings.avatar_local_dir, exist_ok=True)
+    app.mount(settings.avatar_local_url, StaticFiles(directory=settings.avatar_local_dir), name="avatars")
+
 
 @app.middleware("http")
 async def add_process_time_header(request: Request, call_next):
     """
     The add_process_time_header function adds a header to the response; that contains the time it took for this function to run.
-    
-    
+    It also records the request in http_metrics, labelled by the route template rather than the raw path.
+
     :param request: Request: Get the request object
     :param call_next: Pass the request to the next middleware in line
     :return: A response object
     """
-    start_time = time.time()
-    print(request.client)
-    response = await call_next(request)
-    process_time = time.time() - start_time
+    start_time = time.perf_counter()
+    method = request.method
+    request_size = int(request.headers.get("content-length") or 0)
+    http_metrics.started(method)
+    try:
+        response = await call_next(request)
+    except Exception:
+        http_metrics.finished(method, route_template(request), 500, time.perf_counter() - start_time, request_size)
+        raise
+    process_time = time.perf_counter() - start_time
+    route = route_template(request)
+    http_metrics.finished(method, route, response.status_code, process_time, request_size)
+    response.body_iterator = http_metrics.count_body(method, route, response.body_iterator)
     response.headers["performance"] = str(process_time)
     return response
 
 
+def route_template(request: Request) -> str:
+    """
+    The route_template function returns the path template of the route that handled the request.
+
+    :param request: Request: The request object
+    :return: The template, e.g. /api/contacts/{contact_id}, or "unmatched"
+    """
+    route = request.scope.get("route")
+    return getattr(route, "path", "unmatched")
+
+
 @app.get("/")
 def read_root():
     """
@@ -54,17 +108,18 @@ def read_root():
 
 
 @app.get("/api/healthchecker")
-def healthchecker(db: Session = Depends(get_db)):
+async def healthchecker(db: AsyncSession = Depends(get_db)):
     """
     The healthchecker function is used to check the health of the database.
     It will return a message if it can successfully connect to the database, or an error otherwise.
     
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: A dict with a message key
     """
     try:
         # Make request
-        result = db.execute(text("SELECT 1")).fetchone()
+        result = await db.execute(text("SELECT 1"))
+        result = result.fetchone()
         if result is None:
             raise HTTPException(
                 status_code=500, detail="Database is not configured correctly")
@@ -75,6 +130,62 @@ def healthchecker(db: Session = Depends(get_db)):
             status_code=500, detail="Error connecting to the database")
 
 
+@app.get("/api/healthchecker/pool")
+def pool_stats():
+    """
+    The pool_stats function reports the state of the database connection pool:
+        connections checked out, overflow in use, checkout wait time histogram and timeouts.
+
+    :return: A dict of pool statistics
+    """
+    return get_pool_stats()
+
+
+@app.get("/api/healthchecker/replicas")
+def replica_stats():
+    """
+    The replica_stats function reports the health and lag of every read replica and how reads were routed.
+
+    :return: A dict of routing counters and replica states
+    """
+    return replica_router.stats()
+
+
+@app.get("/api/healthchecker/startup")
+def startup_stats():
+    """
+    The startup_stats function reports how long startup took and how long every warm-up job ran.
+
+    :return: A dict of timings in seconds
+    """
+    return resources.stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def metrics():
+    """
+    The metrics function exposes the request metrics together with the pool and cache statistics
+        in the Prometheus text format.
+
+    :return: The metrics as plain text
+    """
+    lines = http_metrics.render()
+    lines += render_stats("db_pool", get_pool_stats())
+    lines += render_stats("db_replicas", replica_router.stats())
+    lines += render_stats("password_pool", password_pool.stats())
+    lines += render_stats("image_pool", image_pool.stats())
+    lines += render_stats("upload_pool", upload_pool.stats())
+    lines += render_stats("user_cache", auth_service.user_cache_stats())
+    lines += render_stats("token_cache", auth_service.token_cache_stats())
+    lines += render_stats("response_cache", response_cache.stats())
+    lines += render_stats("email", mailer.stats())
+    lines += render_stats("email_queue", email_queue.stats())
+    lines += render_stats("rate_limit", rate_limiter.stats())
+    lines += render_stats("sessions", session_store.stats())
+    lines += render_stats("startup", resources.stats())
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+
 app.include_router(contacts.router, prefix="/api")
 app.include_router(auth.router, prefix='/api')
 app.include_router(users.router, prefix='/api')
@@ -0,0 +1,34 @@
+"""birthday_md
+
+Revision ID: b3f1c2d4e5a6
+Revises: 91dcdeb6873a
+Create Date: 2026-10-17 10:12:31.204118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3f1c2d4e5a6'
+down_revision = '91dcdeb6873a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('contacts', sa.Column('birthday_md', sa.SmallInteger(), nullable=True))
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("UPDATE contacts SET birthday_md = "
+                   "EXTRACT(MONTH FROM birthday) * 100 + EXTRACT(DAY FROM birthday) "
+                   "WHERE birthday IS NOT NULL")
+    else:
+        op.execute("UPDATE contacts SET birthday_md = "
+                   "CAST(strftime('%m', birthday) AS INTEGER) * 100 + CAST(strftime('%d', birthday) AS INTEGER) "
+                   "WHERE birthday IS NOT NULL")
+    op.create_index('ix_contacts_user_id_birthday_md', 'contacts', ['user_id', 'birthday_md'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_contacts_user_id_birthday_md', table_name='contacts')
+    op.drop_column('contacts', 'birthday_md')
@@ -0,0 +1,62 @@
+"""contact_search
+
+Revision ID: c7a9e2f0b1d3
+Revises: b3f1c2d4e5a6
+Create Date: 2026-10-17 11:40:05.518733
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7a9e2f0b1d3'
+down_revision = 'b3f1c2d4e5a6'
+branch_labels = None
+depends_on = None
+
+TRGM_INDEXES = {
+    'ix_contacts_first_name_trgm': 'lower(first_name) gin_trgm_ops',
+    'ix_contacts_last_name_trgm': 'lower(last_name) gin_trgm_ops',
+    'ix_contacts_email_trgm': 'lower(email) gin_trgm_ops',
+    'ix_contacts_phone_trgm': 'phone gin_trgm_ops',
+}
+
+SQLITE_FTS = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS contacts_fts USING fts5("
+    "first_name, last_name, email, phone, content='contacts', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS contacts_fts_ai AFTER INSERT ON contacts BEGIN "
+    "INSERT INTO contacts_fts(rowid, first_name, last_name, email, phone) "
+    "VALUES (new.id, new.first_name, new.last_name, new.email, new.phone); END",
+    "CREATE TRIGGER IF NOT EXISTS contacts_fts_ad AFTER DELETE ON contacts BEGIN "
+    "INSERT INTO contacts_fts(contacts_fts, rowid, first_name, last_name, email, phone) "
+    "VALUES ('delete', old.id, old.first_name, old.last_name, old.email, old.phone); END",
+    "CREATE TRIGGER IF NOT EXISTS contacts_fts_au AFTER UPDATE ON contacts BEGIN "
+    "INSERT INTO contacts_fts(contacts_fts, rowid, first_name, last_name, email, phone) "
+    "VALUES ('delete', old.id, old.first_name, old.last_name, old.email, old.phone); "
+    "INSERT INTO contacts_fts(rowid, first_name, last_name, email, phone) "
+    "VALUES (new.id, new.first_name, new.last_name, new.email, new.phone); END",
+    "INSERT INTO contacts_fts(contacts_fts) VALUES ('rebuild')",
+]
+
+
+def upgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        for name, expression in TRGM_INDEXES.items():
+            op.execute(f"CREATE INDEX IF NOT EXISTS {name} ON contacts USING gin ({expression})")
+    elif dialect == 'sqlite':
+        for statement in SQLITE_FTS:
+            op.execute(statement)
+
+
+def downgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        for name in TRGM_INDEXES:
+            op.execute(f"DROP INDEX IF EXISTS {name}")
+    elif dialect == 'sqlite':
+        for trigger in ('contacts_fts_ai', 'contacts_fts_ad', 'contacts_fts_au'):
+            op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        op.execute("DROP TABLE IF EXISTS contacts_fts")
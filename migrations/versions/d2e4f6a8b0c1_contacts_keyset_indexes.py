@@ -0,0 +1,28 @@
+"""contacts_keyset_indexes
+
+Revision ID: d2e4f6a8b0c1
+Revises: c7a9e2f0b1d3
+Create Date: 2026-10-17 12:31:47.902114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2e4f6a8b0c1'
+down_revision = 'c7a9e2f0b1d3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_contacts_user_id_id', 'contacts', ['user_id', 'id'], unique=False)
+    op.create_index('ix_contacts_user_id_first_name_id', 'contacts', ['user_id', 'first_name', 'id'], unique=False)
+    op.create_index('ix_contacts_user_id_last_name_id', 'contacts', ['user_id', 'last_name', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_contacts_user_id_last_name_id', table_name='contacts')
+    op.drop_index('ix_contacts_user_id_first_name_id', table_name='contacts')
+    op.drop_index('ix_contacts_user_id_id', table_name='contacts')
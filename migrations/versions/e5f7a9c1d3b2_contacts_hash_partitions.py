@@ -0,0 +1,185 @@
+"""contacts_hash_partitions
+
+Revision ID: e5f7a9c1d3b2
+Revises: d2e4f6a8b0c1
+Create Date: 2026-10-17 15:02:36.417805
+
+On Postgres contacts becomes a table partitioned by hash of user_id into PARTITIONS partitions, so every
+query of one user touches one partition and its indexes. The count is part of this revision, not of the
+application settings, so the revision always builds the same schema; a deployment that needs another one
+passes it once, as in `alembic -x partitions=32 upgrade head` (the batch size likewise, -x backfill_batch=N).
+The conversion runs online: the partitioned table is created next to contacts and a trigger mirrors every
+write into it, the existing rows are copied in batches of BACKFILL_BATCH rows, each batch
+its own transaction, and only the final swap locks contacts, for as long as a rename takes. An interrupted
+backfill can be started again, it skips the rows already copied.
+
+Unique keys of a partitioned table must include the partition key: the primary key becomes (id, user_id),
+and the email is unique per user instead of globally (on SQLite as well, where nothing else changes).
+Contacts without a user cannot be placed in a partition, the migration stops if there are any.
+"""
+import logging
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5f7a9c1d3b2'
+down_revision = 'd2e4f6a8b0c1'
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+PARTITIONS = 16
+BACKFILL_BATCH = 10000
+
+COLUMNS = ('id', 'first_name', 'last_name', 'email', 'phone', 'birthday', 'description', 'created_at',
+           'updated_at', 'user_id', 'birthday_md')
+
+INDEXES = {
+    'ix_contacts_id': '(id)',
+    'ix_contacts_first_name': '(first_name)',
+    'ix_contacts_last_name': '(last_name)',
+    'ix_contacts_email': '(email)',
+    'ix_contacts_phone': '(phone)',
+    'ix_contacts_user_id_birthday_md': '(user_id, birthday_md)',
+    'ix_contacts_user_id_id': '(user_id, id)',
+    'ix_contacts_user_id_first_name_id': '(user_id, first_name, id)',
+    'ix_contacts_user_id_last_name_id': '(user_id, last_name, id)',
+    'ix_contacts_first_name_trgm': 'USING gin (lower(first_name) gin_trgm_ops)',
+    'ix_contacts_last_name_trgm': 'USING gin (lower(last_name) gin_trgm_ops)',
+    'ix_contacts_email_trgm': 'USING gin (lower(email) gin_trgm_ops)',
+    'ix_contacts_phone_trgm': 'USING gin (phone gin_trgm_ops)',
+}
+
+MIRROR = """
+CREATE OR REPLACE FUNCTION contacts_mirror() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    DELETE FROM contacts_partitioned WHERE id = OLD.id AND user_id = OLD.user_id;
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    INSERT INTO contacts_partitioned SELECT NEW.* ON CONFLICT (id, user_id) DO UPDATE SET {updates};
+  END IF;
+  RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+"""
+
+
+def option(name: str, default: int) -> int:
+    """
+    The option function reads an integer passed to alembic as -x name=value.
+
+    :param name: str: The name of the option
+    :param default: int: The value without the option
+    :return: The value
+    """
+    return int(context.get_x_argument(as_dictionary=True).get(name, default))
+
+
+def prepare(partitions: int) -> None:
+    """
+    The prepare function creates the partitioned table, its partitions and indexes, and the trigger
+        that mirrors writes to contacts into it from now on.
+
+    :param partitions: int: The number of hash partitions
+    :return: None
+    """
+    orphans = op.get_bind().execute(sa.text("SELECT count(*) FROM contacts WHERE user_id IS NULL")).scalar()
+    if orphans:
+        raise RuntimeError(f"{orphans} contacts have no user_id; delete or assign them before partitioning")
+    op.execute("CREATE TABLE IF NOT EXISTS contacts_partitioned (LIKE contacts INCLUDING DEFAULTS, "
+               "CONSTRAINT contacts_partitioned_pkey PRIMARY KEY (id, user_id), "
+               "CONSTRAINT contacts_partitioned_user_id_fkey FOREIGN KEY (user_id) "
+               "REFERENCES users (id) ON DELETE CASCADE) PARTITION BY HASH (user_id)")
+    for remainder in range(partitions):
+        op.execute(f"CREATE TABLE IF NOT EXISTS contacts_p{remainder} PARTITION OF contacts_partitioned "
+                   f"FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})")
+    op.execute("CREATE UNIQUE INDEX IF NOT EXISTS contacts_partitioned_uq_user_id_email "
+               "ON contacts_partitioned (user_id, email)")
+    for name, definition in INDEXES.items():
+        op.execute(f"CREATE INDEX IF NOT EXISTS contacts_partitioned_{name} ON contacts_partitioned {definition}")
+    updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in COLUMNS)
+    op.execute(MIRROR.format(updates=updates))
+    op.execute("DROP TRIGGER IF EXISTS contacts_mirror ON contacts")
+    op.execute("CREATE TRIGGER contacts_mirror AFTER INSERT OR UPDATE OR DELETE ON contacts "
+               "FOR EACH ROW EXECUTE FUNCTION contacts_mirror()")
+
+
+def backfill(batch_size: int) -> None:
+    """
+    The backfill function copies the rows that existed before the trigger, one id range per statement.
+        FOR SHARE makes a concurrent update or delete of a row wait until its batch is committed,
+        so the trigger then finds the copy; rows the trigger already copied are skipped.
+
+    :param batch_size: int: The width of an id range
+    :return: None
+    """
+    bind = op.get_bind()
+    low, high = bind.execute(sa.text("SELECT min(id), max(id) FROM contacts")).one()
+    if low is None:
+        return
+    columns = ", ".join(COLUMNS)
+    copy = sa.text(f"INSERT INTO contacts_partitioned ({columns}) SELECT {columns} FROM contacts "
+                   f"WHERE id >= :start AND id < :stop FOR SHARE ON CONFLICT DO NOTHING")
+    for start in range(low, high + 1, batch_size):
+        bind.execute(copy, {"start": start, "stop": start + batch_size})
+        logger.info("contacts backfill: ids up to %s of %s", min(start + batch_size - 1, high), high)
+
+
+def swap() -> None:
+    """
+    The swap function replaces contacts with the partitioned copy and gives its objects the usual names.
+
+    :return: None
+    """
+    op.execute("LOCK TABLE contacts IN ACCESS EXCLUSIVE MODE")
+    op.execute("DROP TRIGGER contacts_mirror ON contacts")
+    op.execute("DROP FUNCTION contacts_mirror()")
+    op.execute("ALTER SEQUENCE contacts_id_seq OWNED BY contacts_partitioned.id")
+    op.execute("DROP TABLE contacts")
+    op.execute("ALTER TABLE contacts_partitioned RENAME TO contacts")
+    op.execute("ALTER TABLE contacts RENAME CONSTRAINT contacts_partitioned_pkey TO contacts_pkey")
+    op.execute("ALTER TABLE contacts RENAME CONSTRAINT contacts_partitioned_user_id_fkey TO contacts_user_id_fkey")
+    op.execute("ALTER INDEX contacts_partitioned_uq_user_id_email RENAME TO uq_contacts_user_id_email")
+    for name in INDEXES:
+        op.execute(f"ALTER INDEX contacts_partitioned_{name} RENAME TO {name}")
+    op.execute("ANALYZE contacts")
+
+
+def upgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        prepare(option('partitions', PARTITIONS))
+        with op.get_context().autocommit_block():
+            backfill(option('backfill_batch', BACKFILL_BATCH))
+        swap()
+    else:
+        op.drop_index('ix_contacts_email', table_name='contacts')
+        op.create_index('ix_contacts_email', 'contacts', ['email'], unique=False)
+        op.create_index('uq_contacts_user_id_email', 'contacts', ['user_id', 'email'], unique=True)
+
+
+def downgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        # back to a single heap in one transaction; fails if two users now have a contact with the same email
+        columns = ", ".join(COLUMNS)
+        op.execute("CREATE TABLE contacts_heap (LIKE contacts INCLUDING DEFAULTS)")
+        op.execute(f"INSERT INTO contacts_heap ({columns}) SELECT {columns} FROM contacts")
+        op.execute("ALTER SEQUENCE contacts_id_seq OWNED BY contacts_heap.id")
+        op.execute("DROP TABLE contacts")
+        op.execute("ALTER TABLE contacts_heap RENAME TO contacts")
+        op.execute("ALTER TABLE contacts ALTER COLUMN user_id DROP NOT NULL")
+        op.execute("ALTER TABLE contacts ADD CONSTRAINT contacts_pkey PRIMARY KEY (id)")
+        op.execute("ALTER TABLE contacts ADD CONSTRAINT contacts_user_id_fkey FOREIGN KEY (user_id) "
+                   "REFERENCES users (id) ON DELETE CASCADE")
+        for name, definition in INDEXES.items():
+            unique = "UNIQUE " if name == 'ix_contacts_email' else ""
+            op.execute(f"CREATE {unique}INDEX {name} ON contacts {definition}")
+    else:
+        op.drop_index('uq_contacts_user_id_email', table_name='contacts')
+        op.drop_index('ix_contacts_email', table_name='contacts')
+        op.create_index('ix_contacts_email', 'contacts', ['email'], unique=True)
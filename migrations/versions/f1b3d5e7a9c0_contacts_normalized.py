@@ -0,0 +1,131 @@
+"""contacts_normalized
+
+Revision ID: f1b3d5e7a9c0
+Revises: e5f7a9c1d3b2
+Create Date: 2026-10-17 16:48:09.331527
+
+Adds phone_normalized (E.164) and email_normalized (lower case) to contacts, fills them for the existing rows
+in batches of BATCH_SIZE (each its own transaction on Postgres) and indexes them together with user_id
+for exact lookups and duplicate detection.
+
+The normalization is a frozen copy of normalize_phone and normalize_email in src.database.models as they were
+when this revision was written, so a later change there does not change what this revision does. National
+numbers get COUNTRY_CODE; another one, or another batch size, can be given at upgrade time, as in
+`alembic -x country_code=48 -x backfill_batch=5000 upgrade head`.
+"""
+import re
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1b3d5e7a9c0'
+down_revision = 'e5f7a9c1d3b2'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 10000
+COUNTRY_CODE = '380'
+NON_DIGITS = re.compile(r"\D")
+
+INDEXES = {
+    'ix_contacts_user_id_phone_normalized': ['user_id', 'phone_normalized'],
+    'ix_contacts_user_id_email_normalized': ['user_id', 'email_normalized'],
+}
+
+
+def normalize_phone(phone: str | None, country_code: str) -> str | None:
+    """
+    The normalize_phone function writes a phone number in E.164 form, e.g. "(063) 123-45-67" becomes +380631234567.
+
+    :param phone: str | None: The phone number as entered
+    :param country_code: str: The country code of national numbers
+    :return: The E.164 number, or None if there are not 8 to 15 digits
+    """
+    if not phone:
+        return None
+    digits = NON_DIGITS.sub("", phone)
+    international = phone.lstrip().startswith("+")
+    if not international and digits.startswith("00"):
+        digits, international = digits[2:], True
+    if not international and not (digits.startswith(country_code) and len(digits) > len(country_code) + 8):
+        digits = country_code + digits.removeprefix("0")
+    return f"+{digits}" if 8 <= len(digits) <= 15 else None
+
+
+def normalize_email(email: str | None) -> str | None:
+    return email.strip().lower() if email else None
+
+
+def update_statement(dialect: str, size: int) -> tuple[sa.TextClause, bool]:
+    """
+    The update_statement function builds the statement that writes the normalized values of one batch.
+        On Postgres it is a single UPDATE ... FROM (VALUES ...) for the whole batch, joined on the partition
+        key as well, so every row touches one partition; elsewhere one UPDATE per row sent with executemany.
+
+    :param dialect: str: The name of the database dialect
+    :param size: int: The number of rows in the batch
+    :return: The statement, and whether it takes the whole batch as one set of parameters
+    """
+    if dialect != 'postgresql':
+        return sa.text("UPDATE contacts SET phone_normalized = :phone, email_normalized = :email WHERE id = :id"), False
+    # the first row carries the types, the NULLs of the others would not
+    values = ", ".join(
+        f"(CAST(:id_{n} AS integer), CAST(:user_id_{n} AS integer), CAST(:phone_{n} AS varchar), "
+        f"CAST(:email_{n} AS varchar))" if n == 0 else f"(:id_{n}, :user_id_{n}, :phone_{n}, :email_{n})"
+        for n in range(size))
+    return sa.text("UPDATE contacts SET phone_normalized = v.phone, email_normalized = v.email "
+                   f"FROM (VALUES {values}) AS v(id, user_id, phone, email) "
+                   "WHERE contacts.id = v.id AND contacts.user_id = v.user_id"), True
+
+
+def backfill(batch_size: int, country_code: str) -> None:
+    """
+    The backfill function normalizes the phone and email of every contact, walking the table by id,
+        one statement per batch on Postgres.
+
+    :param batch_size: int: The number of rows per batch
+    :param country_code: str: The country code of national numbers
+    :return: None
+    """
+    bind = op.get_bind()
+    select = sa.text("SELECT id, user_id, phone, email FROM contacts WHERE id > :last ORDER BY id LIMIT :size")
+    statements = {}
+    last = 0
+    while True:
+        rows = bind.execute(select, {"last": last, "size": batch_size}).all()
+        if not rows:
+            break
+        if len(rows) not in statements:
+            statements[len(rows)] = update_statement(bind.dialect.name, len(rows))
+        update, batched = statements[len(rows)]
+        values = [{"id": id_, "user_id": user_id, "phone": normalize_phone(phone, country_code),
+                   "email": normalize_email(email)} for id_, user_id, phone, email in rows]
+        if batched:
+            bind.execute(update, {f"{name}_{n}": value for n, row in enumerate(values) for name, value in row.items()})
+        else:
+            bind.execute(update, values)
+        last = rows[-1].id
+
+
+def upgrade() -> None:
+    options = context.get_x_argument(as_dictionary=True)
+    batch_size = int(options.get('backfill_batch', BATCH_SIZE))
+    country_code = options.get('country_code', COUNTRY_CODE)
+    op.add_column('contacts', sa.Column('phone_normalized', sa.String(), nullable=True))
+    op.add_column('contacts', sa.Column('email_normalized', sa.String(), nullable=True))
+    if op.get_bind().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            backfill(batch_size, country_code)
+    else:
+        backfill(batch_size, country_code)
+    for name, columns in INDEXES.items():
+        op.create_index(name, 'contacts', columns, unique=False)
+
+
+def downgrade() -> None:
+    for name in INDEXES:
+        op.drop_index(name, table_name='contacts')
+    op.drop_column('contacts', 'email_normalized')
+    op.drop_column('contacts', 'phone_normalized')
@@ -1,24 +1,170 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, DateTime, func, Date
-from sqlalchemy.orm import relationship, declarative_base
+import re
+from datetime import date, datetime
+
+from sqlalchemy import Boolean, Column, ForeignKey, Integer, SmallInteger, String, DateTime, func, Date, Index, DDL, event
+from sqlalchemy.orm import relationship, declarative_base, validates
+
+from src.conf.config import settings
 
 Base = declarative_base()
 
 
+def birthday_key(birthday: date | None) -> int | None:
+    """
+    The birthday_key function encodes the month and day of a birthday as one sortable integer (MMDD).
+        The 12th of December becomes 1212, the 29th of February becomes 229.
+
+    :param birthday: date | None: The birthday
+    :return: The month * 100 + day, or None if there is no birthday
+    """
+    if birthday is None:
+        return None
+    return birthday.month * 100 + birthday.day
+
+
+# migration f1b3d5e7a9c0 backfilled the existing rows with its own frozen copy of these two functions
+NON_DIGITS = re.compile(r"\D")
+
+
+def normalize_phone(phone: str | None, country_code: str | None = None) -> str | None:
+    """
+    The normalize_phone function writes a phone number in E.164 form, e.g. "(063) 123-45-67" becomes +380631234567.
+        Numbers starting with + or 00 keep their country code, numbers starting with the country code digits
+        get a +, other numbers are national: the trunk 0 is dropped and settings.phone_country_code is added.
+
+    :param phone: str | None: The phone number as entered
+    :param country_code: str | None: The country code of national numbers, settings.phone_country_code by default
+    :return: The E.164 number, or None if there are not 8 to 15 digits
+    """
+    if not phone:
+        return None
+    country_code = country_code or settings.phone_country_code
+    digits = NON_DIGITS.sub("", phone)
+    international = phone.lstrip().startswith("+")
+    if not international and digits.startswith("00"):
+        digits, international = digits[2:], True
+    if not international and not (digits.startswith(country_code) and len(digits) > len(country_code) + 8):
+        digits = country_code + digits.removeprefix("0")
+    return f"+{digits}" if 8 <= len(digits) <= 15 else None
+
+
+def normalize_email(email: str | None) -> str | None:
+    """
+    The normalize_email function lower-cases an email address and strips the spaces around it.
+
+    :param email: str | None: The email address
+    :return: The normalized address, or None
+    """
+    return email.strip().lower() if email else None
+
+
 class Contact(Base):
     __tablename__ = "contacts"
 
     id = Column(Integer, primary_key=True, index=True)
     first_name = Column(String, index=True)
     last_name = Column(String, index=True)
-    email = Column(String, unique=True, index=True)
+    email = Column(String, index=True)
     phone = Column(String, index=True)
+    # kept in step with phone and email by the validators below, for exact lookups and duplicate detection
+    phone_normalized = Column(String, nullable=True)
+    email_normalized = Column(String, nullable=True)
     birthday = Column(Date)
+    birthday_md = Column(SmallInteger, nullable=True)
     description = Column(String, nullable=True)
-    created_at = Column(DateTime, default=func.now())
-    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    # stamped in Python, in UTC, on insert and update alike: list ETags compare max(updated_at), so inserts and
+    # updates must use one clock (CURRENT_TIMESTAMP is also only one-second resolution on SQLite)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     user_id = Column('user_id', ForeignKey('users.id', ondelete='CASCADE'), default=None)
     user = relationship('User', backref="contacts")
 
+    __table_args__ = (
+        # on Postgres contacts is hash partitioned on user_id, so unique keys must include it
+        Index('uq_contacts_user_id_email', 'user_id', 'email', unique=True),
+        Index('ix_contacts_user_id_birthday_md', 'user_id', 'birthday_md'),
+        Index('ix_contacts_user_id_id', 'user_id', 'id'),
+        Index('ix_contacts_user_id_first_name_id', 'user_id', 'first_name', 'id'),
+        Index('ix_contacts_user_id_last_name_id', 'user_id', 'last_name', 'id'),
+        Index('ix_contacts_user_id_phone_normalized', 'user_id', 'phone_normalized'),
+        Index('ix_contacts_user_id_email_normalized', 'user_id', 'email_normalized'),
+        Index('ix_contacts_first_name_trgm', func.lower(first_name).label('first_name_lower'),
+              postgresql_using='gin', postgresql_ops={'first_name_lower': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+        Index('ix_contacts_last_name_trgm', func.lower(last_name).label('last_name_lower'),
+              postgresql_using='gin', postgresql_ops={'last_name_lower': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+        Index('ix_contacts_email_trgm', func.lower(email).label('email_lower'),
+              postgresql_using='gin', postgresql_ops={'email_lower': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+        Index('ix_contacts_phone_trgm', phone,
+              postgresql_using='gin', postgresql_ops={'phone': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+    )
+    # the ORM identifies a contact by (id, user_id), so its UPDATE and DELETE statements prune to one partition
+    __mapper_args__ = {'primary_key': [id, user_id]}
+
+    @validates('birthday')
+    def validate_birthday(self, key, birthday):
+        """
+        The validate_birthday function keeps birthday_md in step with birthday on every ORM write.
+
+        :param self: Represent the instance of the class
+        :param key: The name of the attribute
+        :param birthday: The new birthday
+        :return: The birthday unchanged
+        """
+        self.birthday_md = birthday_key(birthday)
+        return birthday
+
+    @validates('phone')
+    def validate_phone(self, key, phone):
+        """
+        The validate_phone function keeps phone_normalized in step with phone on every ORM write.
+
+        :param self: Represent the instance of the class
+        :param key: The name of the attribute
+        :param phone: The new phone number
+        :return: The phone number unchanged
+        """
+        self.phone_normalized = normalize_phone(phone)
+        return phone
+
+    @validates('email')
+    def validate_email(self, key, email):
+        """
+        The validate_email function keeps email_normalized in step with email on every ORM write.
+
+        :param self: Represent the instance of the class
+        :param key: The name of the attribute
+        :param email: The new email
+        :return: The email unchanged
+        """
+        self.email_normalized = normalize_email(email)
+        return email
+
+
+# SQLite has no trigram indexes; an external-content FTS5 table with the trigram tokenizer,
+# kept in sync by triggers, plays their part for contact search.
+CONTACTS_FTS_CREATE = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS contacts_fts USING fts5("
+    "first_name, last_name, email, phone, content='contacts', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS contacts_fts_ai AFTER INSERT ON contacts BEGIN "
+    "INSERT INTO contacts_fts(rowid, first_name, last_name, email, phone) "
+    "VALUES (new.id, new.first_name, new.last_name, new.email, new.phone); END",
+    "CREATE TRIGGER IF NOT EXISTS contacts_fts_ad AFTER DELETE ON contacts BEGIN "
+    "INSERT INTO contacts_fts(contacts_fts, rowid, first_name, last_name, email, phone) "
+    "VALUES ('delete', old.id, old.first_name, old.last_name, old.email, old.phone); END",
+    "CREATE TRIGGER IF NOT EXISTS contacts_fts_au AFTER UPDATE ON contacts BEGIN "
+    "INSERT INTO contacts_fts(contacts_fts, rowid, first_name, last_name, email, phone) "
+    "VALUES ('delete', old.id, old.first_name, old.last_name, old.email, old.phone); "
+    "INSERT INTO contacts_fts(rowid, first_name, last_name, email, phone) "
+    "VALUES (new.id, new.first_name, new.last_name, new.email, new.phone); END",
+]
+CONTACTS_FTS_DROP = "DROP TABLE IF EXISTS contacts_fts"
+
+event.listen(Contact.__table__, 'before_create',
+             DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect='postgresql'))
+for statement in CONTACTS_FTS_CREATE:
+    event.listen(Contact.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+event.listen(Contact.__table__, 'before_drop', DDL(CONTACTS_FTS_DROP).execute_if(dialect='sqlite'))
+
 
 class User(Base):
     __tablename__ = "users"
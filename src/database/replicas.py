@@ -0,0 +1,294 @@
+import asyncio
+import hashlib
+import itertools
+import logging
+import math
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+import redis.asyncio as redis
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.dml import UpdateBase
+
+from src.conf.config import settings
+from src.services.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# the position a standby has replayed up to, and how far behind the primary that is;
+# a standby that has replayed everything it received is not lagging, however old its last transaction
+REPLICA_STATUS = """
+SELECT pg_last_wal_replay_lsn()::text,
+       CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END
+"""
+PRIMARY_LSN = "SELECT pg_current_wal_lsn()::text"
+
+
+def parse_lsn(lsn: str | None) -> int | None:
+    """
+    The parse_lsn function turns a Postgres WAL position such as 16/B374D848 into a comparable integer.
+
+    :param lsn: str | None: The position as Postgres prints it
+    :return: The position as an integer, or None
+    """
+    if not lsn:
+        return None
+    high, low = lsn.split("/")
+    return (int(high, 16) << 32) + int(low, 16)
+
+
+@dataclass
+class Replica:
+    """
+    A read replica and what the last health check found: whether it answered, how many seconds
+    it lags behind the primary and the WAL position it has replayed (Postgres only).
+    """
+    name: str
+    engine: AsyncEngine
+    healthy: bool = False
+    lag: float | None = None
+    lsn: int | None = None
+    checked_at: float = 0.0
+    failures: int = 0
+    reads: int = 0
+
+
+class ReplicaRouter:
+    """
+    Sends the sessions of safe (GET) requests to a healthy replica that lags less than settings.db_replica_max_lag,
+    everything else to the primary. A client that committed a write is pinned to the primary for
+    settings.db_replica_pin_seconds, or on Postgres until a replica has replayed the WAL position of that commit,
+    so it reads its own writes. A client is the user its access token was issued to, so the pin holds for every
+    token of that user, including a cache entry another of its tokens fills. Pins are kept in Redis, so a write
+    handled by one worker pins the user on every worker before the response cache is filled from a replica;
+    this process also remembers its own pins, which then need no round trip.
+    Replicas start unhealthy and are checked at startup and then every settings.db_replica_check_interval.
+    """
+
+    def __init__(self, primary: AsyncEngine, replicas: dict[str, AsyncEngine]):
+        """
+        The __init__ function creates the router around the primary engine and the replica engines.
+
+        :param self: Represent the instance of the class
+        :param primary: AsyncEngine: The engine of the primary
+        :param replicas: dict[str, AsyncEngine]: The replica engines by name
+        """
+        self.primary = primary
+        self.replicas = [Replica(name, engine) for name, engine in replicas.items()]
+        self.pins = TTLCache(maxsize=settings.db_replica_pin_size, ttl=settings.db_replica_pin_seconds)
+        self.turn = itertools.count()
+        self.task: asyncio.Task | None = None
+        self.primary_reads = 0
+        self.pinned_reads = 0
+        self.pinned = 0
+        # resolves an access token to its user; set by the auth service, which itself depends on this module
+        self.subject: Callable[[str], str | None] | None = None
+        # the Redis client the pins are shared through; set with the other resources, without it pins stay local
+        self.r: redis.Redis | None = None
+
+    def identity(self, authorization: str | None, host: str | None) -> str:
+        """
+        The identity function names the client a pin belongs to: the user of a valid access token,
+            or the client address without one.
+
+        :param self: Represent the instance of the class
+        :param authorization: str | None: The Authorization header
+        :param host: str | None: The client address
+        :return: A digest, so emails and addresses are not kept in memory
+        """
+        scheme, _, token = (authorization or "").partition(" ")
+        subject = self.subject(token) if self.subject is not None and scheme.lower() == "bearer" and token else None
+        return hashlib.sha1((f"user:{subject}" if subject else f"ip:{host}").encode()).hexdigest()
+
+    @staticmethod
+    def pin_key(identity: str) -> str:
+        return f"replicas:pin:{identity}"
+
+    async def find_pin(self, identity: str) -> float | None:
+        """
+        The find_pin function finds the pin of a client: in this process first, then in Redis.
+            If Redis cannot be asked the client is treated as pinned, reading from the primary is always safe.
+
+        :param self: Represent the instance of the class
+        :param identity: str: The client
+        :return: The WAL position a replica must have replayed (inf: none will do), or None without a pin
+        """
+        pin = self.pins.get(identity)
+        if pin is not None or self.r is None:
+            return pin
+        try:
+            value = await self.r.get(self.pin_key(identity))
+        except redis.RedisError as err:
+            logger.warning("replicas: reading a pin failed, using the primary: %s", err)
+            return math.inf
+        if value is None:
+            return None
+        return math.inf if value in (b"inf", "inf") else int(value)
+
+    def choose(self, method: str, pin: float | None = None) -> Replica | None:
+        """
+        The choose function picks the replica for the session of a request, in turn among the eligible ones.
+
+        :param self: Represent the instance of the class
+        :param method: str: The HTTP method of the request
+        :param pin: float | None: The pin of the client, see find_pin
+        :return: A replica, or None for the primary
+        """
+        if method not in SAFE_METHODS or not self.replicas:
+            return None
+        candidates = [replica for replica in self.replicas
+                      if replica.healthy and replica.lag is not None and replica.lag <= settings.db_replica_max_lag
+                      and (pin is None or (replica.lsn is not None and replica.lsn >= pin))]
+        if not candidates:
+            if pin is not None:
+                self.pinned_reads += 1
+            else:
+                self.primary_reads += 1
+            return None
+        replica = candidates[next(self.turn) % len(candidates)]
+        replica.reads += 1
+        return replica
+
+    async def pin(self, session: AsyncSession) -> None:
+        """
+        The pin function sends the next reads of the session's client to the primary after it committed a write.
+            On Postgres the pin also records the WAL position after the commit, which releases it early
+            once a replica has replayed that far; elsewhere only the time window ends it.
+
+        :param self: Represent the instance of the class
+        :param session: AsyncSession: The session that committed
+        :return: None
+        """
+        identity = session.info.get("identity")
+        if identity is None or not self.replicas:
+            return
+        lsn = math.inf
+        if self.primary.dialect.name == "postgresql":
+            try:
+                result = await session.execute(text(PRIMARY_LSN), bind_arguments={"bind": self.primary.sync_engine})
+                lsn = parse_lsn(result.scalar()) or math.inf
+            except Exception as err:
+                logger.warning("replicas: reading the primary WAL position failed: %s", err)
+        self.pins.set(identity, lsn)
+        self.pinned += 1
+        if self.r is not None:
+            try:
+                await self.r.set(self.pin_key(identity), "inf" if lsn == math.inf else str(lsn),
+                                 px=int(settings.db_replica_pin_seconds * 1000))
+            except redis.RedisError as err:
+                logger.warning("replicas: storing a pin failed, it holds on this worker only: %s", err)
+
+    async def probe(self, replica: Replica) -> None:
+        async with replica.engine.connect() as connection:
+            if connection.dialect.name == "postgresql":
+                lsn, lag = (await connection.execute(text(REPLICA_STATUS))).one()
+                replica.lsn, replica.lag = parse_lsn(lsn), float(lag or 0)
+            else:
+                await connection.execute(text("SELECT 1"))
+                replica.lag = 0.0
+
+    async def check_replica(self, replica: Replica) -> None:
+        """
+        The check_replica function refreshes the health, lag and replayed position of one replica.
+            A replica that does not answer within the check interval is taken out of rotation until it does.
+
+        :param self: Represent the instance of the class
+        :param replica: Replica: The replica
+        :return: None
+        """
+        try:
+            await asyncio.wait_for(self.probe(replica), settings.db_replica_check_interval)
+            if not replica.healthy:
+                logger.info("replicas: %s is healthy, lag %.3fs", replica.name, replica.lag)
+            replica.healthy = True
+        except Exception as err:
+            if replica.healthy:
+                logger.warning("replicas: %s failed its health check: %s", replica.name, err)
+            replica.healthy = False
+            replica.failures += 1
+        replica.checked_at = time.time()
+
+    async def check(self) -> None:
+        await asyncio.gather(*(self.check_replica(replica) for replica in self.replicas))
+
+    async def monitor(self) -> None:
+        while True:
+            await asyncio.sleep(settings.db_replica_check_interval)
+            await self.check()
+
+    def ensure_monitor(self) -> None:
+        """
+        The ensure_monitor function starts the periodic health checks on the running loop, once.
+
+        :param self: Represent the instance of the class
+        :return: None
+        """
+        if self.replicas and (self.task is None or self.task.done()):
+            self.task = asyncio.get_running_loop().create_task(self.monitor())
+
+    async def close(self) -> None:
+        """
+        The close function stops the health checks and closes the replica pools.
+
+        :param self: Represent the instance of the class
+        :return: None
+        """
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        for replica in self.replicas:
+            await replica.engine.dispose()
+
+    def stats(self) -> dict:
+        """
+        The stats function returns the routing counters and the state of every replica.
+
+        :param self: Represent the instance of the class
+        :return: A dict of counters and replica states
+        """
+        return {
+            "primary_reads": self.primary_reads,
+            "pinned_reads": self.pinned_reads,
+            "pins": self.pinned,
+            **{replica.name: {"healthy": replica.healthy, "lag_seconds": replica.lag, "reads": replica.reads,
+                              "failures": replica.failures} for replica in self.replicas},
+        }
+
+
+class RoutingSession(Session):
+    """
+    A Session that asks its router for a bind: flushes and INSERT/UPDATE/DELETE statements always go
+    to the primary, reads go to the replica chosen for the session, if any.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kw):
+        router = self.info.get("router")
+        if bind is not None or router is None:
+            return super().get_bind(mapper, clause=clause, bind=bind, **kw)
+        if self._flushing or isinstance(clause, UpdateBase):
+            self.info["wrote"] = True
+            return router.primary.sync_engine
+        replica = self.info.get("replica")
+        return replica.engine.sync_engine if replica is not None else router.primary.sync_engine
+
+
+class RoutingAsyncSession(AsyncSession):
+    """
+    An AsyncSession over RoutingSession that pins its client to the primary once it commits a write.
+    """
+    sync_session_class = RoutingSession
+
+    async def commit(self) -> None:
+        # an unsafe request writes on the primary, also through the raw connection (COPY) the router does not see
+        unsafe = not self.info.get("safe", True) and self.in_transaction()
+        await super().commit()
+        wrote = self.info.pop("wrote", False) or unsafe
+        router = self.info.get("router")
+        if wrote and router is not None:
+            await router.pin(self)
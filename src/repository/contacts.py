@@ -1,53 +1,361 @@
 from typing import List
 
-from sqlalchemy import and_
-from sqlalchemy.orm import Session
-from datetime import datetime, timedelta
+import base64
+import calendar
+import json
+from datetime import date, datetime, timedelta
+from itertools import groupby
 
-from src.database.models import Contact, User
-from src.schemas import ContactModel
+from sqlalchemy import and_, or_, case, column, func, insert, literal_column, nulls_last, select, table, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from src.database.models import Contact, User, birthday_key, normalize_email, normalize_phone
+from src.schemas import ContactModel, ContactResponse
+from src.conf.config import settings
+from src.services.response_cache import response_cache
 
-async def get_contacts(limit: int, offset: int, user: User, db: Session):
+
+SORT_KEYS = {
+    "id": Contact.id,
+    "first_name": Contact.first_name,
+    "last_name": Contact.last_name,
+    "birthday": Contact.birthday,
+}
+
+
+def _sort_order(sort: str) -> list:
+    """
+    The _sort_order function returns the ORDER BY of a sort key: contacts without a value come last,
+        on every backend (Postgres sorts NULLs last, SQLite first), and ties are broken by id.
+
+    :param sort: str: The key of SORT_KEYS
+    :return: The order_by clauses
+    """
+    return [Contact.id] if sort == "id" else [nulls_last(SORT_KEYS[sort]), Contact.id]
+
+
+def _after_position(sort: str, value, contact_id: int):
+    """
+    The _after_position function filters the contacts that come after a cursor position in _sort_order.
+        A row comparison with NULL is never true, so the contacts without a value are matched separately:
+        they all follow any value, and among themselves they follow the id.
+
+    :param sort: str: The key of SORT_KEYS
+    :param value: The sort key value at the position, or None
+    :param contact_id: int: The id at the position
+    :return: A filter clause
+    """
+    key = SORT_KEYS[sort]
+    if value is None:
+        return and_(key.is_(None), Contact.id > contact_id)
+    return or_(tuple_(key, Contact.id) > tuple_(value, contact_id), key.is_(None))
+
+
+def encode_cursor(sort: str, contact: Contact) -> str:
+    """
+    The encode_cursor function makes an opaque cursor that points just past the given contact in the given order.
+
+    :param sort: str: The sort key of the page
+    :param contact: Contact: The last contact of the page
+    :return: A url-safe string
+    """
+    position = [sort, contact.id] if sort == "id" else [sort, getattr(contact, sort), contact.id]
+    raw = json.dumps(position, separators=(",", ":"), default=date.isoformat).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list:
+    """
+    The decode_cursor function reads back a cursor made by encode_cursor.
+
+    :param cursor: str: The cursor from the request
+    :return: A list of the sort key followed by the position values
+    :raises ValueError: If the cursor was not made by encode_cursor
+    """
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError) as err:
+        raise ValueError("Invalid cursor") from err
+    if not isinstance(position, list) or not position or position[0] not in SORT_KEYS \
+            or len(position) != (2 if position[0] == "id" else 3):
+        raise ValueError("Invalid cursor")
+    # the values go straight into the keyset comparison, so they must have the types of their columns
+    if type(position[-1]) is not int:
+        raise ValueError("Invalid cursor")
+    if len(position) == 3:
+        position[1] = _cursor_value(SORT_KEYS[position[0]], position[1])
+    return position
+
+
+def _cursor_value(key, value):
+    """
+    The _cursor_value function checks a sort key value read from a cursor against the type of its column;
+        dates travel as ISO strings and are parsed back. A NULL sort key is kept as None.
+
+    :param key: The column the value belongs to
+    :param value: The value from the cursor
+    :return: The value with the type of the column
+    :raises ValueError: If the value does not fit the column
+    """
+    if value is None:
+        return None
+    python_type = key.type.python_type
+    if python_type in (date, datetime) and isinstance(value, str):
+        return python_type.fromisoformat(value)
+    if not isinstance(value, python_type) or isinstance(value, bool):
+        raise ValueError("Invalid cursor")
+    return value
+
+
+RESPONSE_COLUMNS = tuple(getattr(Contact, name) for name in ContactResponse.__fields__)
+
+
+def _select_contacts(rows: bool):
+    """
+    The _select_contacts function starts a select of whole Contact entities,
+        or with rows=True of just the RESPONSE_COLUMNS as plain rows, which skips ORM hydration.
+
+    :param rows: bool: Select plain rows instead of entities
+    :return: A select statement
+    """
+    return select(*RESPONSE_COLUMNS) if rows else select(Contact)
+
+
+def _fetch_contacts(result, rows: bool) -> list:
+    return result.all() if rows else result.scalars().all()
+
+
+async def get_contacts(limit: int, offset: int, user: User, db: AsyncSession, sort: str = "id", rows: bool = False):
     """
     The get_contacts function returns a list of contacts for the user.
         Args:
             limit (int): The number of contacts to return.
             offset (int): The starting point in the database from which to begin returning contacts.
             user (User): A User object representing the current logged-in user, whose contact list is being returned.
-            db (Session): An SQLAlchemy Session object used for querying and updating data in our database.
+            db (AsyncSession): An SQLAlchemy Session object used for querying and updating data in our database.
+            sort (str): The key of SORT_KEYS the contacts are ordered by, ties are broken by id.
+            rows (bool): Return plain rows of RESPONSE_COLUMNS instead of Contact objects.
     
     :param limit: int: Limit the number of contacts returned
     :param offset: int: Get the next set of contacts when the limit is reached
     :param user: User: Get the user id from the database
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
+    :param sort: str: Order the contacts by this key
+    :param rows: bool: Return plain rows instead of Contact objects
     :return: A list of contacts
     """
-    contacts = db.query(Contact).filter(Contact.user_id ==
-                                        user.id).limit(limit).offset(offset).all()
-    return contacts
+    stmt = _select_contacts(rows).filter(Contact.user_id == user.id).order_by(*_sort_order(sort)) \
+        .limit(limit).offset(offset)
+    contacts = await db.execute(stmt)
+    return _fetch_contacts(contacts, rows)
+
+
+async def get_contacts_page(limit: int, cursor: str | None, user: User, db: AsyncSession, sort: str = "id",
+                            rows: bool = False):
+    """
+    The get_contacts_page function returns one page of contacts using keyset pagination.
+        Instead of skipping rows with OFFSET it continues right after the position stored in the cursor,
+        walking the (user_id, sort key, id) index where there is one, so every page costs the same however
+        deep it is, and rows written meanwhile never make pages overlap or skip.
+        Args:
+            limit (int): The number of contacts to return.
+            cursor (str | None): The next_cursor of the previous page, empty or None for the first page.
+            user (User): The user whose contacts are returned.
+            db (AsyncSession): A database session.
+            sort (str): The key of SORT_KEYS the contacts are ordered by; a cursor carries its own.
+            rows (bool): Return plain rows of RESPONSE_COLUMNS instead of Contact objects.
+
+    :param limit: int: Limit the number of contacts returned
+    :param cursor: str | None: Continue after this position
+    :param user: User: Get the user id from the database
+    :param db: AsyncSession: Access the database
+    :param sort: str: Order the contacts by this key
+    :param rows: bool: Return plain rows instead of Contact objects
+    :return: A tuple of the contacts and the cursor of the next page (None on the last page)
+    :raises ValueError: If the cursor is invalid
+    """
+    stmt = _select_contacts(rows).filter(Contact.user_id == user.id)
+    if cursor:
+        position = decode_cursor(cursor)
+        sort = position[0]
+        if sort == "id":
+            stmt = stmt.filter(Contact.id > position[1])
+        else:
+            stmt = stmt.filter(_after_position(sort, position[1], position[2]))
+    contacts = await db.execute(stmt.order_by(*_sort_order(sort)).limit(limit + 1))
+    contacts = _fetch_contacts(contacts, rows)
+    next_cursor = None
+    if len(contacts) > limit:
+        contacts = contacts[:limit]
+        next_cursor = encode_cursor(sort, contacts[-1])
+    return contacts, next_cursor
+
+
+EXPORT_COLUMNS = ("id", "first_name", "last_name", "email", "phone", "birthday", "description")
+
+
+async def stream_contacts(user: User, db: AsyncSession, chunk_size: int = 1000):
+    """
+    The stream_contacts function yields all contacts of the user in chunks, as plain rows of EXPORT_COLUMNS.
+        The rows come from a server-side cursor (stream_results with yield_per), so only one chunk
+        is held in memory at a time, however many contacts the user has.
+
+    :param user: User: The owner of the contacts
+    :param db: AsyncSession: Access the database
+    :param chunk_size: int: The number of rows fetched from the cursor at once
+    :return: An async iterator of lists of rows
+    """
+    stmt = select(*[getattr(Contact, name) for name in EXPORT_COLUMNS]).filter(Contact.user_id == user.id)\
+        .order_by(Contact.id).execution_options(yield_per=chunk_size)
+    result = await db.stream(stmt)
+    async for rows in result.partitions():
+        yield rows
 
 
-async def get_contact_by_id(contact_id: int, user: User, db: Session):
+async def get_contact_by_id(contact_id: int, user: User, db: AsyncSession):
     """
     The get_contact_by_id function returns a contact object from the database based on the id of that contact.
         Args:
             contact_id (int): The id of the desired Contact object.
             user (User): The User who owns this Contact object.
-            db (Session): A connection to our database, used for querying and updating data in our tables.
+            db (AsyncSession): A connection to our database, used for querying and updating data in our tables.
     
     :param contact_id: int: Specify the id of the contact you want to retrieve
     :param user: User: Get the user_id of the current user
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: The first contact found in the database that matches the user_id and id of the contact
     """
-    contact = db.query(Contact).filter(
-        and_(Contact.id == contact_id, Contact.user_id ==
-             user.id)).first()
-    return contact
+    stmt = select(Contact).filter(and_(Contact.id == contact_id, Contact.user_id == user.id))
+    contact = await db.execute(stmt)
+    return contact.scalars().first()
+
+
+async def get_contact_version(contact_id: int, user: User, db: AsyncSession):
+    """
+    The get_contact_version function returns only the id and updated_at of a contact,
+        enough to build its ETag without loading the whole contact.
+
+    :param contact_id: int: Specify the id of the contact
+    :param user: User: The owner of the contact
+    :param db: AsyncSession: Access the database
+    :return: A tuple (id, updated_at), or None if the user has no such contact
+    """
+    stmt = select(Contact.id, Contact.updated_at).filter(and_(Contact.id == contact_id, Contact.user_id == user.id))
+    version = await db.execute(stmt)
+    version = version.first()
+    return tuple(version) if version is not None else None
+
+
+async def get_contacts_version(user: User, db: AsyncSession) -> tuple:
+    """
+    The get_contacts_version function summarizes the user's contacts in one aggregate row:
+        the count and the sum and maximum of the ids change when contacts are added or removed
+        (ids only grow), and the latest updated_at changes when one is edited.
+        List ETags are built from it without loading any contact while Redis, and so the contacts version
+        of the response cache, is unavailable.
+
+    :param user: User: The owner of the contacts
+    :param db: AsyncSession: Access the database
+    :return: A tuple (count, sum of ids, max id, latest updated_at)
+    """
+    stmt = select(func.count(Contact.id), func.sum(Contact.id), func.max(Contact.id), func.max(Contact.updated_at)) \
+        .filter(Contact.user_id == user.id)
+    version = await db.execute(stmt)
+    return tuple(version.one())
+
 
+SEARCH_FIELDS = ("first_name", "last_name", "email", "phone")
 
-async def get_contact_by_email(contact_email: str, user: User, db: Session):
+contacts_fts = table("contacts_fts", column("rowid"), column("rank"))
+
+
+def _escape_like(term: str) -> str:
+    """
+    The _escape_like function escapes the LIKE wildcards in a search term, so it is matched literally.
+
+    :param term: str: The search term
+    :return: The escaped term
+    """
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _search_column(field: str):
+    """
+    The _search_column function returns the expression a field is searched on.
+        Names and email are compared lower-cased (that is what the trigram indexes are built on), the phone as is.
+
+    :param field: str: The name of the field
+    :return: A column expression
+    """
+    if field == "phone":
+        return Contact.phone
+    return func.lower(getattr(Contact, field))
+
+
+def _search_statement(dialect: str, term: str, fields: tuple, rows: bool = False):
+    """
+    The _search_statement function builds the filter and the ranking for a search on the given dialect.
+        Postgres matches with ILIKE-style patterns that the pg_trgm GIN indexes can serve and ranks by similarity.
+        SQLite matches through the contacts_fts trigram table and ranks by bm25; terms shorter than
+        three characters (too short for a trigram) fall back to LIKE, ranked exact > prefix > substring.
+
+    :param dialect: str: The name of the database dialect
+    :param term: str: The lower-cased search term
+    :param fields: tuple: The fields to search in
+    :param rows: bool: Select plain rows of RESPONSE_COLUMNS instead of Contact objects
+    :return: A select statement without the user filter and pagination
+    """
+    columns = [_search_column(field) for field in fields]
+    if dialect == "sqlite" and len(term) >= 3:
+        phrase = '"' + term.replace('"', '""') + '"'
+        match = literal_column("contacts_fts").op("MATCH")("{" + " ".join(fields) + "} : " + phrase)
+        return _select_contacts(rows).join(contacts_fts, contacts_fts.c.rowid == Contact.id)\
+            .filter(match).order_by(contacts_fts.c.rank, Contact.id)
+
+    pattern = f"%{_escape_like(term)}%"
+    matches = or_(*[col.like(pattern, escape="\\") for col in columns])
+    if dialect == "postgresql":
+        rank = func.greatest(*[func.similarity(col, term) for col in columns])
+        return _select_contacts(rows).filter(matches).order_by(rank.desc(), Contact.id)
+    rank = case((or_(*[col == term for col in columns]), 0),
+                (or_(*[col.like(f"{_escape_like(term)}%", escape="\\") for col in columns]), 1),
+                else_=2)
+    return _select_contacts(rows).filter(matches).order_by(rank, Contact.id)
+
+
+async def search_contacts(query: str, user: User, db: AsyncSession, limit: int = 10, offset: int = 0,
+                          fields: tuple = SEARCH_FIELDS, rows: bool = False):
+    """
+    The search_contacts function returns the contacts of the user that contain the query in one of the fields,
+        case-insensitive, best matches first.
+        Args:
+            query (str): The text to look for.
+            user (User): The user whose contacts are being searched through.
+            db (AsyncSession): A database session object used to query the database.
+            limit (int): The number of contacts to return.
+            offset (int): The number of contacts to skip.
+            fields (tuple): The fields to search in, all of SEARCH_FIELDS by default.
+            rows (bool): Return plain rows of RESPONSE_COLUMNS instead of Contact objects.
+
+    :param query: str: The text to look for
+    :param user: User: Get the user id of the current logged in user
+    :param db: AsyncSession: Access the database
+    :param limit: int: Limit the number of contacts returned
+    :param offset: int: Skip the first offset contacts
+    :param fields: tuple: Restrict the search to some of the fields
+    :param rows: bool: Return plain rows instead of Contact objects
+    :return: A list of contacts ordered by relevance
+    """
+    dialect = db.get_bind().dialect.name
+    stmt = _search_statement(dialect, query.strip().lower(), fields, rows)
+    stmt = stmt.filter(Contact.user_id == user.id).limit(limit).offset(offset)
+    contacts = await db.execute(stmt)
+    return _fetch_contacts(contacts, rows)
+
+
+async def get_contact_by_email(contact_email: str, user: User, db: AsyncSession, limit: int = 10, offset: int = 0,
+                               rows: bool = False):
     """
     The get_contact_by_email function returns a list of contacts that match the contact_email parameter.
         The user parameter is used to filter out contacts that do not belong to the user.
@@ -55,89 +363,251 @@ async def get_contact_by_email(contact_email: str, user: User, db: Session):
     
     :param contact_email: str: Filter the contacts by email
     :param user: User: Get the user_id from the database
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
+    :param limit: int: Limit the number of contacts returned
+    :param offset: int: Skip the first offset contacts
+    :param rows: bool: Return plain rows instead of Contact objects
     :return: A list of contacts that match the email address provided
     """
-    contacts = db.query(Contact).filter(
-        and_(Contact.user_id == user.id, Contact.email.like(f"%{contact_email}%"))).all()
-    return contacts
+    return await search_contacts(contact_email, user, db, limit, offset, fields=("email",), rows=rows)
 
 
-async def get_contacts_by_first_name(contact_first_name: str, user: User, db: Session):
+async def get_contacts_by_first_name(contact_first_name: str, user: User, db: AsyncSession, limit: int = 10,
+                                     offset: int = 0, rows: bool = False):
     """
     The get_contacts_by_first_name function returns a list of contacts that match the first name provided.
-        The function takes in a contact_first_name string and user object, and uses the database session to query for
-        all contacts with matching first names. It then returns those contacts as a list.
+        The function takes in a contact_first_name string and user object, and searches
+        the first names of the user's contacts with search_contacts.
     
     :param contact_first_name: str: Filter the contacts by first name
     :param user: User: Get the user id from the database
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
+    :param limit: int: Limit the number of contacts returned
+    :param offset: int: Skip the first offset contacts
+    :param rows: bool: Return plain rows instead of Contact objects
     :return: A list of contacts that match the search criteria
     """
-    contacts = db.query(Contact).filter(and_(Contact.user_id == user.id,
-                                             Contact.first_name.like(f"%{contact_first_name}%"))).all()
-    return contacts
+    return await search_contacts(contact_first_name, user, db, limit, offset, fields=("first_name",), rows=rows)
 
 
-async def get_contacts_by_last_name(contact_last_name: str, user: User, db: Session):
+async def get_contacts_by_last_name(contact_last_name: str, user: User, db: AsyncSession, limit: int = 10,
+                                    offset: int = 0, rows: bool = False):
     """
     The get_contacts_by_last_name function returns a list of contacts that match the last name provided.
         
     
     :param contact_last_name: str: Filter the contacts by last name
     :param user: User: Get the user id of the current logged in user
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
+    :param limit: int: Limit the number of contacts returned
+    :param offset: int: Skip the first offset contacts
+    :param rows: bool: Return plain rows instead of Contact objects
     :return: A list of contacts that match the last name provided
     """
-    contacts = db.query(Contact).filter(and_(Contact.user_id == user.id,
-                                             Contact.last_name.like(f"%{contact_last_name}%"))).all()
-    return contacts
+    return await search_contacts(contact_last_name, user, db, limit, offset, fields=("last_name",), rows=rows)
 
 
-async def get_contacts_with_birthday(days, user: User, db: Session):
+async def lookup_contacts(user: User, db: AsyncSession, phone: str | None = None, email: str | None = None,
+                          limit: int = 10) -> list:
+    """
+    The lookup_contacts function finds the user's contacts with exactly this phone number and/or email,
+        however they were written: both sides are compared in normalized form on the (user_id, normalized) indexes.
+
+    :param user: User: The owner of the contacts
+    :param db: AsyncSession: Access the database
+    :param phone: str | None: A phone number in any format
+    :param email: str | None: An email address in any case
+    :param limit: int: Limit the number of contacts returned
+    :return: A list of contacts that match every value given
+    """
+    filters = [Contact.user_id == user.id]
+    if phone is not None:
+        filters.append(Contact.phone_normalized == normalize_phone(phone))
+    if email is not None:
+        filters.append(Contact.email_normalized == normalize_email(email))
+    contacts = await db.execute(select(Contact).filter(*filters).order_by(Contact.id).limit(limit))
+    return contacts.scalars().all()
+
+
+# blocking keys: contacts that share one are duplicate candidates
+DUPLICATE_KEYS = {
+    "phone": (Contact.phone_normalized,),
+    "email": (Contact.email_normalized,),
+    "name": (func.lower(Contact.first_name), func.lower(Contact.last_name)),
+}
+
+
+async def find_duplicates(user: User, db: AsyncSession, keys: tuple = tuple(DUPLICATE_KEYS), limit: int = 100) -> list:
+    """
+    The find_duplicates function reports groups of the user's contacts that share a blocking key.
+        For every key the database groups the contacts by it and keeps the values held by more than one,
+        then returns the members of those groups ordered by value, so no pair of contacts is ever compared
+        and the cost grows with the size of the address book, not with its square.
+
+    :param user: User: The owner of the contacts
+    :param db: AsyncSession: Access the database
+    :param keys: tuple: The names of the blocking keys to use, see DUPLICATE_KEYS
+    :param limit: int: The maximum number of groups per key
+    :return: A list of dicts with the key, the shared value and the contacts of every group
+    """
+    groups = []
+    for name in keys:
+        columns = DUPLICATE_KEYS[name]
+        blocks = select(*[column.label(f"key{i}") for i, column in enumerate(columns)])\
+            .filter(Contact.user_id == user.id, *[column.is_not(None) for column in columns])\
+            .group_by(*columns).having(func.count() > 1).order_by(*columns).limit(limit).subquery()
+        values = list(blocks.c)
+        stmt = select(Contact, *values)\
+            .join(blocks, and_(*[column == value for column, value in zip(columns, values)]))\
+            .filter(Contact.user_id == user.id).order_by(*values, Contact.id)
+        result = await db.execute(stmt)
+        for value, rows in groupby(result.all(), key=lambda row: tuple(row[1:])):
+            groups.append({"key": name, "value": " ".join(value), "contacts": [row[0] for row in rows]})
+    return groups
+
+
+def birthday_window(today: date, days: int) -> tuple[int, int]:
+    """
+    The birthday_window function returns the first and the last birthday key (MMDD) of a window of days starting today.
+        The window may wrap over the new year, in which case start is greater than end.
+        In a year without the 29th of February, people born on it celebrate on the 28th,
+        so a window ending on the 28th of February is stretched to include 229.
+
+    :param today: date: The first day of the window
+    :param days: int: The number of days in the window, today included
+    :return: A tuple of start and end keys
+    """
+    last_day = today + timedelta(days=days - 1)
+    start, end = birthday_key(today), birthday_key(last_day)
+    if end == 228 and not calendar.isleap(last_day.year):
+        end = 229
+    return start, end
+
+
+async def get_contacts_with_birthday(days: int, user: User, db: AsyncSession, limit: int = 10, offset: int = 0):
     """
     The get_contacts_with_birthday function returns a list of contacts that have their birthday within the next 'days' days.
+        The window is evaluated in SQL against the indexed (user_id, birthday_md) pair,
+        and the contacts come back ordered by the number of days left until their birthday.
         Args:
-            days (int): The number of days to look ahead for birthdays.
+            days (int): The number of days to look ahead for birthdays, today included.
             user (User): The user whose contacts are being searched through.
-            db (Session): A database session object used to query the database for contact information.
+            db (AsyncSession): A database session object used to query the database for contact information.
+            limit (int): The number of contacts to return.
+            offset (int): The number of contacts to skip.
     
-    :param days: Determine how many days in the future to look for birthdays
+    :param days: int: Determine how many days in the future to look for birthdays
     :param user: User: Get the user's id from the database
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
+    :param limit: int: Limit the number of contacts returned
+    :param offset: int: Skip the first offset contacts
     :return: A list of contacts with birthdays in the next n days
     """
-    contacts = []
-    all_contacts = db.query(Contact).filter(Contact.user_id == user.id).all()
-    for contact in all_contacts:
-        birthday_fulldate = str(contact.birthday)
-        year_month_day_birth = birthday_fulldate.split(".")
-        if len(year_month_day_birth) == 3:
-            for i in range(days):
-                celebration_day = datetime.now() + timedelta(days=i)
-                if year_month_day_birth[2] == celebration_day.day and year_month_day_birth[1] == celebration_day.month:
-                    contacts.append(contact)
-    return contacts
+    start, end = birthday_window(date.today(), days)
+    if days >= 366:
+        in_window = Contact.birthday_md.isnot(None)
+    elif start <= end:
+        in_window = Contact.birthday_md.between(start, end)
+    else:
+        in_window = or_(Contact.birthday_md >= start, Contact.birthday_md <= end)
+    days_left = case((Contact.birthday_md >= start, 0), else_=1)
+    stmt = select(Contact).filter(and_(Contact.user_id == user.id, in_window))\
+        .order_by(days_left, Contact.birthday_md, Contact.id).limit(limit).offset(offset)
+    contacts = await db.execute(stmt)
+    return contacts.scalars().all()
 
 
-async def create(body: ContactModel, user: User, db: Session):
+async def create(body: ContactModel, user: User, db: AsyncSession):
     """
     The create function creates a new contact in the database.
         
     
     :param body: ContactModel: Get the data from the request body
     :param user: User: Get the user id from the token
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: A contact object, but the schema expects a contactmodel
     """
     contact = Contact(first_name=body.first_name, last_name=body.last_name, phone=body.phone,
-                      email=body.email, birthday=body.birthday, description=body.description, user=user)
+                      email=body.email, birthday=body.birthday, description=body.description, user_id=user.id)
     db.add(contact)
-    db.commit()
+    await db.commit()
+    await response_cache.bump(user.id)
+    await db.refresh(contact)
     return contact
 
 
-async def update(contact_id: int, body: ContactModel, user: User, db: Session):
+IMPORT_COLUMNS = ("first_name", "last_name", "email", "email_normalized", "phone", "phone_normalized", "birthday",
+                  "birthday_md", "description", "created_at", "updated_at", "user_id")
+
+
+def _import_row(body: ContactModel, user: User, now: datetime) -> dict:
+    return {"first_name": body.first_name, "last_name": body.last_name, "email": body.email,
+            "email_normalized": normalize_email(body.email), "phone": body.phone,
+            "phone_normalized": normalize_phone(body.phone), "birthday": body.birthday,
+            "birthday_md": birthday_key(body.birthday), "description": body.description,
+            "created_at": now, "updated_at": now, "user_id": user.id}
+
+
+async def _insert_rows(rows: list, db: AsyncSession) -> None:
+    """
+    The _insert_rows function inserts rows with one round trip: COPY on Postgres (asyncpg), executemany elsewhere.
+
+    :param rows: list: Dicts with the IMPORT_COLUMNS keys
+    :param db: AsyncSession: Access the database
+    :return: None
+    """
+    if settings.import_use_copy and db.get_bind().dialect.driver == "asyncpg":
+        connection = await db.connection()
+        raw = await connection.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(
+            Contact.__tablename__, columns=IMPORT_COLUMNS,
+            records=[tuple(row[name] for name in IMPORT_COLUMNS) for row in rows])
+    else:
+        await db.execute(insert(Contact), rows)
+
+
+async def create_many(bodies: list, user: User, db: AsyncSession) -> list:
+    """
+    The create_many function inserts a batch of contacts and commits it as one transaction.
+        Emails the user already has a contact for, or that repeat within the batch, are reported instead of inserted.
+        If the batch still violates a constraint (e.g. a concurrent insert), the rows are retried one by one,
+        so only the offending rows fail.
+
+    :param bodies: list: Tuples of (row number, ContactModel)
+    :param user: User: The owner of the new contacts
+    :param db: AsyncSession: Access the database
+    :return: A list of dicts with the row number and the reason for every row that was not inserted
+    """
+    errors, batch, seen = [], [], set()
+    emails = [body.email for _, body in bodies]
+    existing = await db.execute(select(Contact.email).filter(Contact.user_id == user.id, Contact.email.in_(emails)))
+    existing = set(existing.scalars().all())
+    now = datetime.utcnow()
+    for number, body in bodies:
+        if body.email in existing or body.email in seen:
+            errors.append({"row": number, "detail": f"Contact with email {body.email} already exists"})
+            continue
+        seen.add(body.email)
+        batch.append((number, _import_row(body, user, now)))
+    if not batch:
+        return errors
+    try:
+        await _insert_rows([row for _, row in batch], db)
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        for number, row in batch:
+            try:
+                await db.execute(insert(Contact), [row])
+                await db.commit()
+            except IntegrityError as err:
+                await db.rollback()
+                errors.append({"row": number, "detail": str(err.orig)})
+    await response_cache.bump(user.id)
+    return errors
+
+
+async def update(contact_id: int, body: ContactModel, user: User, db: AsyncSession):
     """
     The update function updates a contact in the database.
         
@@ -145,7 +615,7 @@ async def update(contact_id: int, body: ContactModel, user: User, db: Session):
     :param contact_id: int: Identify the contact to be deleted
     :param body: ContactModel: Get the data from the request body
     :param user: User: Get the user's id to check if they are allowed to delete a contact
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: The contact object
     """
     contact = await get_contact_by_id(contact_id, user, db)
@@ -156,22 +626,24 @@ async def update(contact_id: int, body: ContactModel, user: User, db: Session):
         contact.email = body.email
         contact.birthday = body.birthday
         contact.description = body.description
-        db.commit()
+        await db.commit()
+        await response_cache.bump(user.id)
     return contact
 
 
-async def remove(contact_id: int, user: User, db: Session):
+async def remove(contact_id: int, user: User, db: AsyncSession):
     """
     The remove function removes a contact from the database.
         
     
     :param contact_id: int: Specify the contact id of the contact to be removed
     :param user: User: Get the user id from the database
-    :param db: Session: Connect to the database
+    :param db: AsyncSession: Connect to the database
     :return: The contact that was deleted
     """
     contact = await get_contact_by_id(contact_id, user, db)
     if contact:
-        db.delete(contact)
-        db.commit()
+        await db.delete(contact)
+        await db.commit()
+        await response_cache.bump(user.id)
     return contact
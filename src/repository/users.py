@@ -1,37 +1,39 @@
 from libgravatar import Gravatar
-from sqlalchemy.orm import Session
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.database.models import User
 from src.schemas import UserModel
 
 
-async def get_user_by_email(email: str, db: Session) -> User:
+async def get_user_by_email(email: str, db: AsyncSession) -> User:
     """
     The get_user_by_email function returns a user object from the database based on the email address provided.
         Args:
             email (str): The email address of the user to be retrieved.
-            db (Session): Access the database.
+            db (AsyncSession): Access the database.
         Returns:
             User: A single user object matching the provided email address.
     
     :param email: str: Pass in the email address of the user
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: A user object
     """
-    return db.query(User).filter(User.email == email).first()
+    user = await db.execute(select(User).filter(User.email == email))
+    return user.scalars().first()
 
 
-async def create_user(body: UserModel, db: Session) -> User:
+async def create_user(body: UserModel, db: AsyncSession) -> User:
     """
     The create_user function creates a new user in the database.
         Args:
             body (UserModel): The UserModel object containing the information to be added to the database.
-            db (Session): The SQLAlchemy Session object used for querying and updating data in the database.
+            db (AsyncSession): The SQLAlchemy Session object used for querying and updating data in the database.
         Returns:
             User: A User object representing a newly created user.
     
     :param body: UserModel: Get the data from the request body
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: A user object
     """
     avatar = None
@@ -42,52 +44,83 @@ async def create_user(body: UserModel, db: Session) -> User:
         print(e)
     new_user = User(**body.dict(), avatar=avatar)
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
     return new_user
 
 
-async def update_token(user: User, token: str | None, db: Session) -> None:
+async def update_token(user: User, token: str | None, db: AsyncSession) -> None:
     """
     The update_token function updates the refresh_token field of a user in the database.
     
     :param user: User: Identify the user that is being updated
     :param token: str | None: Set the refresh_token field of the user
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: None
     """
     user.refresh_token = token
-    db.commit()
+    await db.commit()
 
 
-async def confirmed_email(email: str, db: Session) -> None:
+async def revoke_token(email: str, db: AsyncSession, token: str | None = None) -> bool:
+    """
+    The revoke_token function clears the refresh_token field of a user in one conditional UPDATE on the primary.
+        With a token only that token is cleared, so of two concurrent requests presenting it only one succeeds.
+
+    :param email: str: The email of the user
+    :param db: AsyncSession: Access the database
+    :param token: str | None: Clear the field only if it still holds this token
+    :return: True if a token was cleared
+    """
+    stmt = update(User).where(User.email == email, User.refresh_token.is_not(None))
+    if token is not None:
+        stmt = stmt.where(User.refresh_token == token)
+    result = await db.execute(stmt.values(refresh_token=None).execution_options(synchronize_session=False))
+    await db.commit()
+    return result.rowcount == 1
+
+
+async def update_password(user: User, password_hash: str, db: AsyncSession) -> None:
+    """
+    The update_password function replaces the stored password hash of a user, e.g. after a rehash on login.
+
+    :param user: User: Identify the user that is being updated
+    :param password_hash: str: The new password hash
+    :param db: AsyncSession: Access the database
+    :return: None
+    """
+    user.password = password_hash
+    await db.commit()
+
+
+async def confirmed_email(email: str, db: AsyncSession) -> None:
     """
     The confirmed_email function sets the confirmed field of a user to True.
     
     :param email: str: Get the email address of the user
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: None
     """
     user = await get_user_by_email(email, db)
     user.confirmed = True
-    db.commit()
+    await db.commit()
     
 
-async def update_avatar(email, url: str, db: Session) -> User:
+async def update_avatar(email, url: str, db: AsyncSession) -> User:
     """
     The update_avatar function updates the avatar of a user.
     
     Args:
         email (str): The email address of the user to update.
         url (str): The URL for the new avatar image.
-        db (Session, optional): A database session object to use instead of creating one locally. Defaults to None.  # noQA: E501 line too long
+        db (AsyncSession, optional): A database session object to use instead of creating one locally. Defaults to None.  # noQA: E501 line too long
     
     :param email: Find the user in the database
     :param url: str: Specify the type of the parameter
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: A user object
     """
     user = await get_user_by_email(email, db)
     user.avatar = url
-    db.commit()
+    await db.commit()
     return user
@@ -1,47 +1,55 @@
 from typing import List
 
-from fastapi import APIRouter, HTTPException, Depends, status, Security, BackgroundTasks, Request
+from fastapi import APIRouter, HTTPException, Depends, status, Security, BackgroundTasks, Request, Header
 from fastapi.security import OAuth2PasswordRequestForm, HTTPAuthorizationCredentials, HTTPBearer
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.database.db import get_db
+from src.database.models import User
 from src.schemas import UserModel, UserResponse, TokenModel, RequestEmail
 from src.repository import users as repository_users
 from src.services.auth import auth_service
 from src.services.email import send_email
+from src.services.email_queue import email_queue
+from src.services.sessions import session_store
 
 router = APIRouter(prefix='/auth', tags=["auth"])
 security = HTTPBearer()
 
 
 @router.post("/signup", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
-async def signup(body: UserModel, background_tasks: BackgroundTasks, request: Request, db: Session = Depends(get_db)):
+async def signup(body: UserModel, background_tasks: BackgroundTasks, request: Request, db: AsyncSession = Depends(get_db)):
     """
     The signup function creates a new user in the database.
         It takes an email and password as input, hashes the password, and stores it in the database.
-        It then sends an email to that address with a link to confirm their account.
+        It then queues an email to that address with a link to confirm their account
+        (or sends it as a background task if the email queue is unavailable).
     
     :param body: UserModel: Get the data from the request body
     :param background_tasks: BackgroundTasks: Add a task to the background tasks queue
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: A dict with a user and detail key
     """
     exist_user = await repository_users.get_user_by_email(body.email, db)
     if exist_user:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Account already exists")
-    body.password = auth_service.get_password_hash(body.password)
+    body.password = await auth_service.hash_password(body.password)
     new_user = await repository_users.create_user(body, db)
-    background_tasks.add_task(send_email, new_user.email, new_user.username, request.base_url)
+    if not await email_queue.enqueue(new_user.email, new_user.username, str(request.base_url)):
+        background_tasks.add_task(send_email, new_user.email, new_user.username, str(request.base_url))
     return {"user": new_user, "detail": "User successfully created"}
 
 
 @router.post("/login", response_model=TokenModel)
-async def login(body: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login(body: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db),
+                x_device_id: str | None = Header(None)):
     """
     The login function is used to authenticate a user.
+        The refresh token opens a new session in the session store, labelled with the X-Device-Id if given.
     
     :param body: OAuth2PasswordRequestForm: Get the username and password from the request body
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
+    :param x_device_id: str | None: An optional label of the client device
     :return: A dict containing the access_token, refresh_token and token_type
     """
     user = await repository_users.get_user_by_email(body.username, db)
@@ -49,40 +57,59 @@ async def login(body: OAuth2PasswordRequestForm = Depends(), db: Session = Depen
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid email")
     if not user.confirmed:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Email not confirmed")
-    if not auth_service.verify_password(body.password, user.password):
+    verified, new_hash = await auth_service.verify_and_update_password(body.password, user.password)
+    if not verified:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid password")
+    if new_hash:
+        await repository_users.update_password(user, new_hash, db)
     access_token = await auth_service.create_access_token(data={"sub": user.email})
-    refresh_token = await auth_service.create_refresh_token(data={"sub": user.email})
-    await repository_users.update_token(user, refresh_token, db)
+    refresh_token = await session_store.issue(user, db, device=x_device_id)
     return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
 
 
 @router.get('/refresh_token', response_model=TokenModel)
-async def refresh_token(credentials: HTTPAuthorizationCredentials = Security(security), db: Session = Depends(get_db)):
+async def refresh_token(credentials: HTTPAuthorizationCredentials = Security(security), db: AsyncSession = Depends(get_db)):
     """
     The refresh_token function is used to refresh the access token.
     It takes in a refresh token and returns an access_token, a new refresh_token, and the type of token (bearer).
-    
+    The refresh token is rotated in the session store; presenting an already used one revokes its session.
     
     :param credentials: HTTPAuthorizationCredentials: Get the token from the header
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: A new access_token and refresh_token
     """
-    token = credentials.credentials
-    email = await auth_service.decode_refresh_token(token)
-    user = await repository_users.get_user_by_email(email, db)
-    if user.refresh_token != token:
-        await repository_users.update_token(user, None, db)
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
-
+    email, refresh_token = await session_store.rotate(credentials.credentials, db)
     access_token = await auth_service.create_access_token(data={"sub": email})
-    refresh_token = await auth_service.create_refresh_token(data={"sub": email})
-    await repository_users.update_token(user, refresh_token, db)
     return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
 
 
+@router.post('/logout', status_code=status.HTTP_204_NO_CONTENT)
+async def logout(credentials: HTTPAuthorizationCredentials = Security(security), db: AsyncSession = Depends(get_db)):
+    """
+    The logout function ends the session of the refresh token in the Authorization header.
+
+    :param credentials: HTTPAuthorizationCredentials: Get the refresh token from the header
+    :param db: AsyncSession: Access the database
+    :return: None
+    """
+    await session_store.revoke(credentials.credentials, db)
+
+
+@router.post('/logout_all', status_code=status.HTTP_204_NO_CONTENT)
+async def logout_all(current_user: User = Depends(auth_service.get_current_user), db: AsyncSession = Depends(get_db)):
+    """
+    The logout_all function ends every session of the current user: none of the refresh tokens
+        issued so far can be used again. Access tokens stay valid until they expire.
+
+    :param current_user: User: The user, from the access token
+    :param db: AsyncSession: Access the database
+    :return: None
+    """
+    await session_store.revoke_all(current_user, db)
+
+
 @router.get('/confirmed_email/{token}')
-async def confirmed_email(token: str, db: Session = Depends(get_db)):
+async def confirmed_email(token: str, db: AsyncSession = Depends(get_db)):
     """
     The confirmed_email function is used to confirm a user's email address.
     It takes the token from the URL and uses it to get the user's email address.
@@ -93,7 +120,7 @@ async def confirmed_email(token: str, db: Session = Depends(get_db)):
     with that email as its argument
 
     :param token: str: Get the token from the url
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: A dict with a message
     """
 
@@ -109,19 +136,19 @@ async def confirmed_email(token: str, db: Session = Depends(get_db)):
 
 @router.post('/request_email')
 async def request_email(body: RequestEmail, background_tasks: BackgroundTasks, request: Request,
-                        db: Session = Depends(get_db)):
+                        db: AsyncSession = Depends(get_db)):
     """
     The request_email function is used to send an email to the user with a link that will allow them
     to confirm their email address. The function takes in a RequestEmail object, which contains the
     email of the user who wants to confirm their account. It then checks if there is already a confirmed
-    user with that email address, and if so returns an error message saying as much. If not, it sends 
-    an asynchronous task (using FastAPI's BackgroundTasks) to send_email(), which sends out an actual 
-    confirmation email.
+    user with that email address, and if so returns an error message saying as much. If not, it queues
+    the confirmation email for the email worker, falling back to an asynchronous task (using FastAPI's
+    BackgroundTasks) that calls send_email() if the queue is unavailable.
     
     :param body: RequestEmail: Get the email from the request body
     :param background_tasks: BackgroundTasks: Add a task to the background tasks queue
     :param request: Request: Get the base_url of the request
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: A dictionary with a message
     """
     user = await repository_users.get_user_by_email(body.email, db)
@@ -129,6 +156,7 @@ async def request_email(body: RequestEmail, background_tasks: BackgroundTasks, r
     if user.confirmed:
         return {"message": "Your email is already confirmed"}
     if user:
-        background_tasks.add_task(send_email, user.email, user.username, str(request.base_url))
+        if not await email_queue.enqueue(user.email, user.username, str(request.base_url)):
+            background_tasks.add_task(send_email, user.email, user.username, str(request.base_url))
     return {"message": "Check your email for confirmation."}
 
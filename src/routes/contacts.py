@@ -1,154 +1,330 @@
-from typing import List
+from typing import List, Optional, Union
 
-import redis.asyncio as redis
-
-from fastapi import APIRouter, Depends, HTTPException, Path, status, Query
-from sqlalchemy.orm import Session
-
-from fastapi_limiter import FastAPILimiter
-from fastapi_limiter.depends import RateLimiter
+from fastapi import APIRouter, Depends, HTTPException, Path, status, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.database.db import get_db
 from src.database.models import Contact, User
-from src.schemas import ContactResponse, ContactModel, TokenModel, UserDb, UserModel, UserResponse
+from src.schemas import ContactResponse, ContactModel, ContactPage, DuplicateGroup, ImportReport, TokenModel, UserDb, UserModel, UserResponse
 from src.repository import contacts as repository_contacts
 from src.services.auth import auth_service
+from src.services.contact_export import MEDIA_TYPES, RENDERERS
+from src.services.contact_import import ImportFormatError, UnsupportedContentType, iter_contacts
+from src.services.etag import make_etag, not_modified
+from src.services.rate_limit import RateLimit
+from src.services.response_cache import response_cache
 from src.conf.config import settings
 
 router = APIRouter(prefix="/contacts", tags=["contacts"])
 
 
-@router.on_event("startup")
-async def startup():
+async def conditional_list(route: str, params: dict, model, produce, request: Request, db: AsyncSession,
+                           current_user: User) -> Response:
     """
-    The startup function is called when the application starts up.
-    It's a good place to initialize things that are used by the app, such as caches or databases.
-    
-    :return: A coroutine
+    The conditional_list function serves a list endpoint with an ETag built from the route, its parameters and
+        the contacts version the response cache keeps in Redis, bumped by every write. If the client already has
+        that version it gets 304 Not Modified without touching the database; otherwise the response comes from
+        the response cache or from produce. While Redis is unavailable the ETag summarizes the contacts
+        in the database instead.
+
+    :param route: str: The name of the route in the response cache
+    :param params: dict: The parameters that change the response
+    :param model: The response model
+    :param produce: Loads the data from the database, as plain rows when settings.contacts_fast_path is on
+    :param request: Request: Read the If-None-Match header
+    :param db: AsyncSession: Access the database
+    :param current_user: User: The owner of the contacts
+    :return: A 304 or a JSON response with the ETag header
     """
-    r = await redis.Redis(host=settings.redis_host, port=settings.redis_port, db=0, encoding="utf-8", decode_responses=True)
-    await FastAPILimiter.init(r)
+    version = await response_cache.version(current_user.id)
+    if version is None:
+        summary = await repository_contacts.get_contacts_version(current_user, db)
+        etag = make_etag(current_user.id, route, params, "db", summary)
+    else:
+        etag = make_etag(current_user.id, route, params, version)
+    response = not_modified(request, etag)
+    if response is not None:
+        return response
+    response = await response_cache.get_or_set(route, current_user.id, params, model, produce,
+                                               trusted=settings.contacts_fast_path, version=version)
+    response.headers["ETag"] = etag
+    return response
 
 
-@router.get("/", response_model=List[ContactResponse], description='No more than 2 requests per 5 seconds', dependencies=[Depends(RateLimiter(times=2, seconds=5))])
-async def get_contacts(limit: int = Query(10, le=200), offset: int = 0, db: Session = Depends(get_db), current_user: User = Depends(auth_service.get_current_user)):
+@router.get("/", response_model=Union[List[ContactResponse], ContactPage], description='No more than 2 requests per 5 seconds', dependencies=[Depends(RateLimit("read_contacts"))])
+async def get_contacts(request: Request, limit: int = Query(10, le=200), offset: int = 0, cursor: Optional[str] = None,
+                       sort: str = Query("id", regex="^(id|first_name|last_name|birthday)$"),
+                       db: AsyncSession = Depends(get_db), current_user: User = Depends(auth_service.get_current_user)):
     """
     The get_contacts function returns a list of contacts for the current user.
         The limit and offset parameters are used to paginate the results.
+        When a cursor is passed (an empty one for the first page) keyset pagination is used instead
+        and the response is a page with the items and the next_cursor to pass for the following page.
+        Responses are cached in Redis until the user's contacts change (see ResponseCache).
+        The ETag summarizes the user's contacts, so If-None-Match is answered with 304 before any contact is loaded.
+        With settings.contacts_fast_path the contacts are read as plain rows and encoded with orjson directly.
     
     
+    :param request: Request: Read the If-None-Match header
     :param limit: int: Limit the number of contacts returned
     :param le: Limit the number of contacts returned to 200
     :param offset: int: Specify the offset of the first record to return
-    :param db: Session: Access the database
+    :param cursor: Optional[str]: Continue after the position of a previous page
+    :param sort: str: Order the contacts by id, first_name, last_name or birthday; contacts without one come last
+    :param db: AsyncSession: Access the database
     :param current_user: User: Get the user from the database
-    :return: A list of contact objects
+    :return: A list of contact objects, or a page of them in cursor mode
+    """
+    fast = settings.contacts_fast_path
+
+    async def produce():
+        if cursor is not None:
+            try:
+                contacts, next_cursor = await repository_contacts.get_contacts_page(limit, cursor, current_user, db,
+                                                                                    sort, rows=fast)
+            except ValueError:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+            return {"items": contacts, "next_cursor": next_cursor}
+        return await repository_contacts.get_contacts(limit, offset, current_user, db, sort, rows=fast)
+
+    params = {"limit": limit, "offset": offset, "cursor": cursor, "sort": sort}
+    return await conditional_list("contacts", params, ContactPage if cursor is not None else List[ContactResponse],
+                                  produce, request, db, current_user)
+
+
+@router.get("/search", response_model=List[ContactResponse])
+async def search_contacts(q: str = Query(min_length=1, max_length=100), limit: int = Query(10, le=200), offset: int = 0,
+                          db: AsyncSession = Depends(get_db),
+                          current_user: User = Depends(auth_service.get_current_user)):
     """
-    contacts = await repository_contacts.get_contacts(limit, offset, current_user, db)
+    The search_contacts function looks for contacts whose first name, last name, email or phone contain q.
+        The search is case-insensitive, the best matches come first and the results are paginated.
+
+    :param q: str: The text to look for
+    :param limit: int: Limit the number of contacts returned
+    :param offset: int: Specify the offset of the first record to return
+    :param db: AsyncSession: Access the database
+    :param current_user: User: Get the current user from the database
+    :return: A list of contacts
+    """
+    contacts = await repository_contacts.search_contacts(q, current_user, db, limit, offset)
     return contacts
 
 
-@router.get("/{contact_id}", response_model=ContactResponse, description='No more than 2 requests per 5 seconds', dependencies=[Depends(RateLimiter(times=2, seconds=5))])
-async def get_contact(contact_id: int = Path(ge=1), db: Session = Depends(get_db), current_user: User = Depends(auth_service.get_current_user)):
+@router.get("/lookup", response_model=List[ContactResponse])
+async def lookup_contacts(phone: Optional[str] = Query(None, max_length=32),
+                          email: Optional[str] = Query(None, max_length=254), limit: int = Query(10, le=200),
+                          db: AsyncSession = Depends(get_db), current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The lookup_contacts function finds the contacts with exactly this phone number and/or email.
+        The phone may be written in any format, e.g. 063 123 45 67 finds +380631234567, and the email in any case.
+
+    :param phone: Optional[str]: The phone number to look for
+    :param email: Optional[str]: The email to look for
+    :param limit: int: Limit the number of contacts returned
+    :param db: AsyncSession: Access the database
+    :param current_user: User: Get the current user from the database
+    :return: A list of contacts
+    """
+    if phone is None and email is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Give a phone or an email")
+    return await repository_contacts.lookup_contacts(current_user, db, phone, email, limit)
+
+
+@router.get("/duplicates", response_model=List[DuplicateGroup])
+async def get_duplicates(key: Optional[str] = Query(None, regex="^(phone|email|name)$"),
+                         limit: int = Query(100, ge=1, le=1000), db: AsyncSession = Depends(get_db),
+                         current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The get_duplicates function reports groups of contacts that share a phone number, an email or a name,
+        compared in normalized form, as candidates for merging.
+
+    :param key: Optional[str]: Only report groups sharing this key (phone, email or name); all keys by default
+    :param limit: int: The maximum number of groups per key
+    :param db: AsyncSession: Access the database
+    :param current_user: User: Get the current user from the database
+    :return: A list of duplicate groups
+    """
+    keys = (key,) if key else tuple(repository_contacts.DUPLICATE_KEYS)
+    return await repository_contacts.find_duplicates(current_user, db, keys, limit)
+
+
+@router.get("/export", response_class=StreamingResponse)
+async def export_contacts(format: str = Query("ndjson", regex="^(ndjson|csv)$"), db: AsyncSession = Depends(get_db),
+                          current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The export_contacts function streams all contacts of the current user as NDJSON or CSV.
+        Rows are read from a server-side cursor and written out chunk by chunk,
+        so memory use does not depend on the number of contacts.
+
+    :param format: str: ndjson or csv
+    :param db: AsyncSession: Access the database
+    :param current_user: User: Get the current user from the database
+    :return: A streaming response
+    """
+    chunks = repository_contacts.stream_contacts(current_user, db, settings.export_chunk_size)
+    return StreamingResponse(RENDERERS[format](chunks), media_type=MEDIA_TYPES[format],
+                             headers={"Content-Disposition": f'attachment; filename="contacts.{format}"'})
+
+
+@router.get("/{contact_id}", response_model=ContactResponse, description='No more than 2 requests per 5 seconds', dependencies=[Depends(RateLimit("read_contact"))])
+async def get_contact(request: Request, contact_id: int = Path(ge=1), db: AsyncSession = Depends(get_db), current_user: User = Depends(auth_service.get_current_user)):
     """
     The get_contact function returns a contact by id.
         Args:
             contact_id (int): The id of the contact to be returned.
-            db (Session, optional): SQLAlchemy Session. Defaults to Depends(get_db).
+            db (AsyncSession, optional): SQLAlchemy AsyncSession. Defaults to Depends(get_db).
             current_user (User, optional): Current user object from auth middleware. Defaults to Depends(auth_service.get_current_user).
         Returns:
             Contact: A single Contact object matching the given id or None if no match is found.&lt;/code&gt;
+        The ETag comes from the id and updated_at of the contact, which are read without loading it,
+        so a matching If-None-Match is answered with 304 right away.
     
+    :param request: Request: Read the If-None-Match header
     :param contact_id: int: Get the contact id from the url
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :param current_user: User: Get the current user from the database
     :return: A contact object
     """
-    contact = await repository_contacts.get_contact_by_id(contact_id, current_user, db)
-    if contact is None:
+    version = await repository_contacts.get_contact_version(contact_id, current_user, db)
+    if version is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Not found!")
-    return contact
+    etag = make_etag(current_user.id, version)
+    response = not_modified(request, etag)
+    if response is not None:
+        return response
+
+    async def produce():
+        contact = await repository_contacts.get_contact_by_id(contact_id, current_user, db)
+        if contact is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="Not found!")
+        return contact
+
+    response = await response_cache.get_or_set("contact", current_user.id, {"contact_id": contact_id},
+                                               ContactResponse, produce)
+    response.headers["ETag"] = etag
+    return response
 
 
 @router.get("/email/", response_model=List[ContactResponse])
-async def get_contact(contact_email: str, db: Session = Depends(get_db), current_user: User = Depends(auth_service.get_current_user)):
+async def get_contact(request: Request, contact_email: str, limit: int = Query(10, le=200), offset: int = 0,
+                      db: AsyncSession = Depends(get_db), current_user: User = Depends(auth_service.get_current_user)):
     """
     The get_contact function returns a contact by email.
     
+    :param request: Request: Read the If-None-Match header
     :param contact_email: str: Get the contact email from the url path
-    :param db: Session: Access the database
+    :param limit: int: Limit the number of contacts returned
+    :param offset: int: Specify the offset of the first record to return
+    :param db: AsyncSession: Access the database
     :param current_user: User: Get the user from the database
     :return: A contact object
     """
-    contact = await repository_contacts.get_contact_by_email(contact_email, current_user, db)
-    if contact is None:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="Not found!")
-    return contact
+    fast = settings.contacts_fast_path
+
+    async def produce():
+        contact = await repository_contacts.get_contact_by_email(contact_email, current_user, db, limit, offset,
+                                                                 rows=fast)
+        if contact is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="Not found!")
+        return contact
+
+    params = {"email": contact_email, "limit": limit, "offset": offset}
+    return await conditional_list("contacts_by_email", params, List[ContactResponse], produce, request, db, current_user)
 
 
 @router.get("/first_name/", response_model=List[ContactResponse])
-async def get_contact(contact_first_name: str, db: Session = Depends(get_db), current_user: User = Depends(auth_service.get_current_user)):
+async def get_contact(request: Request, contact_first_name: str, limit: int = Query(10, le=200), offset: int = 0,
+                      db: AsyncSession = Depends(get_db), current_user: User = Depends(auth_service.get_current_user)):
     """
     The get_contact function returns a contact by first name.
     
+    :param request: Request: Read the If-None-Match header
     :param contact_first_name: str: Get the first name of the contact
-    :param db: Session: Access the database
+    :param limit: int: Limit the number of contacts returned
+    :param offset: int: Specify the offset of the first record to return
+    :param db: AsyncSession: Access the database
     :param current_user: User: Get the current user
     :return: A list of contacts
     """
-    contacts = await repository_contacts.get_contacts_by_first_name(contact_first_name, current_user, db)
-    if contacts is None:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="Not found!")
-    return contacts
+    fast = settings.contacts_fast_path
+
+    async def produce():
+        contacts = await repository_contacts.get_contacts_by_first_name(contact_first_name, current_user, db, limit,
+                                                                        offset, rows=fast)
+        if contacts is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="Not found!")
+        return contacts
+
+    params = {"first_name": contact_first_name, "limit": limit, "offset": offset}
+    return await conditional_list("contacts_by_first_name", params, List[ContactResponse], produce, request, db, current_user)
 
 
 @router.get("/last_name/", response_model=List[ContactResponse])
-async def get_contact(contact_last_name: str, db: Session = Depends(get_db), current_user: User = Depends(auth_service.get_current_user)):
+async def get_contact(request: Request, contact_last_name: str, limit: int = Query(10, le=200), offset: int = 0,
+                      db: AsyncSession = Depends(get_db), current_user: User = Depends(auth_service.get_current_user)):
     """
     The get_contact function returns a contact by last name.
     
+    :param request: Request: Read the If-None-Match header
     :param contact_last_name: str: Pass the last name of the contact to be retrieved
-    :param db: Session: Access the database
+    :param limit: int: Limit the number of contacts returned
+    :param offset: int: Specify the offset of the first record to return
+    :param db: AsyncSession: Access the database
     :param current_user: User: Get the current user from the database
     :return: A list of contacts that match the last_name parameter
     """
-    contacts = await repository_contacts.get_contacts_by_last_name(contact_last_name, current_user, db)
-    if contacts is None:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="Not found!")
-    return contacts
+    fast = settings.contacts_fast_path
+
+    async def produce():
+        contacts = await repository_contacts.get_contacts_by_last_name(contact_last_name, current_user, db, limit,
+                                                                       offset, rows=fast)
+        if contacts is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="Not found!")
+        return contacts
+
+    params = {"last_name": contact_last_name, "limit": limit, "offset": offset}
+    return await conditional_list("contacts_by_last_name", params, List[ContactResponse], produce, request, db, current_user)
 
 
 @router.get("/birthdays/", response_model=List[ContactResponse])
-async def get_contact(days: int = 7, db: Session = Depends(get_db), current_user: User = Depends(auth_service.get_current_user)):
+async def get_contact(days: int = Query(7, ge=1, le=366), limit: int = Query(10, le=200), offset: int = 0,
+                      db: AsyncSession = Depends(get_db), current_user: User = Depends(auth_service.get_current_user)):
     """
     The get_contact function returns a list of contacts with birthdays in the next 7 days.
         The default number of days is 7, but this can be changed by passing an integer to the function.
+        The contacts are ordered by the number of days left until their birthday and paginated with limit and offset.
         If no contacts are found, it will return a 404 error.
     
     :param days: int: Get the number of days to look for contacts with birthdays
-    :param db: Session: Access the database
+    :param limit: int: Limit the number of contacts returned
+    :param offset: int: Specify the offset of the first record to return
+    :param db: AsyncSession: Access the database
     :param current_user: User: Get the user_id from the jwt token
     :return: A list of contacts
     """
-    contacts = await repository_contacts.get_contacts_with_birthday(days, current_user, db)
+    contacts = await repository_contacts.get_contacts_with_birthday(days, current_user, db, limit, offset)
     if len(contacts) == 0:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Not found!")
     return contacts
 
 
-@router.post("/", response_model=ContactResponse, status_code=status.HTTP_201_CREATED, description='No more than 2 requests per 5 seconds', dependencies=[Depends(RateLimiter(times=2, seconds=5))])
-async def create_contact(body: ContactModel, db: Session = Depends(get_db), current_user: User = Depends(auth_service.get_current_user)):
+@router.post("/", response_model=ContactResponse, status_code=status.HTTP_201_CREATED, description='No more than 2 requests per 5 seconds', dependencies=[Depends(RateLimit("create_contact"))])
+async def create_contact(body: ContactModel, db: AsyncSession = Depends(get_db), current_user: User = Depends(auth_service.get_current_user)):
     """
     The create_contact function creates a new contact in the database.
         The function takes a ContactModel object as input and returns the newly created contact.
 
     :param body: ContactModel: Get the data from the request body
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :param current_user: User: Get the user who is currently logged in
     :return: A contactmodel object
     """
@@ -156,8 +332,58 @@ async def create_contact(body: ContactModel, db: Session = Depends(get_db), curr
     return contact
 
 
+@router.post("/bulk", response_model=ImportReport, description='No more than 2 requests per 5 seconds', dependencies=[Depends(RateLimit("import_contacts"))])
+async def import_contacts(request: Request, batch_size: int = Query(settings.import_batch_size, ge=1, le=10000),
+                          db: AsyncSession = Depends(get_db),
+                          current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The import_contacts function creates many contacts from one request.
+        The body is a JSON array (application/json), NDJSON (application/x-ndjson) or CSV with a header
+        line (text/csv). It is parsed while it streams in; every row is validated with ContactModel and
+        valid rows are inserted in batches of batch_size. Bad rows do not abort the import: they are
+        listed in the report with their row number.
+
+    :param request: Request: Read the body as a stream
+    :param batch_size: int: The number of rows inserted per transaction
+    :param db: AsyncSession: Access the database
+    :param current_user: User: Get the user who is currently logged in
+    :return: A report with the number of inserted and failed rows and the errors
+    """
+    report = {"inserted": 0, "failed": 0, "errors": []}
+
+    def fail(errors):
+        report["failed"] += len(errors)
+        report["errors"].extend(errors[:max(0, settings.import_max_errors - len(report["errors"]))])
+
+    async def flush(batch):
+        errors = await repository_contacts.create_many(batch, current_user, db)
+        report["inserted"] += len(batch) - len(errors)
+        fail(errors)
+
+    batch = []
+    try:
+        async for number, body, error in iter_contacts(request.headers.get("content-type", ""), request.stream()):
+            if body is None:
+                fail([{"row": number, "detail": error}])
+                continue
+            batch.append((number, body))
+            if len(batch) >= batch_size:
+                await flush(batch)
+                batch = []
+    except UnsupportedContentType as err:
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail=str(err))
+    except ImportFormatError as err:
+        if batch:
+            await flush(batch)
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"{err}; {report['inserted']} contacts were imported before the error")
+    if batch:
+        await flush(batch)
+    return report
+
+
 @router.put("/{contact_id}", response_model=ContactResponse)
-async def update_contact(body: ContactModel, contact_id: int = Path(ge=1), db: Session = Depends(get_db), current_user: User = Depends(auth_service.get_current_user)):
+async def update_contact(body: ContactModel, contact_id: int = Path(ge=1), db: AsyncSession = Depends(get_db), current_user: User = Depends(auth_service.get_current_user)):
     """
     The update_contact function updates a contact in the database.
         The function takes an id, body and db as parameters.
@@ -165,7 +391,7 @@ async def update_contact(body: ContactModel, contact_id: int = Path(ge=1), db: S
 
     :param body: ContactModel: Get the data from the request body
     :param contact_id: int: Specify the id of the contact to be updated
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :param current_user: User: Get the user who is making the request
     :return: A contactmodel
     """
@@ -177,16 +403,16 @@ async def update_contact(body: ContactModel, contact_id: int = Path(ge=1), db: S
 
 
 @router.delete("/{contact_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_contact(contact_id: int = Path(ge=1), db: Session = Depends(get_db), current_user: User = Depends(auth_service.get_current_user)):
+async def delete_contact(contact_id: int = Path(ge=1), db: AsyncSession = Depends(get_db), current_user: User = Depends(auth_service.get_current_user)):
     """
     The delete_contact function deletes a contact from the database.
         Args:
             contact_id (int): The id of the contact to delete.
-            db (Session, optional): SQLAlchemy Session. Defaults to Depends(get_db).
+            db (AsyncSession, optional): SQLAlchemy AsyncSession. Defaults to Depends(get_db).
             current_user (User, optional): User object for authentication and authorization purposes. Defaults to Depends(auth_service.get_current_user).
     
     :param contact_id: int: Get the contact id from the url
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :param current_user: User: Get the current user from the database
     :return: None
     """
@@ -1,13 +1,13 @@
-from fastapi import APIRouter, Depends, status, UploadFile, File
-from sqlalchemy.orm import Session
-import cloudinary
-import cloudinary.uploader
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.database.db import get_db
 from src.database.models import User
 from src.repository import users as repository_users
 from src.services.auth import auth_service
-from src.conf.config import settings
+from src.services.images import InvalidImage, resize_avatar
+from src.services.storage import storage
+from src.services.workers import PoolSaturated, image_pool
 from src.schemas import UserDb
 
 router = APIRouter(prefix="/users", tags=["users"])
@@ -31,29 +31,30 @@ async def read_users_me(current_user: User = Depends(auth_service.get_current_us
 
 @router.patch('/avatar', response_model=UserDb)
 async def update_avatar_user(file: UploadFile = File(), current_user: User = Depends(auth_service.get_current_user),
-                             db: Session = Depends(get_db)):
+                             db: AsyncSession = Depends(get_db)):
     """
     The update_avatar_user function updates the avatar of a user.
+        The image is cropped and resized to 250x250 in the image worker pool, so only the small avatar
+        is uploaded, and it is stored by the configured storage backend. The body size is capped by
+        UploadLimitMiddleware while it streams in.
         Args:
             file (UploadFile): The image to be uploaded as an avatar.
             current_user (User): The user whose avatar is being updated.
-            db (Session): A database session for interacting with the database.
+            db (AsyncSession): A database session for interacting with the database.
     
     :param file: UploadFile: Get the file from the request body
     :param current_user: User: Get the current user from the database
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :return: An object of the user class
     """
-    cloudinary.config(
-        cloud_name=settings.cloudinary_name,
-        api_key=settings.cloudinary_api_key,
-        api_secret=settings.cloudinary_api_secret,
-        secure=True
-    )
-
-    r = cloudinary.uploader.upload(
-        file.file, public_id=f'ContactsApp/{current_user.username}', overwrite=True)
-    src_url = cloudinary.CloudinaryImage(f'ContactsApp/{current_user.username}')\
-                        .build_url(width=250, height=250, crop='fill', version=r.get('version'))
+    try:
+        avatar = await image_pool.run(resize_avatar, file.file)
+        src_url = await storage.save(f'ContactsApp/{current_user.username}', avatar)
+    except InvalidImage as err:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(err))
+    except PoolSaturated:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Server is busy, try again later",
+                            headers={"Retry-After": "1"})
     user = await repository_users.update_avatar(current_user.email, src_url, db)
+    await auth_service.invalidate_user(current_user.email)
     return user
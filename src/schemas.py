@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Any, List, Optional
 from datetime import date, datetime
 
 from pydantic import BaseModel, EmailStr, Field
@@ -26,6 +26,28 @@ class ContactResponse(BaseModel):
         orm_mode = True
 
 
+class ContactPage(BaseModel):
+    items: List[ContactResponse]
+    next_cursor: Optional[str] = None
+
+
+class ImportRowError(BaseModel):
+    row: int
+    detail: Any
+
+
+class ImportReport(BaseModel):
+    inserted: int = 0
+    failed: int = 0
+    errors: List[ImportRowError] = []
+
+
+class DuplicateGroup(BaseModel):
+    key: str
+    value: str
+    contacts: List[ContactResponse]
+
+
 class UserModel(BaseModel):
     username: str = Field(min_length=5, max_length=16)
     email: str
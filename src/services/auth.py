@@ -1,25 +1,41 @@
 from typing import Optional
-import redis
-import pickle
+import hashlib
+import json
+import logging
+import time
+
+import redis.asyncio as redis
 
 from jose import JWTError, jwt
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.database.db import get_db
+from src.database.db import get_db, replica_router
+from src.database.models import User
 from src.repository import users as repository_users
+from src.services.cache import TTLCache
+from src.services.resources import resources
+from src.services.workers import PoolSaturated, password_pool
 from src.conf.config import settings
 
+logger = logging.getLogger(__name__)
+
+USER_CACHE_FIELDS = ("id", "username", "email", "avatar", "confirmed")
+
 
 class Auth:
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.bcrypt_rounds)
     SECRET_KEY = settings.secret_key
     ALGORITHM = settings.algorithm
     oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
-    r = redis.Redis(host=settings.redis_host, port=settings.redis_port, db=0)
+    r = resources.redis
+    user_cache = TTLCache(maxsize=settings.user_cache_local_size, ttl=settings.user_cache_local_ttl)
+    token_cache = TTLCache(maxsize=settings.token_cache_size, ttl=900)
+    redis_hits = 0
+    redis_misses = 0
 
     def verify_password(self, plain_password, hashed_password):
         """
@@ -45,6 +61,37 @@ class Auth:
         """
         return self.pwd_context.hash(password)
 
+    async def hash_password(self, password: str) -> str:
+        """
+        The hash_password function hashes a password in the password worker pool, so bcrypt does not block the event loop.
+
+        :param self: Represent the instance of the class
+        :param password: str: Pass the password to be hashed
+        :return: A hash of the password
+        """
+        try:
+            return await password_pool.run(self.pwd_context.hash, password)
+        except PoolSaturated:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Server is busy, try again later",
+                                headers={"Retry-After": "1"})
+
+    async def verify_and_update_password(self, plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+        """
+        The verify_and_update_password function checks a password in the password worker pool.
+            When the password is right but the hash was made with other cost parameters than pwd_context
+            has now (e.g. bcrypt_rounds changed), it also returns a new hash to store.
+
+        :param self: Represent the instance of the class
+        :param plain_password: str: The password that the user enters when they log in
+        :param hashed_password: str: The hash stored in the database
+        :return: A tuple of whether the password is correct and the new hash (or None)
+        """
+        try:
+            return await password_pool.run(self.pwd_context.verify_and_update, plain_password, hashed_password)
+        except PoolSaturated:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Server is busy, try again later",
+                                headers={"Retry-After": "1"})
+
     def create_email_token(self, data: dict):
         """
         The create_email_token function takes a dictionary of data and returns a token.
@@ -120,19 +167,30 @@ class Auth:
         :param refresh_token: str: Pass the refresh token to the function
         :return: The email of the user
         """
+        payload = await self.decode_refresh_payload(refresh_token)
+        return payload['sub']
+
+    async def decode_refresh_payload(self, refresh_token: str) -> dict:
+        """
+        The decode_refresh_payload function verifies a refresh token and returns all of its claims,
+            including the session claims (sid, jti, gen) of tokens issued by the session store.
+
+        :param self: Represent the instance of the class
+        :param refresh_token: str: The refresh token
+        :return: The claims
+        """
         try:
             payload = jwt.decode(
                 refresh_token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
-            if payload['scope'] == 'refresh_token':
-                email = payload['sub']
-                return email
+            if payload.get('scope') == 'refresh_token' and payload.get('sub'):
+                return payload
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED, detail='Invalid scope for token')
         except JWTError:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                                 detail='Could not validate credentials')
 
-    async def get_current_user(self, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    async def get_current_user(self, token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
         """
         The get_current_user function is a dependency that will be used in the
             UserController class. It will return the user object if it exists, or raise an
@@ -140,7 +198,7 @@ class Auth:
         
         :param self: Represent the instance of a class
         :param token: str: Get the token from the authorization header
-        :param db: Session: Access the database
+        :param db: AsyncSession: Access the database
         :return: A user object
         """
         credentials_exception = HTTPException(
@@ -149,29 +207,150 @@ class Auth:
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-        try:
-            payload = jwt.decode(token, self.SECRET_KEY,
-                                 algorithms=[self.ALGORITHM])
-            if payload['scope'] == 'access_token':
-                email = payload["sub"]
-                if email is None:
-                    raise credentials_exception
-            else:
-                raise credentials_exception
-        except JWTError as e:
+        email = self.verify_access_token(token)
+        if email is None:
             raise credentials_exception
-        
-        user = self.r.get(f"user:{email}")
+
+        user = await self.get_cached_user(email)
         if user is None:
             user = await repository_users.get_user_by_email(email, db)
             if user is None:
                 raise credentials_exception
-            self.r.set(f"user:{email}", pickle.dumps(user))
-            self.r.expire(f"user:{email}", 900)
-        else:
-            user = pickle.loads(user)
+            user = await self.cache_user(user)
         return user
-    
+
+    def verify_access_token(self, token: str) -> str | None:
+        """
+        The verify_access_token function checks the signature, expiry and scope of an access token
+            and returns its subject. Verified claims are kept in token_cache under a hash of the token
+            until the token's own exp, so a token presented again is not decoded again.
+            Tokens that fail verification are never cached.
+
+        :param self: Represent the instance of the class
+        :param token: str: The access token from the authorization header
+        :return: The email of the user, or None if the token is not a valid access token
+        """
+        key = hashlib.sha256(token.encode()).digest()
+        email = self.token_cache.get(key)
+        if email is not None:
+            return email
+        try:
+            payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
+        except JWTError:
+            return None
+        email = payload.get("sub")
+        if payload.get("scope") != "access_token" or email is None:
+            return None
+        ttl = payload["exp"] - time.time()
+        if ttl > 0:
+            self.token_cache.set(key, email, ttl=ttl)
+        return email
+
+    @staticmethod
+    def dump_user(user: User) -> str:
+        """
+        The dump_user function serializes the columns of a user that the routes need into a compact JSON record.
+            The password hash and the refresh token are never put in the cache.
+
+        :param user: User: The user loaded from the database
+        :return: A JSON string
+        """
+        record = {field: getattr(user, field) for field in USER_CACHE_FIELDS}
+        record["created_at"] = user.created_at.isoformat() if user.created_at else None
+        return json.dumps(record, separators=(",", ":"))
+
+    @staticmethod
+    def load_user(record: str | bytes) -> User:
+        """
+        The load_user function builds a detached User object from a record made by dump_user.
+
+        :param record: str | bytes: The JSON record
+        :return: A user object that is not attached to any session
+        """
+        fields = json.loads(record)
+        if fields.get("created_at"):
+            fields["created_at"] = datetime.fromisoformat(fields["created_at"])
+        return User(**fields)
+
+    async def get_cached_user(self, email: str) -> User | None:
+        """
+        The get_cached_user function looks the user up in the in-process cache first and in Redis second.
+            A Redis hit is copied into the in-process cache, so the next request on this worker makes no network hop.
+            Redis errors are logged and treated as a miss.
+
+        :param self: Represent the instance of the class
+        :param email: str: The email of the user
+        :return: A user object or None
+        """
+        user = self.user_cache.get(email)
+        if user is not None:
+            return user
+        try:
+            record = await self.r.get(f"user:{email}")
+        except redis.RedisError as err:
+            logger.warning("user cache: redis get failed: %s", err)
+            record = None
+        if record is None:
+            self.redis_misses += 1
+            return None
+        self.redis_hits += 1
+        user = self.load_user(record)
+        self.user_cache.set(email, user)
+        return user
+
+    async def cache_user(self, user: User) -> User:
+        """
+        The cache_user function stores the user in both cache tiers.
+            SET with EX writes the value and its expiry in one round trip.
+
+        :param self: Represent the instance of the class
+        :param user: User: The user loaded from the database
+        :return: The detached copy of the user that was cached, so a hit and a miss hand out the same kind of object
+        """
+        record = self.dump_user(user)
+        cached = self.load_user(record)
+        self.user_cache.set(user.email, cached)
+        try:
+            await self.r.set(f"user:{user.email}", record, ex=settings.user_cache_ttl)
+        except redis.RedisError as err:
+            logger.warning("user cache: redis set failed: %s", err)
+        return cached
+
+    async def invalidate_user(self, email: str) -> None:
+        """
+        The invalidate_user function drops the user from both cache tiers, e.g. after the profile has changed.
+            Other workers keep their in-process copy until it expires.
+
+        :param self: Represent the instance of the class
+        :param email: str: The email of the user
+        :return: None
+        """
+        self.user_cache.pop(email)
+        try:
+            await self.r.delete(f"user:{email}")
+        except redis.RedisError as err:
+            logger.warning("user cache: redis delete failed: %s", err)
+
+    def user_cache_stats(self) -> dict:
+        """
+        The user_cache_stats function returns the hit/miss counters of both cache tiers.
+
+        :param self: Represent the instance of the class
+        :return: A dict with the in-process and the Redis counters
+        """
+        return {
+            "local": self.user_cache.stats(),
+            "redis": {"hits": self.redis_hits, "misses": self.redis_misses},
+        }
+
+    def token_cache_stats(self) -> dict:
+        """
+        The token_cache_stats function returns the size and the hit rate of the verified-token cache.
+
+        :param self: Represent the instance of the class
+        :return: A dict with size, maxsize, hits, misses and hit_rate
+        """
+        return self.token_cache.stats()
 
     async def get_email_from_token(self, token: str):
         """
@@ -195,3 +374,5 @@ class Auth:
 
 
 auth_service = Auth()
+replica_router.subject = auth_service.verify_access_token
+resources.on_startup("bcrypt", lambda: auth_service.hash_password("warm-up"))
@@ -0,0 +1,103 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class TTLCache:
+    """
+    A bounded in-process LRU cache whose entries also expire after a time-to-live.
+    It is not shared between workers, so it only holds data that may be a little stale.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        """
+        The __init__ function creates an empty cache.
+
+        :param self: Represent the instance of the class
+        :param maxsize: int: The maximum number of entries; the least recently used one is evicted first
+        :param ttl: float: Default lifetime of an entry in seconds
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        The get function returns the cached value for key, or None if it is missing or expired.
+
+        :param self: Represent the instance of the class
+        :param key: Hashable: The cache key
+        :return: The cached value or None
+        """
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """
+        The set function stores value under key, evicting the least recently used entry when the cache is full.
+
+        :param self: Represent the instance of the class
+        :param key: Hashable: The cache key
+        :param value: Any: The value to cache
+        :param ttl: Optional[float]: Lifetime of this entry in seconds, defaults to the cache ttl
+        :return: None
+        """
+        if self.maxsize <= 0:
+            return
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        """
+        The pop function removes key from the cache if it is there.
+
+        :param self: Represent the instance of the class
+        :param key: Hashable: The cache key
+        :return: None
+        """
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        """
+        The clear function drops every entry and resets the counters.
+
+        :param self: Represent the instance of the class
+        :return: None
+        """
+        self._data.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        """
+        The stats function returns the size of the cache and its hit/miss counters.
+
+        :param self: Represent the instance of the class
+        :return: A dict with size, maxsize, hits, misses and hit_rate
+        """
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,55 @@
+import csv
+import io
+import json
+from typing import AsyncIterator
+
+from src.repository.contacts import EXPORT_COLUMNS
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def _record(row) -> dict:
+    record = dict(zip(EXPORT_COLUMNS, row))
+    if record["birthday"] is not None:
+        record["birthday"] = record["birthday"].isoformat()
+    return record
+
+
+async def ndjson_lines(chunks: AsyncIterator[list]) -> AsyncIterator[str]:
+    """
+    The ndjson_lines function renders chunks of contact rows as NDJSON, one text block per chunk.
+
+    :param chunks: AsyncIterator[list]: Chunks of rows of EXPORT_COLUMNS
+    :return: An async iterator of text blocks
+    """
+    async for rows in chunks:
+        yield "".join(json.dumps(_record(row), ensure_ascii=False) + "\n" for row in rows)
+
+
+async def csv_lines(chunks: AsyncIterator[list]) -> AsyncIterator[str]:
+    """
+    The csv_lines function renders chunks of contact rows as CSV with a header line, one text block per chunk.
+        The output can be imported again through POST /api/contacts/bulk.
+
+    :param chunks: AsyncIterator[list]: Chunks of rows of EXPORT_COLUMNS
+    :return: An async iterator of text blocks
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(EXPORT_COLUMNS)
+    async for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+RENDERERS = {
+    "ndjson": ndjson_lines,
+    "csv": csv_lines,
+}
@@ -0,0 +1,181 @@
+import codecs
+import csv
+import json
+from typing import AsyncIterator
+
+from pydantic import ValidationError
+
+from src.schemas import ContactModel
+
+FORMATS = {
+    "application/json": "json",
+    "application/x-ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+    "text/csv": "csv",
+}
+
+
+class ImportFormatError(Exception):
+    """
+    Raised when the body cannot be parsed any further, e.g. a JSON array that is not closed.
+    """
+
+
+class UnsupportedContentType(ImportFormatError):
+    """
+    Raised when the body is in none of the FORMATS.
+    """
+
+
+async def iter_text(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """
+    The iter_text function decodes a stream of utf-8 byte chunks, also when a character is split between chunks.
+
+    :param chunks: AsyncIterator[bytes]: The raw body, e.g. request.stream()
+    :return: An async iterator of text chunks
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    async for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """
+    The iter_lines function splits a stream of byte chunks into lines without reading the whole body.
+
+    :param chunks: AsyncIterator[bytes]: The raw body
+    :return: An async iterator of lines without line endings
+    """
+    buffer = ""
+    async for text in iter_text(chunks):
+        buffer += text
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    if buffer:
+        yield buffer.rstrip("\r")
+
+
+async def parse_ndjson(chunks: AsyncIterator[bytes]) -> AsyncIterator[tuple[int, dict | None, str | None]]:
+    """
+    The parse_ndjson function yields one object per non-empty line of an NDJSON body.
+
+    :param chunks: AsyncIterator[bytes]: The raw body
+    :return: An async iterator of (row number, object or None, error or None)
+    """
+    number = 0
+    async for line in iter_lines(chunks):
+        if not line.strip():
+            continue
+        number += 1
+        try:
+            yield number, json.loads(line), None
+        except ValueError as err:
+            yield number, None, f"Invalid JSON: {err}"
+
+
+async def parse_csv(chunks: AsyncIterator[bytes]) -> AsyncIterator[tuple[int, dict | None, str | None]]:
+    """
+    The parse_csv function yields one dict per record of a CSV body whose first line is the header.
+        A quoted field may contain line breaks, so lines are joined until the quotes are balanced.
+
+    :param chunks: AsyncIterator[bytes]: The raw body
+    :return: An async iterator of (row number, dict or None, error or None)
+    """
+    header, record, number = None, "", 0
+    async for line in iter_lines(chunks):
+        record = f"{record}\n{line}" if record else line
+        if record.count('"') % 2:
+            continue
+        values, record = next(csv.reader([record])), ""
+        if not values or not any(value.strip() for value in values):
+            continue
+        if header is None:
+            header = [value.strip() for value in values]
+            continue
+        number += 1
+        if len(values) != len(header):
+            yield number, None, f"Expected {len(header)} columns, got {len(values)}"
+            continue
+        yield number, {key: (value if value != "" else None) for key, value in zip(header, values)}, None
+    if record:
+        yield number + 1, None, "Unterminated quoted field"
+
+
+async def parse_json_array(chunks: AsyncIterator[bytes]) -> AsyncIterator[tuple[int, dict | None, str | None]]:
+    """
+    The parse_json_array function yields the elements of a top-level JSON array as soon as each one is complete,
+        so the array never has to be held in memory as a whole.
+
+    :param chunks: AsyncIterator[bytes]: The raw body
+    :return: An async iterator of (row number, element, None)
+    :raises ImportFormatError: If the body is not a JSON array
+    """
+    decoder = json.JSONDecoder()
+    buffer, position, number, started, finished = "", 0, 0, False, False
+    async for text in iter_text(chunks):
+        buffer = buffer[position:] + text
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position == len(buffer) or finished:
+                break
+            if not started:
+                if buffer[position] != "[":
+                    raise ImportFormatError("Body is not a JSON array")
+                started, position = True, position + 1
+                continue
+            if buffer[position] == "]":
+                finished, position = True, position + 1
+                continue
+            try:
+                element, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                break
+            if end == len(buffer) and not isinstance(element, (dict, list)):
+                break
+            number += 1
+            position = end
+            yield number, element, None
+    if not finished:
+        raise ImportFormatError("JSON array is not terminated")
+
+
+PARSERS = {
+    "json": parse_json_array,
+    "ndjson": parse_ndjson,
+    "csv": parse_csv,
+}
+
+
+async def iter_contacts(content_type: str, chunks: AsyncIterator[bytes]) \
+        -> AsyncIterator[tuple[int, ContactModel | None, object]]:
+    """
+    The iter_contacts function parses a streamed body and validates every row with ContactModel.
+
+    :param content_type: str: The Content-Type header of the request
+    :param chunks: AsyncIterator[bytes]: The raw body
+    :return: An async iterator of (row number, ContactModel or None, error detail or None)
+    :raises UnsupportedContentType: If the content type is not supported
+    :raises ImportFormatError: If the body cannot be parsed
+    """
+    media_type = content_type.split(";")[0].strip().lower()
+    if media_type not in FORMATS:
+        raise UnsupportedContentType(f"Unsupported content type {media_type!r}")
+    async for number, row, error in PARSERS[FORMATS[media_type]](chunks):
+        if error is not None:
+            yield number, None, error
+            continue
+        if not isinstance(row, dict):
+            yield number, None, "Row is not an object"
+            continue
+        try:
+            yield number, ContactModel(**row), None
+        except ValidationError as err:
+            yield number, None, err.errors()
@@ -1,25 +1,243 @@
+import asyncio
+import logging
+import time
+from email.message import EmailMessage
+from email.utils import formataddr
 from pathlib import Path
 
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig, MessageType
-from fastapi_mail.errors import ConnectionErrors
+import aiosmtplib
+from jinja2 import Environment, FileSystemLoader, select_autoescape
 from pydantic import EmailStr
 
 from src.services.auth import auth_service
+from src.services.metrics import Histogram
+from src.services.resources import resources
 from src.conf.config import settings
 
-conf = ConnectionConfig(
-    MAIL_USERNAME=settings.mail_username,
-    MAIL_PASSWORD=settings.mail_password,
-    MAIL_FROM=settings.mail_from,
-    MAIL_PORT=settings.mail_port,
-    MAIL_SERVER=settings.mail_server,
-    MAIL_FROM_NAME="Homework 13_Python Web",
-    MAIL_STARTTLS=False,
-    MAIL_SSL_TLS=True,
-    USE_CREDENTIALS=True,
-    VALIDATE_CERTS=True,
-    TEMPLATE_FOLDER=Path(__file__).parent/'templates',
+logger = logging.getLogger(__name__)
+
+TEMPLATE_FOLDER = Path(__file__).parent / 'templates'
+MAIL_FROM_NAME = "Homework 13_Python Web"
+
+
+class EmailDeliveryError(Exception):
+    """
+    Raised when a message could not be sent after all retries.
+    """
+
+
+class Mailer:
+    """
+    A long-lived SMTP sender. It keeps up to pool_size authenticated connections open and reuses them,
+    so a message costs one SMTP transaction instead of a TCP+TLS handshake and a login.
+    Templates are compiled once by the Jinja environment and only rendered per message.
+    """
+
+    def __init__(self, hostname: str, port: int, username: str | None = None, password: str | None = None,
+                 use_tls: bool = True, start_tls: bool = False, validate_certs: bool = True,
+                 pool_size: int = 2, timeout: float = 10, idle_timeout: float = 60,
+                 retries: int = 3, backoff: float = 0.5, sender: str = settings.mail_from,
+                 template_folder: Path = TEMPLATE_FOLDER):
+        """
+        The __init__ function configures the sender; no connection is opened until the first message.
+
+        :param self: Represent the instance of the class
+        :param hostname: str: The SMTP server
+        :param port: int: The SMTP port
+        :param username: str | None: The login, None to send without authentication
+        :param password: str | None: The password
+        :param use_tls: bool: Connect with implicit TLS
+        :param start_tls: bool: Upgrade the connection with STARTTLS
+        :param validate_certs: bool: Check the server certificate
+        :param pool_size: int: The maximum number of open connections
+        :param timeout: float: The timeout of every SMTP command in seconds
+        :param idle_timeout: float: Connections unused for longer are closed instead of reused
+        :param retries: int: How many times a failed message is retried
+        :param backoff: float: The first retry delay in seconds, doubled for every further retry
+        :param sender: str: The From address
+        :param template_folder: Path: Where the Jinja templates are
+        """
+        self.options = {"hostname": hostname, "port": port, "username": username, "password": password,
+                        "use_tls": use_tls, "start_tls": start_tls, "validate_certs": validate_certs,
+                        "timeout": timeout}
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.sender = formataddr((MAIL_FROM_NAME, sender))
+        self.templates = Environment(loader=FileSystemLoader(template_folder),
+                                     autoescape=select_autoescape(["html"]))
+        self._idle: list[tuple[aiosmtplib.SMTP, float]] = []
+        self._slots: asyncio.Semaphore | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self.send_time = Histogram()
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.connections_opened = 0
+
+    def _bind_loop(self) -> None:
+        """
+        The _bind_loop function ties the pool to the running event loop;
+            connections made on another loop (e.g. a previous asyncio.run) cannot be reused and are dropped.
+
+        :param self: Represent the instance of the class
+        :return: None
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._idle = []
+            self._slots = asyncio.Semaphore(self.pool_size)
+
+    async def _acquire(self) -> aiosmtplib.SMTP:
+        """
+        The _acquire function returns an idle connection that is still fresh, or opens and logs in a new one.
+            The caller must hold a pool slot.
+
+        :param self: Represent the instance of the class
+        :return: A connected SMTP client
+        """
+        while self._idle:
+            client, last_used = self._idle.pop()
+            if client.is_connected and time.monotonic() - last_used < self.idle_timeout:
+                return client
+            await self._close(client)
+        client = aiosmtplib.SMTP(**self.options)
+        await client.connect()
+        self.connections_opened += 1
+        return client
+
+    @staticmethod
+    async def _close(client: aiosmtplib.SMTP) -> None:
+        try:
+            await client.quit()
+        except (aiosmtplib.SMTPException, OSError, asyncio.TimeoutError):
+            client.close()
+
+    def render(self, template_name: str, context: dict) -> str:
+        """
+        The render function renders a template; the compiled template is cached by the environment.
+
+        :param self: Represent the instance of the class
+        :param template_name: str: The file name in the template folder
+        :param context: dict: The template variables
+        :return: The rendered body
+        """
+        return self.templates.get_template(template_name).render(**context)
+
+    def build_message(self, recipient: str, subject: str, html: str) -> EmailMessage:
+        message = EmailMessage()
+        message["From"] = self.sender
+        message["To"] = recipient
+        message["Subject"] = subject
+        message.set_content(html, subtype="html")
+        return message
+
+    @staticmethod
+    def is_permanent(err: Exception) -> bool:
+        """
+        The is_permanent function tells whether retrying cannot help, i.e. the server answered with a 5xx code.
+
+        :param err: Exception: The error of the failed attempt
+        :return: True for permanent failures
+        """
+        return isinstance(err, aiosmtplib.SMTPResponseException) and 500 <= err.code < 600
+
+    async def send(self, recipient: str, subject: str, template_name: str, context: dict) -> None:
+        """
+        The send function renders the template and sends the message over a pooled connection.
+            Transient failures are retried with exponential backoff on a fresh connection.
+
+        :param self: Represent the instance of the class
+        :param recipient: str: The To address
+        :param subject: str: The subject
+        :param template_name: str: The file name in the template folder
+        :param context: dict: The template variables
+        :return: None
+        :raises EmailDeliveryError: If every attempt failed
+        """
+        self._bind_loop()
+        message = self.build_message(recipient, subject, self.render(template_name, context))
+        start = time.perf_counter()
+        for attempt in range(self.retries + 1):
+            async with self._slots:
+                client = None
+                try:
+                    client = await self._acquire()
+                    await client.send_message(message)
+                    self._idle.append((client, time.monotonic()))
+                    self.sent += 1
+                    self.send_time.observe(time.perf_counter() - start)
+                    return
+                except (aiosmtplib.SMTPException, OSError, asyncio.TimeoutError) as err:
+                    if client is not None:
+                        await self._close(client)
+                    if attempt == self.retries or self.is_permanent(err):
+                        self.failed += 1
+                        raise EmailDeliveryError(f"Sending to {recipient} failed: {err}") from err
+                    logger.warning("email: attempt %s to %s failed: %s", attempt + 1, recipient, err)
+            self.retried += 1
+            await asyncio.sleep(self.backoff * 2 ** attempt)
+
+    async def close(self) -> None:
+        """
+        The close function closes the idle connections, e.g. on shutdown.
+
+        :param self: Represent the instance of the class
+        :return: None
+        """
+        idle, self._idle = self._idle, []
+        for client, _ in idle:
+            await self._close(client)
+
+    def stats(self) -> dict:
+        """
+        The stats function returns the delivery counters and the send latency histogram.
+
+        :param self: Represent the instance of the class
+        :return: A dict of counters
+        """
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "connections_opened": self.connections_opened,
+            "idle_connections": len(self._idle),
+            "send_seconds": self.send_time.snapshot(),
+        }
+
+
+mailer = Mailer(
+    hostname=settings.mail_server,
+    port=settings.mail_port,
+    username=settings.mail_username,
+    password=settings.mail_password,
+    use_tls=settings.mail_ssl_tls,
+    start_tls=settings.mail_starttls,
+    validate_certs=settings.mail_validate_certs,
+    pool_size=settings.smtp_pool_size,
+    timeout=settings.smtp_timeout,
+    idle_timeout=settings.smtp_idle_timeout,
+    retries=settings.smtp_retries,
+    backoff=settings.smtp_backoff,
 )
+resources.on_shutdown("smtp", mailer.close)
+
+
+async def send_confirmation(email: str, username: str, host: str, token: str) -> None:
+    """
+    The send_confirmation function sends the email confirmation message with an existing token.
+
+    :param email: str: The address to confirm
+    :param username: str: Pass the username to the template
+    :param host: str: Pass the hostname of the server to the email template
+    :param token: str: The email verification token
+    :return: None
+    :raises EmailDeliveryError: If the message could not be sent
+    """
+    await mailer.send(email, "Confirm your email ", "email_template.html",
+                      {"host": host, "username": username, "token": token})
 
 
 async def send_email(email: EmailStr, username: str, host: str):
@@ -27,11 +245,11 @@ async def send_email(email: EmailStr, username: str, host: str):
     The send_email function sends an email to the user with a link to confirm their email address.
         The function takes in three parameters:
         email: the user's email address, which is used as a unique identifier for them.
-        username: the username of the user who is registering. This will be displayed in 
-        their confirmation message so they know it was sent to them and not someone else. 
-        host: this is where we are hosting our application, which will be used as part of 
+        username: the username of the user who is registering. This will be displayed in
+        their confirmation message so they know it was sent to them and not someone else.
+        host: this is where we are hosting our application, which will be used as part of
         constructing our confirmation URL.
-    
+
     :param email: EmailStr: Validate the email address
     :param username: str: Pass the username to the template
     :param host: str: Pass the hostname of the server to the email template
@@ -39,16 +257,6 @@ async def send_email(email: EmailStr, username: str, host: str):
     """
     try:
         token_verification = auth_service.create_email_token({"sub": email})
-        message = MessageSchema(
-            subject="Confirm your email ",
-            recipients=[email],
-            template_body={"host": host, "username": username,
-                           "token": token_verification},
-            subtype=MessageType.html
-        )
-
-        fm = FastMail(conf)
-        await fm.send_message(message, template_name="email_template.html")
-    except ConnectionErrors as err:
-        print(err)
-
+        await send_confirmation(email, username, str(host), token_verification)
+    except EmailDeliveryError as err:
+        logger.error("email: %s", err)
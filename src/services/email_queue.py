@@ -0,0 +1,208 @@
+import asyncio
+import hashlib
+import logging
+
+import redis.asyncio as redis
+
+from src.services.auth import auth_service
+from src.services.email import EmailDeliveryError, send_confirmation
+from src.services.resources import resources
+from src.conf.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class EmailQueue:
+    """
+    A durable queue of outbound emails on a Redis Stream, drained by email_worker.py.
+    The API only appends a job (one XADD), so sending takes no time from API requests
+    and survives restarts of the API workers. Workers read through a consumer group:
+    a job stays pending until it is acknowledged, and jobs left by a crashed worker are claimed by another one.
+    Delivery is idempotent on (email, token): a job that was already sent is only acknowledged.
+    """
+    r = resources.redis_text
+
+    def __init__(self):
+        """
+        The __init__ function creates the counters.
+
+        :param self: Represent the instance of the class
+        """
+        self.enqueued = 0
+        self.sent = 0
+        self.duplicates = 0
+        self.retried = 0
+        self.dead = 0
+
+    @staticmethod
+    def job_key(email: str, token: str) -> str:
+        """
+        The job_key function identifies one email for idempotent delivery.
+
+        :param email: str: The recipient
+        :param token: str: The verification token in the email
+        :return: A hex digest
+        """
+        return hashlib.sha256(f"{email}:{token}".encode()).hexdigest()
+
+    async def enqueue(self, email: str, username: str, host: str) -> bool:
+        """
+        The enqueue function adds a confirmation email job to the stream.
+            The token is created here, so retries of the job send the same link.
+
+        :param self: Represent the instance of the class
+        :param email: str: The recipient
+        :param username: str: Pass the username to the template
+        :param host: str: Pass the hostname of the server to the email template
+        :return: False if the queue is disabled or Redis is unavailable; the caller should then send directly
+        """
+        if not settings.email_queue_enabled:
+            return False
+        token = auth_service.create_email_token({"sub": email})
+        job = {"email": email, "username": username, "host": str(host), "token": token,
+               "key": self.job_key(email, token), "attempts": 0}
+        try:
+            await self.r.xadd(settings.email_stream, job, maxlen=settings.email_stream_maxlen, approximate=True)
+        except redis.RedisError as err:
+            logger.warning("email queue: redis xadd failed: %s", err)
+            return False
+        self.enqueued += 1
+        return True
+
+    async def ensure_group(self) -> None:
+        """
+        The ensure_group function creates the stream and the consumer group if they do not exist yet.
+
+        :param self: Represent the instance of the class
+        :return: None
+        """
+        try:
+            await self.r.xgroup_create(settings.email_stream, settings.email_group, id="0", mkstream=True)
+        except redis.ResponseError as err:
+            if "BUSYGROUP" not in str(err):
+                raise
+
+    async def handle(self, message_id: str, job: dict) -> None:
+        """
+        The handle function delivers one job and acknowledges it.
+            A failed job is appended again with one more attempt, or to the dead-letter stream
+            after email_max_attempts; the original entry is acknowledged in the same transaction.
+            A job that fails any other way (a malformed payload, a template error) would fail again on every
+            retry, so it goes to the dead-letter stream at once instead of stopping the worker.
+            Redis errors are raised, the job then stays pending and is claimed again later.
+
+        :param self: Represent the instance of the class
+        :param message_id: str: The stream entry id
+        :param job: dict: The job fields
+        :return: None
+        """
+        try:
+            await self.deliver(message_id, job)
+        except redis.RedisError:
+            raise
+        except Exception as err:
+            logger.exception("email queue: job %s cannot be delivered", message_id)
+            await self.dead_letter(message_id, job, f"{type(err).__name__}: {err}")
+
+    async def deliver(self, message_id: str, job: dict) -> None:
+        sent_key = f"email:sent:{job['key']}"
+        if await self.r.exists(sent_key):
+            self.duplicates += 1
+            await self.r.xack(settings.email_stream, settings.email_group, message_id)
+            return
+        try:
+            await send_confirmation(job["email"], job["username"], job["host"], job["token"])
+        except EmailDeliveryError as err:
+            attempts = int(job.get("attempts", 0)) + 1
+            if attempts >= settings.email_max_attempts:
+                logger.error("email queue: giving up on %s: %s", message_id, err)
+                await self.dead_letter(message_id, {**job, "attempts": attempts}, str(err))
+                return
+            async with self.r.pipeline(transaction=True) as pipe:
+                pipe.xadd(settings.email_stream, {**job, "attempts": attempts},
+                          maxlen=settings.email_stream_maxlen, approximate=True)
+                pipe.xack(settings.email_stream, settings.email_group, message_id)
+                await pipe.execute()
+            self.retried += 1
+            return
+        async with self.r.pipeline(transaction=True) as pipe:
+            pipe.set(sent_key, 1, ex=settings.email_sent_ttl)
+            pipe.xack(settings.email_stream, settings.email_group, message_id)
+            await pipe.execute()
+        self.sent += 1
+
+    async def dead_letter(self, message_id: str, job: dict, error: str) -> None:
+        """
+        The dead_letter function moves a job to the dead-letter stream and acknowledges the original entry,
+            in one transaction.
+
+        :param self: Represent the instance of the class
+        :param message_id: str: The stream entry id
+        :param job: dict: The job fields
+        :param error: str: Why the job was given up
+        :return: None
+        """
+        async with self.r.pipeline(transaction=True) as pipe:
+            pipe.xadd(settings.email_dead_stream, {**job, "error": error})
+            pipe.xack(settings.email_stream, settings.email_group, message_id)
+            await pipe.execute()
+        self.dead += 1
+
+    async def process_batch(self, consumer: str, concurrency: int) -> int:
+        """
+        The process_batch function takes up to concurrency jobs, first those a dead consumer left pending,
+            then new ones, and delivers them concurrently.
+
+        :param self: Represent the instance of the class
+        :param consumer: str: The name of this worker in the consumer group
+        :param concurrency: int: The maximum number of emails sent at once
+        :return: The number of jobs taken
+        """
+        _, messages, *_ = await self.r.xautoclaim(settings.email_stream, settings.email_group, consumer,
+                                                  min_idle_time=settings.email_claim_idle_ms, start_id="0-0",
+                                                  count=concurrency)
+        if not messages:
+            response = await self.r.xreadgroup(settings.email_group, consumer, {settings.email_stream: ">"},
+                                               count=concurrency, block=settings.email_block_ms)
+            messages = response[0][1] if response else []
+        for message_id, job in messages:
+            if not job:
+                await self.r.xack(settings.email_stream, settings.email_group, message_id)
+        # every job of the batch finishes before a Redis error, the only kind handle raises, is passed on
+        results = await asyncio.gather(*(self.handle(message_id, job) for message_id, job in messages if job),
+                                       return_exceptions=True)
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            raise errors[0]
+        return len(messages)
+
+    async def run(self, consumer: str, concurrency: int, stop: asyncio.Event) -> None:
+        """
+        The run function drains the queue until stop is set. Redis errors are logged and retried.
+
+        :param self: Represent the instance of the class
+        :param consumer: str: The name of this worker in the consumer group
+        :param concurrency: int: The maximum number of emails sent at once
+        :param stop: asyncio.Event: Set it to finish after the current batch
+        :return: None
+        """
+        await self.ensure_group()
+        while not stop.is_set():
+            try:
+                await self.process_batch(consumer, concurrency)
+            except redis.RedisError as err:
+                logger.warning("email queue: redis error: %s", err)
+                await asyncio.sleep(1)
+
+    def stats(self) -> dict:
+        """
+        The stats function returns the counters of this process.
+
+        :param self: Represent the instance of the class
+        :return: A dict of counters
+        """
+        return {"enqueued": self.enqueued, "sent": self.sent, "duplicates": self.duplicates,
+                "retried": self.retried, "dead": self.dead}
+
+
+email_queue = EmailQueue()
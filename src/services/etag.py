@@ -0,0 +1,42 @@
+import hashlib
+import json
+
+from fastapi import Request, Response, status
+
+
+def make_etag(*parts) -> str:
+    """
+    The make_etag function builds a strong entity tag from the values a response depends on.
+
+    :param parts: The values, e.g. the route, the query parameters and the version of the data
+    :return: A quoted ETag
+    """
+    raw = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str).encode()
+    return f'"{hashlib.sha1(raw).hexdigest()}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """
+    The etag_matches function tells whether an If-None-Match header lists the entity tag.
+
+    :param if_none_match: str | None: The If-None-Match header of the request
+    :param etag: str: The current ETag of the resource
+    :return: True if the client already has this version
+    """
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
+
+
+def not_modified(request: Request, etag: str) -> Response | None:
+    """
+    The not_modified function answers 304 Not Modified if the client sent the current ETag.
+
+    :param request: Request: The request with the If-None-Match header
+    :param etag: str: The current ETag of the resource
+    :return: A 304 response, or None if the full response has to be sent
+    """
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    return None
@@ -0,0 +1,40 @@
+from io import BytesIO
+from typing import BinaryIO
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from src.conf.config import settings
+
+AVATAR_FORMATS = {"JPEG", "PNG", "GIF", "WEBP"}
+
+
+class InvalidImage(Exception):
+    """
+    Raised when an upload is not an image in one of the AVATAR_FORMATS, or is too large to decode.
+    """
+
+
+def resize_avatar(source: BinaryIO, size: int = settings.avatar_size) -> bytes:
+    """
+    The resize_avatar function decodes an uploaded image, crops it to a centered square and scales it to size x size.
+        It is CPU-bound and blocking, so it runs in the image worker pool. The dimensions are checked
+        from the header before the pixels are decoded, so a decompression bomb is rejected cheaply.
+
+    :param source: BinaryIO: The uploaded file
+    :param size: int: The side of the avatar in pixels
+    :return: The avatar encoded as JPEG
+    :raises InvalidImage: If the file is not a supported image
+    """
+    try:
+        with Image.open(source) as image:
+            if image.format not in AVATAR_FORMATS:
+                raise InvalidImage(f"Unsupported image format {image.format}")
+            if image.width * image.height > settings.avatar_max_pixels:
+                raise InvalidImage("Image dimensions are too large")
+            image = ImageOps.exif_transpose(image)
+            avatar = ImageOps.fit(image.convert("RGB"), (size, size), Image.LANCZOS)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as err:
+        raise InvalidImage("File is not a valid image") from err
+    output = BytesIO()
+    avatar.save(output, format="JPEG", quality=85, optimize=True)
+    return output.getvalue()
@@ -0,0 +1,204 @@
+from bisect import bisect_left
+from typing import AsyncIterator
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """
+    A cumulative latency histogram with fixed upper bounds, in the shape Prometheus expects.
+    """
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        """
+        The __init__ function creates an empty histogram.
+
+        :param self: Represent the instance of the class
+        :param buckets: tuple: The upper bounds of the buckets in seconds
+        """
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        """
+        The observe function records one measurement.
+
+        :param self: Represent the instance of the class
+        :param value: float: The measured value, e.g. a latency in seconds
+        :return: None
+        """
+        self.count += 1
+        self.sum += value
+        index = bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+
+    def snapshot(self) -> dict:
+        """
+        The snapshot function returns the cumulative bucket counts together with the total count and sum.
+
+        :param self: Represent the instance of the class
+        :return: A dict with buckets (upper bound label, "+Inf" for the last one -> cumulative count), count and sum
+        """
+        cumulative, buckets = 0, {}
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            buckets[f"{bound:g}"] = cumulative
+        buckets["+Inf"] = self.count
+        return {"buckets": buckets, "count": self.count, "sum": self.sum}
+
+
+def _escape(value) -> str:
+    """
+    The _escape function escapes a label value as the Prometheus text format requires.
+
+    :param value: The label value
+    :return: The value with backslashes, quotes and line breaks escaped
+    """
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: dict) -> str:
+    """
+    The _labels function formats a label set in the Prometheus exposition format.
+
+    :param labels: dict: Label names and values
+    :return: The label set in braces, or an empty string if there are no labels
+    """
+    if not labels:
+        return ""
+    escaped = (f'{name}="{_escape(value)}"' for name, value in labels.items())
+    return "{" + ",".join(escaped) + "}"
+
+
+def render_histogram(name: str, snapshot: dict, labels: dict = None) -> list[str]:
+    """
+    The render_histogram function turns a Histogram snapshot into Prometheus sample lines.
+
+    :param name: str: The metric name
+    :param snapshot: dict: The result of Histogram.snapshot()
+    :param labels: dict: Extra labels of every sample
+    :return: The _bucket, _sum and _count lines
+    """
+    labels = labels or {}
+    lines = [f"{name}_bucket{_labels({**labels, 'le': bound})} {count}"
+             for bound, count in snapshot["buckets"].items()]
+    lines.append(f"{name}_sum{_labels(labels)} {snapshot['sum']}")
+    lines.append(f"{name}_count{_labels(labels)} {snapshot['count']}")
+    return lines
+
+
+def render_stats(prefix: str, stats: dict) -> list[str]:
+    """
+    The render_stats function exposes a stats() dict as Prometheus gauges;
+        nested dicts extend the metric name and histogram snapshots are rendered as histograms.
+
+    :param prefix: str: The metric name prefix, e.g. db_pool
+    :param stats: dict: The statistics to expose
+    :return: The exposition lines
+    """
+    lines = []
+    for key, value in stats.items():
+        name = f"{prefix}_{key}"
+        if isinstance(value, dict) and "buckets" in value:
+            lines.append(f"# TYPE {name} histogram")
+            lines.extend(render_histogram(name, value))
+        elif isinstance(value, dict):
+            lines.extend(render_stats(name, value))
+        elif isinstance(value, (int, float)):
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {float(value):g}" if isinstance(value, float) else f"{name} {int(value)}")
+    return lines
+
+
+class HttpMetrics:
+    """
+    Per-route request metrics collected by the HTTP middleware and exposed at /metrics.
+    Routes are labelled by their template (e.g. /api/contacts/{contact_id}) so the number of series stays bounded.
+    """
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        """
+        The __init__ function creates empty metrics.
+
+        :param self: Represent the instance of the class
+        :param buckets: tuple: The latency histogram buckets in seconds
+        """
+        self.buckets = buckets
+        self.latency: dict[tuple, Histogram] = {}
+        self.in_flight: dict[str, int] = {}
+        self.request_bytes: dict[tuple, int] = {}
+        self.response_bytes: dict[tuple, int] = {}
+
+    def started(self, method: str) -> None:
+        """
+        The started function counts a request that is being handled.
+
+        :param self: Represent the instance of the class
+        :param method: str: The HTTP method
+        :return: None
+        """
+        self.in_flight[method] = self.in_flight.get(method, 0) + 1
+
+    def finished(self, method: str, route: str, status: int, duration: float, request_size: int) -> None:
+        """
+        The finished function records a handled request.
+
+        :param self: Represent the instance of the class
+        :param method: str: The HTTP method
+        :param route: str: The route template
+        :param status: int: The response status code
+        :param duration: float: The time until the response headers were ready, in seconds
+        :param request_size: int: The request body size in bytes
+        :return: None
+        """
+        self.in_flight[method] -= 1
+        key = (method, route, status)
+        if key not in self.latency:
+            self.latency[key] = Histogram(self.buckets)
+        self.latency[key].observe(duration)
+        self.request_bytes[method, route] = self.request_bytes.get((method, route), 0) + request_size
+
+    async def count_body(self, method: str, route: str, body: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """
+        The count_body function passes a response body through and adds its size to the response byte counter,
+            which also works for streamed responses without a Content-Length.
+
+        :param self: Represent the instance of the class
+        :param method: str: The HTTP method
+        :param route: str: The route template
+        :param body: AsyncIterator[bytes]: The response body iterator
+        :return: The same chunks
+        """
+        async for chunk in body:
+            size = len(chunk) if isinstance(chunk, (bytes, bytearray, memoryview)) else len(chunk.encode())
+            self.response_bytes[method, route] = self.response_bytes.get((method, route), 0) + size
+            yield chunk
+
+    def render(self) -> list[str]:
+        """
+        The render function returns the request metrics in the Prometheus text format.
+
+        :param self: Represent the instance of the class
+        :return: The exposition lines
+        """
+        lines = ["# HELP http_request_duration_seconds Time until the response headers were ready.",
+                 "# TYPE http_request_duration_seconds histogram"]
+        for (method, route, status), histogram in sorted(self.latency.items()):
+            labels = {"method": method, "route": route, "status": status}
+            lines.extend(render_histogram("http_request_duration_seconds", histogram.snapshot(), labels))
+        lines += ["# HELP http_requests_in_flight Requests being handled.",
+                  "# TYPE http_requests_in_flight gauge"]
+        for method, value in sorted(self.in_flight.items()):
+            lines.append(f"http_requests_in_flight{_labels({'method': method})} {value}")
+        for name, counter, help_text in (("http_request_size_bytes_total", self.request_bytes, "Request body bytes."),
+                                         ("http_response_size_bytes_total", self.response_bytes, "Response body bytes.")):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+            for (method, route), value in sorted(counter.items()):
+                lines.append(f"{name}{_labels({'method': method, 'route': route})} {value}")
+        return lines
+
+
+http_metrics = HttpMetrics()
@@ -0,0 +1,222 @@
+import hashlib
+import logging
+import math
+import time
+from dataclasses import dataclass
+
+import redis.asyncio as redis
+from fastapi import Depends, HTTPException, Request, status
+from redis.exceptions import NoScriptError
+
+from src.services.auth import auth_service
+from src.services.cache import TTLCache
+from src.services.resources import resources
+from src.conf.config import settings
+
+logger = logging.getLogger(__name__)
+
+# KEYS[1]: the bucket hash; ARGV: capacity, refill rate per second, now, tokens to take, unused tokens to give back.
+# Refills the bucket for the time since the last call, returns the unused tokens of the previous lease,
+# takes up to the requested number of whole tokens and answers {granted, seconds until the next token}.
+TOKEN_BUCKET = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local requested = tonumber(ARGV[4])
+local refund = tonumber(ARGV[5])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate + refund)
+local granted = math.min(requested, math.floor(tokens))
+tokens = tokens - granted
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+local retry_after = 0
+if granted == 0 then
+  retry_after = (1 - tokens) / rate
+end
+return {granted, tostring(retry_after)}
+"""
+TOKEN_BUCKET_SHA = hashlib.sha1(TOKEN_BUCKET.encode()).hexdigest()
+
+
+@dataclass(frozen=True)
+class RatePolicy:
+    """
+    A token bucket of times tokens that refills completely in seconds,
+    i.e. a burst of times requests and then times/seconds requests per second.
+    """
+    times: int
+    seconds: float
+
+    @classmethod
+    def parse(cls, spec: str) -> "RatePolicy":
+        """
+        The parse function reads a policy written as "times/seconds", e.g. "2/5".
+
+        :param spec: str: The policy from the settings
+        :return: A RatePolicy
+        """
+        times, seconds = spec.split("/")
+        return cls(int(times), float(seconds))
+
+    @property
+    def rate(self) -> float:
+        return self.times / self.seconds
+
+
+@dataclass
+class Lease:
+    """
+    Tokens taken from the Redis bucket in advance and spent by this process without asking Redis,
+    or, when denied, a refusal that holds until the next token is due.
+    """
+    tokens: int
+    sync_at: float
+    denied: bool = False
+
+
+class RateLimiter:
+    """
+    Per-user token buckets in Redis, checked and updated by one atomic Lua call.
+    With settings.rate_limit_local each process takes a batch of tokens per call and spends them locally
+    until they run out or rate_limit_sync_interval passes; unused tokens go back with the next call.
+    A limited user is also remembered locally until the next token is due, so Redis sees about one call
+    per active user and interval instead of one per request. If Redis is unavailable requests are let through.
+    """
+    r = resources.redis
+
+    def __init__(self):
+        """
+        The __init__ function creates the local leases and the counters.
+
+        :param self: Represent the instance of the class
+        """
+        self.leases = TTLCache(maxsize=settings.rate_limit_local_size, ttl=settings.rate_limit_sync_interval)
+        self.allowed: dict[str, int] = {}
+        self.limited: dict[str, int] = {}
+        self.redis_calls = 0
+        self.errors = 0
+
+    @staticmethod
+    def policy(name: str) -> RatePolicy | None:
+        spec = settings.rate_limits.get(name)
+        return RatePolicy.parse(spec) if spec else None
+
+    @staticmethod
+    def bucket_key(name: str, identity: str) -> str:
+        return f"ratelimit:{name}:{identity}"
+
+    async def take(self, key: str, policy: RatePolicy, requested: int, refund: int) -> tuple[int, float]:
+        """
+        The take function runs the token bucket script, loading it into Redis first if the server does not know it.
+
+        :param self: Represent the instance of the class
+        :param key: str: The bucket key
+        :param policy: RatePolicy: The size and refill rate of the bucket
+        :param requested: int: How many tokens to take
+        :param refund: int: Unused tokens of the previous lease
+        :return: The number of tokens granted and the seconds until the next token if none was
+        """
+        args = (policy.times, policy.rate, time.time(), requested, refund)
+        self.redis_calls += 1
+        try:
+            granted, retry_after = await self.r.evalsha(TOKEN_BUCKET_SHA, 1, key, *args)
+        except NoScriptError:
+            granted, retry_after = await self.r.eval(TOKEN_BUCKET, 1, key, *args)
+        return int(granted), float(retry_after)
+
+    async def check(self, name: str, identity: str) -> float | None:
+        """
+        The check function spends one token of the identity's bucket for the named policy.
+
+        :param self: Represent the instance of the class
+        :param name: str: The policy name in settings.rate_limits
+        :param identity: str: Whose bucket it is, e.g. "user:<email>"
+        :return: None if the request may proceed, otherwise the seconds after which it may be retried
+        """
+        policy = self.policy(name)
+        if not settings.rate_limit_enabled or policy is None:
+            return None
+        key = self.bucket_key(name, identity)
+        local = settings.rate_limit_local
+        now = time.monotonic()
+        lease = self.leases.get(key) if local else None
+        refund = 0
+        if lease is not None:
+            if lease.sync_at > now and lease.tokens > 0:
+                lease.tokens -= 1
+                return self.count(self.allowed, name, None)
+            if lease.sync_at > now and lease.denied:
+                return self.count(self.limited, name, lease.sync_at - now)
+            refund = lease.tokens
+        requested = min(settings.rate_limit_local_batch, policy.times) if local else 1
+        try:
+            granted, retry_after = await self.take(key, policy, requested, refund)
+        except redis.RedisError as err:
+            logger.warning("rate limit: redis call failed: %s", err)
+            self.errors += 1
+            return None
+        if local:
+            interval = settings.rate_limit_sync_interval if granted else retry_after
+            self.leases.set(key, Lease(max(granted - 1, 0), now + interval, denied=not granted), ttl=policy.seconds)
+        if granted:
+            return self.count(self.allowed, name, None)
+        return self.count(self.limited, name, retry_after)
+
+    @staticmethod
+    def count(counters: dict[str, int], name: str, retry_after: float | None) -> float | None:
+        counters[name] = counters.get(name, 0) + 1
+        return retry_after
+
+    def stats(self) -> dict:
+        """
+        The stats function returns the allowed/limited counters per policy, the Redis calls and errors.
+
+        :param self: Represent the instance of the class
+        :return: A dict of counters
+        """
+        names = sorted(set(self.allowed) | set(self.limited))
+        return {
+            "redis_calls": self.redis_calls,
+            "errors": self.errors,
+            "leases": len(self.leases),
+            **{name: {"allowed": self.allowed.get(name, 0), "limited": self.limited.get(name, 0)} for name in names},
+        }
+
+
+rate_limiter = RateLimiter()
+
+
+class RateLimit:
+    """
+    A route dependency that applies the named policy to the user of the access token,
+    or to the client address when the request has no valid token.
+    """
+
+    def __init__(self, name: str):
+        """
+        The __init__ function binds the dependency to a policy in settings.rate_limits.
+
+        :param self: Represent the instance of the class
+        :param name: str: The policy name
+        """
+        self.name = name
+
+    async def __call__(self, request: Request, token: str = Depends(auth_service.oauth2_scheme)) -> None:
+        """
+        The __call__ function raises 429 Too Many Requests with a Retry-After header when the bucket is empty.
+            The subject comes from the verified token cache, so the check costs no database query.
+
+        :param self: Represent the instance of the class
+        :param request: Request: Read the client address
+        :param token: str: The access token
+        :return: None
+        """
+        email = auth_service.verify_access_token(token)
+        identity = f"user:{email}" if email else f"ip:{request.client.host if request.client else 'unknown'}"
+        retry_after = await rate_limiter.check(self.name, identity)
+        if retry_after is not None:
+            raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Too many requests",
+                                headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
@@ -0,0 +1,189 @@
+import asyncio
+import inspect
+import logging
+import time
+from functools import cached_property
+from typing import Awaitable, Callable
+
+from redis.asyncio import Redis
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from src.conf.config import settings
+from src.database.db import engine, replica_router
+
+logger = logging.getLogger(__name__)
+
+Hook = Callable[[], Awaitable[None] | None]
+
+
+class Resources:
+    """
+    The long-lived resources of the application: the database engine, the Redis clients and whatever
+    the services register (SMTP pool, thread pools, warm-up jobs). Clients are created on first use and
+    connect lazily; the lifespan of the app calls startup, which warms them up, and shutdown, which closes them.
+    """
+
+    def __init__(self, engine: AsyncEngine):
+        """
+        The __init__ function creates an empty container around the engine.
+
+        :param self: Represent the instance of the class
+        :param engine: AsyncEngine: The application engine
+        """
+        self.engine = engine
+        self.warmups: dict[str, Hook] = {"redis": self.ping_redis, "db_pool": self.fill_db_pool}
+        self.closers: dict[str, Hook] = {}
+        self.timings: dict[str, float] = {}
+        self.warmup_failures = 0
+        self.startup_seconds = 0.0
+
+    @cached_property
+    def redis(self) -> Redis:
+        """
+        The redis function returns the client shared by the caches and the rate limiter; it answers bytes.
+
+        :param self: Represent the instance of the class
+        :return: A Redis client
+        """
+        return Redis(host=settings.redis_host, port=settings.redis_port, db=0)
+
+    @cached_property
+    def redis_text(self) -> Redis:
+        """
+        The redis_text function returns the client that decodes answers to str, used by the email queue.
+
+        :param self: Represent the instance of the class
+        :return: A Redis client
+        """
+        return Redis(host=settings.redis_host, port=settings.redis_port, db=0, decode_responses=True)
+
+    def on_startup(self, name: str, hook: Hook) -> None:
+        """
+        The on_startup function registers a warm-up job; jobs run concurrently at startup.
+
+        :param self: Represent the instance of the class
+        :param name: str: The name of the job in the startup report
+        :param hook: Hook: A function or coroutine function without arguments
+        :return: None
+        """
+        self.warmups[name] = hook
+
+    def on_shutdown(self, name: str, hook: Hook) -> None:
+        """
+        The on_shutdown function registers a closer; closers run in reverse order of registration.
+
+        :param self: Represent the instance of the class
+        :param name: str: The name of the resource
+        :param hook: Hook: A function or coroutine function without arguments
+        :return: None
+        """
+        self.closers[name] = hook
+
+    async def ping_redis(self) -> None:
+        await self.redis.ping()
+
+    async def fill_db_pool(self) -> None:
+        """
+        The fill_db_pool function opens settings.warmup_db_connections connections at once and returns them
+            to the pool, so the first requests do not pay for connecting.
+
+        :param self: Represent the instance of the class
+        :return: None
+        """
+        count = settings.warmup_db_connections
+        if count is None:
+            count = settings.db_pool_size
+        results = await asyncio.gather(*(self.engine.connect().start() for _ in range(count)), return_exceptions=True)
+        for connection in results:
+            if not isinstance(connection, BaseException):
+                await connection.close()
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            raise errors[0]
+
+    async def timed(self, name: str, hook: Hook) -> None:
+        """
+        The timed function runs a warm-up job and records its duration. A failed job is logged and counted,
+            the application starts anyway and connects on demand.
+
+        :param self: Represent the instance of the class
+        :param name: str: The name of the job
+        :param hook: Hook: The job
+        :return: None
+        """
+        start = time.perf_counter()
+        try:
+            result = hook()
+            if inspect.isawaitable(result):
+                await result
+        except Exception as err:
+            logger.warning("startup: %s failed: %s", name, err)
+            self.warmup_failures += 1
+        finally:
+            self.timings[name] = time.perf_counter() - start
+
+    async def startup(self) -> None:
+        """
+        The startup function runs the warm-up jobs concurrently and logs how long startup took.
+
+        :param self: Represent the instance of the class
+        :return: None
+        """
+        start = time.perf_counter()
+        if settings.warmup_enabled:
+            await asyncio.gather(*(self.timed(name, hook) for name, hook in self.warmups.items()))
+        self.startup_seconds = time.perf_counter() - start
+        logger.info("startup: ready in %.3fs %s", self.startup_seconds,
+                    {name: round(seconds, 3) for name, seconds in self.timings.items()})
+
+    async def shutdown(self) -> None:
+        """
+        The shutdown function closes the registered resources, then the Redis clients and the engine.
+            Every step gets settings.shutdown_timeout seconds; a failure does not stop the others.
+            Synchronous closers, such as joining a thread pool, run in a thread so that the timeout
+            also bounds them instead of blocking the event loop.
+
+        :param self: Represent the instance of the class
+        :return: None
+        """
+        steps = list(reversed(self.closers.items()))
+        for attribute in ("redis", "redis_text"):
+            if attribute in self.__dict__:
+                steps.append((attribute, self.__dict__[attribute].close))
+        steps.append(("engine", self.engine.dispose))
+        for name, hook in steps:
+            try:
+                await asyncio.wait_for(self.close(hook), settings.shutdown_timeout)
+            except asyncio.TimeoutError:
+                logger.warning("shutdown: closing %s timed out after %ss", name, settings.shutdown_timeout)
+            except Exception as err:
+                logger.warning("shutdown: closing %s failed: %s", name, err)
+
+    @staticmethod
+    async def close(hook: Hook) -> None:
+        if inspect.iscoroutinefunction(hook):
+            await hook()
+            return
+        result = await asyncio.to_thread(hook)
+        if inspect.isawaitable(result):
+            await result
+
+    def stats(self) -> dict:
+        """
+        The stats function returns the startup time and the duration of every warm-up job.
+
+        :param self: Represent the instance of the class
+        :return: A dict of timings in seconds
+        """
+        return {
+            "startup_seconds": self.startup_seconds,
+            "warmup_failures": self.warmup_failures,
+            "warmup_seconds": dict(self.timings),
+        }
+
+
+resources = Resources(engine)
+if replica_router.replicas:
+    replica_router.r = resources.redis
+    resources.on_startup("db_replicas", replica_router.check)
+    resources.on_shutdown("db_replicas", replica_router.close)
@@ -0,0 +1,182 @@
+import hashlib
+import json
+import logging
+import time
+from typing import Any, Awaitable, Callable
+
+import redis.asyncio as redis
+from fastapi import Response
+from fastapi.responses import ORJSONResponse
+from fastapi.encoders import jsonable_encoder
+from pydantic import parse_obj_as
+
+from src.services.resources import resources
+from src.conf.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """
+    A Redis cache of serialized responses of the contact read endpoints, shared by all workers.
+    Every key contains the user's contacts version; a write bumps the version, which makes all cached
+    responses of that user unreachable at once without scanning keys. The old keys simply expire.
+    A version starts from the clock, so after Redis lost it (flushed, evicted) it does not repeat an earlier one.
+    """
+    r = resources.redis
+
+    def __init__(self):
+        """
+        The __init__ function creates the hit/miss counters.
+
+        :param self: Represent the instance of the class
+        """
+        self.hits: dict[str, int] = {}
+        self.misses: dict[str, int] = {}
+        self.errors = 0
+
+    @staticmethod
+    def version_key(user_id: int) -> str:
+        return f"contacts:version:{user_id}"
+
+    @staticmethod
+    def response_key(user_id: int, version: int, route: str, params: dict) -> str:
+        """
+        The response_key function builds the key of a cached response.
+
+        :param user_id: int: The owner of the contacts
+        :param version: int: The current contacts version of the user
+        :param route: str: The name of the cached route
+        :param params: dict: The query and path parameters that change the response
+        :return: The Redis key
+        """
+        digest = hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+        return f"contacts:response:{user_id}:{version}:{route}:{digest}"
+
+    async def version(self, user_id: int) -> int | None:
+        """
+        The version function returns the contacts version of the user, starting one if there is none yet.
+            List ETags are built from it, so a conditional request needs no database query.
+
+        :param self: Represent the instance of the class
+        :param user_id: int: The owner of the contacts
+        :return: The version, or None if Redis is unavailable
+        """
+        key = self.version_key(user_id)
+        try:
+            version = await self.r.get(key)
+            if version is None:
+                await self.r.set(key, time.time_ns() // 1000, nx=True)
+                version = await self.r.get(key)
+        except redis.RedisError as err:
+            logger.warning("response cache: redis get failed: %s", err)
+            self.errors += 1
+            return None
+        return int(version)
+
+    def enabled(self, route: str) -> bool:
+        """
+        The enabled function tells whether responses of the route may be cached.
+
+        :param self: Represent the instance of the class
+        :param route: str: The name of the route
+        :return: False if caching is switched off globally or for this route
+        """
+        return settings.response_cache_enabled and route not in settings.response_cache_disabled_routes
+
+    async def get_or_set(self, route: str, user_id: int, params: dict, model: Any,
+                         produce: Callable[[], Awaitable[Any]], trusted: bool = False,
+                         version: int | None = None) -> Response:
+        """
+        The get_or_set function returns the cached response for the parameters,
+            or calls produce, serializes its result through model and caches it.
+            If Redis is unavailable the response is produced without the cache.
+
+        :param self: Represent the instance of the class
+        :param route: str: The name of the route, used in the key and in the metrics
+        :param user_id: int: The owner of the contacts
+        :param params: dict: The parameters that change the response
+        :param model: Any: The response model, e.g. List[ContactResponse]
+        :param produce: Callable[[], Awaitable[Any]]: Loads the data from the database; may raise HTTPException
+        :param trusted: bool: produce returns plain rows in the shape of the model, see render
+        :param version: int | None: The contacts version, if the caller already has it
+        :return: A JSON response
+        """
+        if not self.enabled(route):
+            return self.render(model, await produce(), trusted)
+        key = None
+        body = None
+        if version is None:
+            version = await self.version(user_id)
+        if version is not None:
+            key = self.response_key(user_id, version, route, params)
+            try:
+                body = await self.r.get(key)
+            except redis.RedisError as err:
+                logger.warning("response cache: redis get failed: %s", err)
+                self.errors += 1
+        if body is not None:
+            self.hits[route] = self.hits.get(route, 0) + 1
+            return Response(content=body, media_type="application/json")
+        self.misses[route] = self.misses.get(route, 0) + 1
+        response = self.render(model, await produce(), trusted)
+        if key is not None:
+            try:
+                await self.r.set(key, response.body, ex=settings.response_cache_ttl)
+            except redis.RedisError as err:
+                logger.warning("response cache: redis set failed: %s", err)
+                self.errors += 1
+        return response
+
+    @staticmethod
+    def render(model: Any, data: Any, trusted: bool = False) -> Response:
+        """
+        The render function validates the data with the response model and serializes it to JSON once.
+            Trusted data (rows selected with exactly the model's columns) skips the validation
+            and is encoded with orjson.
+
+        :param model: Any: The response model
+        :param data: Any: ORM objects or plain data
+        :param trusted: bool: data is a list of rows, or a dict with such a list under items
+        :return: A JSON response
+        """
+        if trusted:
+            if isinstance(data, dict):
+                return ORJSONResponse({**data, "items": [row._asdict() for row in data["items"]]})
+            return ORJSONResponse([row._asdict() for row in data])
+        content = json.dumps(jsonable_encoder(parse_obj_as(model, data)), separators=(",", ":"))
+        return Response(content=content, media_type="application/json")
+
+    async def bump(self, user_id: int) -> None:
+        """
+        The bump function invalidates every cached response of the user by incrementing the contacts version.
+
+        :param self: Represent the instance of the class
+        :param user_id: int: The owner of the contacts
+        :return: None
+        """
+        key = self.version_key(user_id)
+        try:
+            async with self.r.pipeline(transaction=True) as pipe:
+                pipe.set(key, time.time_ns() // 1000, nx=True)
+                pipe.incr(key)
+                await pipe.execute()
+        except redis.RedisError as err:
+            logger.warning("response cache: redis incr failed: %s", err)
+            self.errors += 1
+
+    def stats(self) -> dict:
+        """
+        The stats function returns the hit/miss counters per route and the number of Redis errors.
+
+        :param self: Represent the instance of the class
+        :return: A dict of counters
+        """
+        routes = sorted(set(self.hits) | set(self.misses))
+        return {
+            "errors": self.errors,
+            **{route: {"hits": self.hits.get(route, 0), "misses": self.misses.get(route, 0)} for route in routes},
+        }
+
+
+response_cache = ResponseCache()
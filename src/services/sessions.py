@@ -0,0 +1,256 @@
+import hashlib
+import logging
+import re
+import uuid
+
+import redis.asyncio as redis
+from fastapi import HTTPException, status
+from redis.exceptions import NoScriptError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.database.models import User
+from src.repository import users as repository_users
+from src.services.auth import auth_service
+from src.services.resources import resources
+from src.conf.config import settings
+
+logger = logging.getLogger(__name__)
+
+# KEYS[1]: the session hash, KEYS[2]: the generation counter of the user; ARGV: jti, ttl, device label.
+# Opens the session and answers the generation the token is issued in.
+OPEN_SESSION = """
+local generation = tonumber(redis.call('GET', KEYS[2]) or '0')
+redis.call('HSET', KEYS[1], 'jti', ARGV[1], 'gen', generation, 'device', ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return generation
+"""
+
+# KEYS as above; ARGV: presented jti, generation of the presented token, new jti, ttl.
+# Answers the generation for the new token, or -1 if the presented token was already used (the session
+# is deleted), -2 if the user revoked all sessions since the token was issued, -3 if there is no session.
+ROTATE_SESSION = """
+local generation = tonumber(redis.call('GET', KEYS[2]) or '0')
+if tonumber(ARGV[2]) < generation then
+  redis.call('DEL', KEYS[1])
+  return -2
+end
+local current = redis.call('HGET', KEYS[1], 'jti')
+if not current then
+  return -3
+end
+if current ~= ARGV[1] then
+  redis.call('DEL', KEYS[1])
+  return -1
+end
+redis.call('HSET', KEYS[1], 'jti', ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return generation
+"""
+
+REUSED, REVOKED, MISSING = -1, -2, -3
+DEVICE_ID = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
+
+class SessionStore:
+    """
+    Refresh token sessions in Redis, one hash per login, expiring with the refresh token.
+    Every refresh token belongs to a session (sid, its token family, always chosen by the server; the client's
+    device label is only stored with it) and has its own id (jti); using it
+    rotates the session to a new jti. Presenting an older token of the family means it was stolen or
+    replayed, so the whole session is revoked. Revoking all sessions of a user increments one counter:
+    tokens issued in an older generation are refused, without looking for the user's sessions.
+    If Redis is unavailable the token is kept in users.refresh_token instead, as before.
+    """
+    r = resources.redis
+
+    def __init__(self):
+        """
+        The __init__ function creates the counters.
+
+        :param self: Represent the instance of the class
+        """
+        self.issued = 0
+        self.rotated = 0
+        self.reused = 0
+        self.rejected = 0
+        self.fallbacks = 0
+
+    @staticmethod
+    def user_key(email: str) -> str:
+        return hashlib.sha1(email.encode()).hexdigest()
+
+    def session_key(self, email: str, sid: str) -> str:
+        return f"session:{self.user_key(email)}:{sid}"
+
+    def generation_key(self, email: str) -> str:
+        return f"session:generation:{self.user_key(email)}"
+
+    async def script(self, source: str, keys: list, args: list) -> int:
+        """
+        The script function runs a Lua script by its digest, sending the source only if Redis does not know it yet.
+
+        :param self: Represent the instance of the class
+        :param source: str: The script
+        :param keys: list: The keys it touches
+        :param args: list: Its arguments
+        :return: The integer the script answers
+        """
+        sha = hashlib.sha1(source.encode()).hexdigest()
+        try:
+            return int(await self.r.evalsha(sha, len(keys), *keys, *args))
+        except NoScriptError:
+            return int(await self.r.eval(source, len(keys), *keys, *args))
+
+    def use_redis(self) -> bool:
+        return settings.refresh_token_store == "redis"
+
+    async def token(self, email: str, sid: str, jti: str, generation: int) -> str:
+        return await auth_service.create_refresh_token({"sub": email, "sid": sid, "jti": jti, "gen": generation},
+                                                       expires_delta=settings.refresh_token_ttl)
+
+    async def issue(self, user: User, db: AsyncSession, device: str | None = None) -> str:
+        """
+        The issue function opens a new session and returns its first refresh token.
+            The session id is generated here, never taken from the client, so a client cannot name
+            (and so replace) a session of another login.
+
+        :param self: Represent the instance of the class
+        :param user: User: The user who logged in
+        :param db: AsyncSession: Access the database, only used without Redis
+        :param device: str | None: A client-chosen device label (X-Device-Id), stored with the session if valid
+        :return: The refresh token
+        """
+        sid = uuid.uuid4().hex
+        label = device if device and DEVICE_ID.match(device) else ""
+        jti = uuid.uuid4().hex
+        if self.use_redis():
+            try:
+                generation = await self.script(OPEN_SESSION, [self.session_key(user.email, sid),
+                                                              self.generation_key(user.email)],
+                                               [jti, settings.refresh_token_ttl, label])
+                self.issued += 1
+                return await self.token(user.email, sid, jti, generation)
+            except redis.RedisError as err:
+                self.fallback(err)
+        refresh_token = await auth_service.create_refresh_token({"sub": user.email, "jti": jti},
+                                                                expires_delta=settings.refresh_token_ttl)
+        await repository_users.update_token(user, refresh_token, db)
+        self.issued += 1
+        return refresh_token
+
+    async def rotate(self, refresh_token: str, db: AsyncSession) -> tuple[str, str]:
+        """
+        The rotate function exchanges a refresh token for the next one of its session.
+            Tokens without a session (issued while Redis was unavailable) are taken out of users.refresh_token
+            by one conditional UPDATE on the primary before the next token is issued, so such a token can only be
+            used once, even by concurrent requests or while a replica still has it.
+            Session tokens are only known to Redis, so while it is unavailable they get 503 rather than 401.
+
+        :param self: Represent the instance of the class
+        :param refresh_token: str: The presented refresh token
+        :param db: AsyncSession: Access the database, only used for tokens without a session
+        :return: The email of the user and the new refresh token
+        :raises HTTPException: 401 if the token is invalid, reused or revoked; 503 if Redis is unavailable
+        """
+        payload = await auth_service.decode_refresh_payload(refresh_token)
+        email = payload["sub"]
+        sid = payload.get("sid")
+        if sid is not None and self.use_redis():
+            jti = uuid.uuid4().hex
+            try:
+                result = await self.script(ROTATE_SESSION, [self.session_key(email, sid), self.generation_key(email)],
+                                           [payload.get("jti", ""), payload.get("gen", 0), jti,
+                                            settings.refresh_token_ttl])
+            except redis.RedisError as err:
+                self.fallback(err)
+                raise self.unavailable()
+            if result == REUSED:
+                logger.warning("sessions: refresh token reused, session %s revoked", sid)
+                self.reused += 1
+                raise self.invalid()
+            if result < 0:
+                raise self.invalid()
+            self.rotated += 1
+            return email, await self.token(email, sid, jti, result)
+        if sid is not None:
+            raise self.invalid()
+        if not await repository_users.revoke_token(email, db, refresh_token):
+            # an older token of the user: whoever presents it, the current one is revoked as well
+            await repository_users.revoke_token(email, db)
+            raise self.invalid()
+        user = await repository_users.get_user_by_email(email, db)
+        if user is None:
+            raise self.invalid()
+        self.rotated += 1
+        return email, await self.issue(user, db)
+
+    async def revoke(self, refresh_token: str, db: AsyncSession) -> None:
+        """
+        The revoke function ends the session of a refresh token, i.e. logs one device out.
+            If Redis cannot be reached the session is still alive, so the logout fails with 503
+            whatever settings.refresh_token_db_fallback says.
+
+        :param self: Represent the instance of the class
+        :param refresh_token: str: The refresh token of the session
+        :param db: AsyncSession: Access the database, only used for tokens without a session
+        :return: None
+        :raises HTTPException: 503 if Redis is unavailable
+        """
+        payload = await auth_service.decode_refresh_payload(refresh_token)
+        if payload.get("sid") is not None:
+            try:
+                await self.r.delete(self.session_key(payload["sub"], payload["sid"]))
+            except redis.RedisError as err:
+                raise self.revocation_failed(err)
+            return
+        await repository_users.revoke_token(payload["sub"], db, refresh_token)
+
+    async def revoke_all(self, user: User, db: AsyncSession) -> None:
+        """
+        The revoke_all function ends every session of the user at once by starting a new token generation.
+            A token kept in the users table is cleared first; if Redis then cannot be reached the sessions
+            are still alive, so the call fails with 503 whatever settings.refresh_token_db_fallback says.
+
+        :param self: Represent the instance of the class
+        :param user: User: The user, possibly the cached copy from get_current_user
+        :param db: AsyncSession: Access the database, to clear a token kept there
+        :return: None
+        :raises HTTPException: 503 if Redis is unavailable
+        """
+        await repository_users.revoke_token(user.email, db)
+        try:
+            await self.r.incr(self.generation_key(user.email))
+        except redis.RedisError as err:
+            raise self.revocation_failed(err)
+
+    def fallback(self, err: Exception) -> None:
+        logger.warning("sessions: redis unavailable, using the users table: %s", err)
+        self.fallbacks += 1
+        if not settings.refresh_token_db_fallback:
+            raise self.unavailable()
+
+    def revocation_failed(self, err: Exception) -> HTTPException:
+        logger.error("sessions: redis unavailable, sessions not revoked: %s", err)
+        self.fallbacks += 1
+        return self.unavailable()
+
+    @staticmethod
+    def unavailable() -> HTTPException:
+        return HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Session store unavailable")
+
+    def invalid(self) -> HTTPException:
+        self.rejected += 1
+        return HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
+
+    def stats(self) -> dict:
+        """
+        The stats function returns the session counters of this process.
+
+        :param self: Represent the instance of the class
+        :return: A dict of counters
+        """
+        return {"issued": self.issued, "rotated": self.rotated, "reused": self.reused, "rejected": self.rejected,
+                "fallbacks": self.fallbacks}
+
+
+session_store = SessionStore()
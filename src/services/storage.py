@@ -0,0 +1,104 @@
+import hashlib
+import re
+from abc import ABC, abstractmethod
+from io import BytesIO
+from pathlib import Path
+
+import cloudinary
+import cloudinary.uploader
+
+from src.services.workers import upload_pool
+from src.conf.config import settings
+
+
+class StorageBackend(ABC):
+    """
+    Where avatars are stored. save is a coroutine; blocking SDK or file calls run in the upload worker pool.
+    """
+
+    @abstractmethod
+    async def save(self, key: str, data: bytes) -> str:
+        """
+        The save function stores an image under key, replacing the previous one.
+
+        :param self: Represent the instance of the class
+        :param key: str: The name of the image, e.g. ContactsApp/username
+        :param data: bytes: The encoded image
+        :return: The URL the image is served from
+        """
+
+
+class CloudinaryStorage(StorageBackend):
+    """
+    Stores avatars in Cloudinary. The SDK is configured once, not on every upload.
+    """
+
+    def __init__(self):
+        cloudinary.config(
+            cloud_name=settings.cloudinary_name,
+            api_key=settings.cloudinary_api_key,
+            api_secret=settings.cloudinary_api_secret,
+            secure=True
+        )
+
+    @staticmethod
+    def _upload(key: str, data: bytes) -> str:
+        r = cloudinary.uploader.upload(BytesIO(data), public_id=key, overwrite=True)
+        return cloudinary.CloudinaryImage(key).build_url(version=r.get('version'))
+
+    async def save(self, key: str, data: bytes) -> str:
+        return await upload_pool.run(self._upload, key, data)
+
+
+class LocalStorage(StorageBackend):
+    """
+    Stores avatars as files under root, served by the StaticFiles mount at url.
+    Useful for development and for load tests that must not touch Cloudinary.
+    """
+
+    def __init__(self, root: str | Path, url: str):
+        """
+        The __init__ function sets where the files are written and served from.
+
+        :param self: Represent the instance of the class
+        :param root: str | Path: The directory the files are written to
+        :param url: str: The URL prefix the directory is served at
+        """
+        self.root = Path(root)
+        self.url = url.rstrip("/")
+
+    @staticmethod
+    def relative_path(key: str) -> str:
+        """
+        The relative_path function turns a key into a safe file path below the root.
+
+        :param key: str: The name of the image
+        :return: The path, without '..' or characters outside [A-Za-z0-9_.-]
+        """
+        parts = [re.sub(r"[^A-Za-z0-9_.-]", "_", part) for part in key.split("/") if part not in ("", ".", "..")]
+        return "/".join(parts) + ".jpg"
+
+    def _write(self, path: Path, data: bytes) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_bytes(data)
+        tmp.replace(path)
+
+    async def save(self, key: str, data: bytes) -> str:
+        relative = self.relative_path(key)
+        await upload_pool.run(self._write, self.root / relative, data)
+        return f"{self.url}/{relative}?v={hashlib.sha1(data).hexdigest()[:12]}"
+
+
+def get_storage() -> StorageBackend:
+    """
+    The get_storage function creates the backend chosen by settings.avatar_storage.
+
+    :return: A CloudinaryStorage or a LocalStorage
+    """
+    if settings.avatar_storage == "local":
+        return LocalStorage(settings.avatar_local_dir, settings.avatar_local_url)
+    return CloudinaryStorage()
+
+
+storage = get_storage()
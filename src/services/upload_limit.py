@@ -0,0 +1,49 @@
+from fastapi import HTTPException, status
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+
+class UploadLimitMiddleware:
+    """
+    An ASGI middleware that caps the request body size of some paths.
+    A Content-Length above the limit is rejected before anything is read; otherwise the bytes are counted
+    while the body streams in and the request fails with 413 as soon as the limit is passed,
+    so an oversized upload is never buffered as a whole.
+    """
+
+    def __init__(self, app: ASGIApp, limits: dict[str, int]):
+        """
+        The __init__ function wraps the application.
+
+        :param self: Represent the instance of the class
+        :param app: ASGIApp: The wrapped application
+        :param limits: dict[str, int]: The maximum body size in bytes per path
+        """
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        limit = self.limits.get(scope.get("path")) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            response = JSONResponse({"detail": "Request body is too large"},
+                                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+            await response(scope, receive, send)
+            return
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                        detail="Request body is too large")
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,110 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from src.conf.config import settings
+from src.services.metrics import Histogram
+from src.services.resources import resources
+
+
+class PoolSaturated(Exception):
+    """
+    Raised when a BoundedExecutor already has as many jobs waiting as its queue allows.
+    """
+
+
+class BoundedExecutor:
+    """
+    A thread pool for blocking work (bcrypt, image processing, blocking SDKs) that must stay off the event loop.
+    The number of jobs running or waiting is capped, so a burst is rejected early instead of piling up,
+    and the time jobs spend waiting and running is recorded.
+    """
+
+    def __init__(self, name: str, max_workers: int, max_queue: int):
+        """
+        The __init__ function creates the pool; the threads are started on first use.
+
+        :param self: Represent the instance of the class
+        :param name: str: The name of the pool, used for its threads and metrics
+        :param max_workers: int: The number of worker threads
+        :param max_queue: int: The number of jobs allowed to wait for a free worker
+        """
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.pending = 0
+        self.rejected = 0
+        self.wait_time = Histogram()
+        self.run_time = Histogram()
+        self._executor = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name)
+        return self._executor
+
+    def _timed(self, submitted: float, fn, *args):
+        started = time.perf_counter()
+        self.wait_time.observe(started - submitted)
+        try:
+            return fn(*args)
+        finally:
+            self.run_time.observe(time.perf_counter() - started)
+
+    async def run(self, fn, *args):
+        """
+        The run function calls fn(*args) in a worker thread and waits for the result without blocking the loop.
+
+        :param self: Represent the instance of the class
+        :param fn: The blocking callable
+        :param args: The positional arguments for fn
+        :return: Whatever fn returns
+        :raises PoolSaturated: If max_workers + max_queue jobs are already running or waiting
+        """
+        if self.pending >= self.max_workers + self.max_queue:
+            self.rejected += 1
+            raise PoolSaturated(f"{self.name} pool is saturated")
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, partial(self._timed, time.perf_counter(), fn, *args))
+        finally:
+            self.pending -= 1
+
+    def stats(self) -> dict:
+        """
+        The stats function returns the queue depth, the rejections and the latency histograms of the pool.
+
+        :param self: Represent the instance of the class
+        :return: A dict of pool statistics
+        """
+        return {
+            "workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "pending": self.pending,
+            "rejected": self.rejected,
+            "wait_seconds": self.wait_time.snapshot(),
+            "run_seconds": self.run_time.snapshot(),
+        }
+
+    def shutdown(self) -> None:
+        """
+        The shutdown function stops the worker threads once the running jobs have finished;
+            jobs still waiting in the queue are cancelled.
+
+        :param self: Represent the instance of the class
+        :return: None
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+
+password_pool = BoundedExecutor("password", settings.password_hash_workers, settings.password_hash_queue)
+image_pool = BoundedExecutor("image", settings.image_workers, settings.image_queue)
+upload_pool = BoundedExecutor("upload", settings.upload_workers, settings.upload_queue)
+resources.on_shutdown("password_pool", password_pool.shutdown)
+resources.on_shutdown("image_pool", image_pool.shutdown)
+resources.on_shutdown("upload_pool", upload_pool.shutdown)
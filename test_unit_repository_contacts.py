@@ -3,16 +3,20 @@ from datetime import date
 import unittest
 from unittest.mock import MagicMock
 
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.database.models import Contact, User
 from src.schemas import ContactModel
 from src.repository.contacts import (get_contacts,
+    get_contacts_page,
+    decode_cursor,
     get_contact_by_id,
     get_contact_by_email,
     get_contacts_by_first_name,
     get_contacts_by_last_name,
+    search_contacts,
     get_contacts_with_birthday,
+    birthday_window,
     create,
     remove,
     update,
@@ -22,68 +26,105 @@ from src.repository.contacts import (get_contacts,
 class TestContacts(unittest.IsolatedAsyncioTestCase):
 
     def setUp(self):
-        self.session = MagicMock(spec=Session)
+        self.session = MagicMock(spec=AsyncSession)
+        self.result = MagicMock()
+        self.session.execute.return_value = self.result
         self.user = User(id=1)
 
     async def test_get_contacts(self):
         contacts = [Contact(), Contact(), Contact()]
-        self.session.query().filter().limit().offset().all.return_value = contacts
+        self.result.scalars().all.return_value = contacts
         result = await get_contacts(limit=10, offset=2, user=self.user, db=self.session)
         self.assertEqual(result, contacts)
 
+    async def test_get_contacts_page(self):
+        contacts = [Contact(id=1, last_name="A"), Contact(id=2, last_name="B"), Contact(id=3, last_name="C")]
+        self.result.scalars().all.return_value = contacts
+        result, next_cursor = await get_contacts_page(limit=2, cursor=None, user=self.user, db=self.session,
+                                                      sort="last_name")
+        self.assertEqual(result, contacts[:2])
+        self.assertEqual(decode_cursor(next_cursor), ["last_name", "B", 2])
+
+    async def test_get_contacts_last_page(self):
+        contacts = [Contact(id=3)]
+        self.result.scalars().all.return_value = contacts
+        result, next_cursor = await get_contacts_page(limit=2, cursor=None, user=self.user, db=self.session)
+        self.assertEqual(result, contacts)
+        self.assertIsNone(next_cursor)
+
+    def test_decode_invalid_cursor(self):
+        with self.assertRaises(ValueError):
+            decode_cursor("garbage")
+
     async def test_get_contact_by_id_found(self):
         contact = Contact()
-        self.session.query().filter().first.return_value = contact
+        self.result.scalars().first.return_value = contact
         result = await get_contact_by_id(contact_id=1, user=self.user, db=self.session)
         self.assertEqual(result, contact)
 
     async def test_get_contact_by_id_not_found(self):
-        self.session.query().filter().first.return_value = None
+        self.result.scalars().first.return_value = None
         result = await get_contact_by_id(contact_id=1, user=self.user, db=self.session)
         self.assertIsNone(result)
 
     async def test_get_contact_by_email_found(self):
         contact = Contact()
-        self.session.query().filter().all.return_value = contact
+        self.result.scalars().all.return_value = contact
         result = await get_contact_by_email(contact_email="test@test.ua", user=self.user, db=self.session)
         self.assertEqual(result, contact)
 
     async def test_get_contact_by_email_not_found(self):
-        self.session.query().filter().all.return_value = None
+        self.result.scalars().all.return_value = None
         result = await get_contact_by_email(contact_email="test@test.ua", user=self.user, db=self.session)
         self.assertIsNone(result)
 
     async def test_get_contact_by_first_name_found(self):
         contacts = [Contact(), Contact(), Contact()]
-        self.session.query().filter().all.return_value = contacts
+        self.result.scalars().all.return_value = contacts
         result = await get_contacts_by_first_name(contact_first_name="FirstName", user=self.user, db=self.session)
         self.assertEqual(result, contacts)
 
     async def test_get_contact_by_first_name_not_found(self):
-        self.session.query().filter().all.return_value = None
+        self.result.scalars().all.return_value = None
         result = await get_contacts_by_first_name(contact_first_name="FirstName", user=self.user, db=self.session)
         self.assertIsNone(result)
 
     async def test_get_contact_by_last_name_found(self):
         contacts = [Contact(), Contact()]
-        self.session.query().filter().all.return_value = contacts
+        self.result.scalars().all.return_value = contacts
         result = await get_contacts_by_last_name(contact_last_name="LastName", user=self.user, db=self.session)
         self.assertEqual(result, contacts)
 
     async def test_get_contact_by_last_name_not_found(self):
-        self.session.query().filter().all.return_value = None
+        self.result.scalars().all.return_value = None
         result = await get_contacts_by_last_name(contact_last_name="LastName", user=self.user, db=self.session)
         self.assertIsNone(result)
 
     async def test_get_contact_with_birthdays(self):
         contacts = [Contact(), Contact()]
-        self.session.query().filter().all.return_value = contacts
+        self.result.scalars().all.return_value = contacts
         result = await get_contacts_with_birthday(days=7, user=self.user, db=self.session)
         if len(result) == 0:
             self.assertEqual(result, [])
         else:
             self.assertEqual(result, contacts)
 
+    async def test_search_contacts(self):
+        contacts = [Contact(), Contact()]
+        self.result.scalars().all.return_value = contacts
+        result = await search_contacts(query="Name", user=self.user, db=self.session)
+        self.assertEqual(result, contacts)
+
+    def test_birthday_window(self):
+        self.assertEqual(birthday_window(date(year=2023, month=5, day=28), 7), (528, 603))
+
+    def test_birthday_window_wraps_new_year(self):
+        self.assertEqual(birthday_window(date(year=2023, month=12, day=28), 7), (1228, 103))
+
+    def test_birthday_window_feb_29_in_common_year(self):
+        self.assertEqual(birthday_window(date(year=2023, month=2, day=22), 7), (222, 229))
+        self.assertEqual(birthday_window(date(year=2024, month=2, day=22), 7), (222, 228))
+
     async def test_create_contact(self):
         body = ContactModel(id=3, first_name="FirstName", last_name="LastName",
                             email="email@email.com", phone="0123456789", birthday=date(year=2012, month=12, day=12))
@@ -95,7 +136,7 @@ class TestContacts(unittest.IsolatedAsyncioTestCase):
     async def test_update_contact_found(self):
         contact = ContactModel(id=3, first_name="FirstName", last_name="LastName",
                             email="email@email.com", phone="0123456789", birthday=date(year=2012, month=12, day=12), user_id=1)
-        self.session.query().filter().first.return_value = contact
+        self.result.scalars().first.return_value = contact
         self.session.commit.return_value = None
         result = await update(contact_id=1, body=contact, user=self.user, db=self.session)
         self.assertEqual(result, contact)
@@ -103,19 +144,19 @@ class TestContacts(unittest.IsolatedAsyncioTestCase):
     async def test_update_contact_not_found(self):
         contact = ContactModel(id=3, first_name="FirstName", last_name="LastName",
                             email="email@email.com", phone="0123456789", birthday=date(year=2012, month=12, day=12), user_id=1)
-        self.session.query().filter().first.return_value = None
+        self.result.scalars().first.return_value = None
         self.session.commit.return_value = None
         result = await update(contact_id=1, body=contact, user=self.user, db=self.session)
         self.assertIsNone(result)
 
     async def test_remove_contact_found(self):
         contact = Contact()
-        self.session.query().filter().first.return_value = contact
+        self.result.scalars().first.return_value = contact
         result = await remove(contact_id=3, user=self.user, db=self.session)
         self.assertEqual(result, contact)
 
     async def test_remove_contact_not_found(self):
-        self.session.query().filter().first.return_value = None
+        self.result.scalars().first.return_value = None
         result = await remove(contact_id=3, user=self.user, db=self.session)
         self.assertIsNone(result)
 
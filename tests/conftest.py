@@ -1,15 +1,24 @@
-
+import anyio
+import fakeredis
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
 
 from main import app
 from src.database.models import Base
-from src.database.db import get_db
+from src.database.db import get_db, replica_router
+from src.services.auth import auth_service
+from src.services.email_queue import email_queue
+from src.services.rate_limit import rate_limiter
+from src.services.resources import resources
+from src.services.response_cache import response_cache
+from src.services.sessions import session_store
 
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+ASYNC_SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
@@ -17,6 +26,19 @@ engine = create_engine(
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
+@pytest.fixture(autouse=True)
+def fake_redis(monkeypatch):
+    # every test gets an empty Redis of its own, never the one that may listen on localhost
+    server = fakeredis.FakeServer()
+    client = fakeredis.aioredis.FakeRedis(server=server)
+    monkeypatch.setattr(resources, "redis", client)
+    monkeypatch.setattr(resources, "redis_text", fakeredis.aioredis.FakeRedis(server=server, decode_responses=True))
+    for service in (auth_service, response_cache, rate_limiter, session_store, replica_router):
+        monkeypatch.setattr(service, "r", client)
+    monkeypatch.setattr(email_queue, "r", resources.redis_text)
+    return client
+
+
 @pytest.fixture(scope="module")
 def session():
     # Create the database
@@ -35,15 +57,23 @@ def session():
 def client(session):
     # Dependency override
 
-    def override_get_db():
-        try:
-            yield session
-        finally:
-            session.close()
+    async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL)
+    AsyncTestingSessionLocal = async_sessionmaker(async_engine, autocommit=False, autoflush=False,
+                                                  expire_on_commit=False)
 
-    app.dependency_overrides[get_db] = override_get_db
+    async def override_get_db():
+        async with AsyncTestingSessionLocal() as db:
+            yield db
 
-    yield TestClient(app)
+    app.dependency_overrides[get_db] = override_get_db
+    auth_service.user_cache.clear()
+    auth_service.token_cache.clear()
+
+    # one event loop for all requests, as under uvicorn: Redis connections belong to the loop that opened them
+    with anyio.from_thread.start_blocking_portal() as portal:
+        test_client = TestClient(app)
+        test_client.portal = portal
+        yield test_client
 
 
 @pytest.fixture(scope="module")
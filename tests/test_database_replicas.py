@@ -0,0 +1,127 @@
+import asyncio
+import itertools
+
+import fakeredis
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from starlette.requests import Request
+
+from src.database.db import route_session
+from src.database.models import Base, User
+from src.database.replicas import ReplicaRouter, RoutingAsyncSession
+from src.services.auth import auth_service
+
+
+def make_request(method: str, token: str) -> Request:
+    return Request({"type": "http", "method": method, "path": "/", "query_string": b"",
+                    "headers": [(b"authorization", f"Bearer {token}".encode())], "client": ("127.0.0.1", 5000)})
+
+
+def make_database(path, source: str) -> None:
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE marker (source TEXT)"))
+        connection.execute(text("INSERT INTO marker VALUES (:source)"), {"source": source})
+    engine.dispose()
+
+
+def test_reads_go_to_replica_until_write(tmp_path):
+    make_database(tmp_path / "primary.db", "primary")
+    make_database(tmp_path / "replica.db", "replica")
+
+    async def scenario():
+        primary = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'primary.db'}")
+        replica = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'replica.db'}")
+        router = ReplicaRouter(primary, {"replica0": replica})
+        router.subject = auth_service.verify_access_token
+        sessions = async_sessionmaker(primary, class_=RoutingAsyncSession, expire_on_commit=False)
+        tokens = map(str, itertools.count())
+
+        async def source(method: str, name: str, write: bool = False) -> str:
+            # a new access token every time: the pin belongs to the user, not to one of its tokens
+            token = await auth_service.create_access_token({"sub": f"{name}@example.com", "jti": next(tokens)})
+            async with sessions() as db:
+                await route_session(db, make_request(method, token), router)
+                marker = (await db.execute(text("SELECT source FROM marker"))).scalar()
+                if write:
+                    db.add(User(username=name, email=f"{name}@example.com", password="secret"))
+                    await db.commit()
+                return marker
+
+        try:
+            assert await source("GET", "alice") == "primary"
+            await router.check()
+            assert await source("GET", "alice") == "replica"
+            assert await source("POST", "alice") == "primary"
+            # a write during a GET goes to the primary and pins the client there, other clients stay on the replica
+            assert await source("GET", "bob", write=True) == "replica"
+            assert await source("GET", "bob") == "primary"
+            assert await source("GET", "alice") == "replica"
+            stats = router.stats()
+            assert stats["pins"] == 1
+            assert stats["pinned_reads"] == 1
+            assert stats["replica0"]["healthy"] is True
+        finally:
+            await router.close()
+            await primary.dispose()
+
+    asyncio.run(scenario())
+    users = create_engine(f"sqlite:///{tmp_path / 'primary.db'}")
+    with users.connect() as connection:
+        assert connection.execute(text("SELECT username FROM users")).scalars().all() == ["bob"]
+    users.dispose()
+
+
+def test_pin_is_shared_between_workers(tmp_path):
+    make_database(tmp_path / "primary.db", "primary")
+    make_database(tmp_path / "replica.db", "replica")
+
+    async def scenario():
+        primary = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'primary.db'}")
+        replica = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'replica.db'}")
+        shared = fakeredis.aioredis.FakeRedis(server=fakeredis.FakeServer())
+        workers = [ReplicaRouter(primary, {"replica0": replica}) for _ in range(2)]
+        for router in workers:
+            router.subject = auth_service.verify_access_token
+            router.r = shared
+            await router.check()
+        sessions = async_sessionmaker(primary, class_=RoutingAsyncSession, expire_on_commit=False)
+        token = await auth_service.create_access_token({"sub": "carol@example.com"})
+        try:
+            async with sessions() as db:
+                await route_session(db, make_request("POST", token), workers[0])
+                db.add(User(username="carol", email="carol@example.com", password="secret"))
+                await db.commit()
+            async with sessions() as db:
+                await route_session(db, make_request("GET", token), workers[1])
+                return (await db.execute(text("SELECT source FROM marker"))).scalar()
+        finally:
+            for router in workers:
+                await router.close()
+            await primary.dispose()
+
+    assert asyncio.run(scenario()) == "primary"
+
+
+def test_unreachable_replica_is_skipped(tmp_path, monkeypatch):
+    make_database(tmp_path / "primary.db", "primary")
+
+    async def refuse(replica):
+        raise ConnectionRefusedError("replica is down")
+
+    async def scenario():
+        primary = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'primary.db'}")
+        router = ReplicaRouter(primary, {"replica0": primary})
+        try:
+            await router.check()
+            assert router.choose("GET").name == "replica0"
+            monkeypatch.setattr(router, "probe", refuse)
+            await router.check()
+            assert router.choose("GET") is None
+            assert router.stats()["replica0"] == {"healthy": False, "lag_seconds": 0.0, "reads": 1, "failures": 1}
+        finally:
+            await primary.dispose()
+
+    asyncio.run(scenario())
@@ -1,6 +1,17 @@
+import asyncio
+import threading
+import time
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
 from fastapi.testclient import TestClient
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine
 
 from main import app
+from src.conf.config import settings
+from src.database.db import InstrumentedPool, pool_stats
+from src.services.resources import Resources
 
 client = TestClient(app)
 
@@ -8,3 +19,96 @@ client = TestClient(app)
 def test_read_main():
     response = client.get("/")
     assert response.status_code == 200
+
+
+def test_pool_stats():
+    response = client.get("/api/healthchecker/pool")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["size"] == settings.db_pool_size
+    assert data["max_overflow"] == settings.db_max_overflow
+    assert {"checked_out", "overflow", "timeouts", "checkout_wait_seconds"} <= data.keys()
+
+
+def test_pool_counts_checkout_timeouts():
+    engine = create_async_engine("sqlite+aiosqlite:///./test.db", poolclass=InstrumentedPool,
+                                 pool_size=1, max_overflow=0, pool_timeout=0.05)
+    timeouts = pool_stats.timeouts
+
+    async def scenario():
+        async with engine.connect():
+            with pytest.raises(TimeoutError):
+                async with engine.connect():
+                    pass
+        await engine.dispose()
+
+    asyncio.run(scenario())
+    assert pool_stats.timeouts == timeouts + 1
+
+
+def test_metrics_are_labelled_by_route_template():
+    client.get("/api/healthchecker/pool")
+    client.get("/no/such/path")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    assert 'http_request_duration_seconds_count{method="GET",route="/api/healthchecker/pool",status="200"}' in body
+    assert 'route="unmatched",status="404"' in body
+    assert "/no/such/path" not in body
+    assert 'http_requests_in_flight{method="GET"} 1' in body
+    assert "db_pool_checkout_wait_seconds_bucket" in body
+
+
+def test_resources_warm_up_and_close(monkeypatch):
+    monkeypatch.setattr(settings, "warmup_db_connections", 3)
+    engine = create_async_engine("sqlite+aiosqlite:///./test.db", poolclass=InstrumentedPool,
+                                 pool_size=3, max_overflow=0)
+    resources = Resources(engine)
+    resources.redis = AsyncMock()
+    resources.redis.ping.side_effect = ConnectionError("down")
+    warmup, closer = AsyncMock(), MagicMock()
+    resources.on_startup("bcrypt", warmup)
+    resources.on_shutdown("password_pool", closer)
+
+    async def scenario():
+        await resources.startup()
+        idle = engine.sync_engine.pool.checkedin()
+        await resources.shutdown()
+        return idle
+
+    assert asyncio.run(scenario()) == 3
+    warmup.assert_awaited_once()
+    closer.assert_called_once()
+    resources.redis.close.assert_awaited_once()
+    stats = resources.stats()
+    assert stats["warmup_failures"] == 1
+    assert set(stats["warmup_seconds"]) == {"redis", "db_pool", "bcrypt"}
+    assert stats["startup_seconds"] >= max(stats["warmup_seconds"].values())
+
+
+def test_stuck_sync_closer_does_not_block_shutdown(monkeypatch):
+    monkeypatch.setattr(settings, "shutdown_timeout", 0.05)
+    engine = create_async_engine("sqlite+aiosqlite:///./test.db")
+    resources = Resources(engine)
+    release = threading.Event()
+    closer = AsyncMock()
+    resources.on_shutdown("smtp", closer)
+    resources.on_shutdown("password_pool", lambda: release.wait(0.5))
+
+    async def scenario():
+        start = time.perf_counter()
+        await resources.shutdown()
+        return time.perf_counter() - start
+
+    try:
+        assert asyncio.run(scenario()) < 0.4
+    finally:
+        release.set()
+    closer.assert_awaited_once()
+
+
+def test_startup_stats():
+    response = client.get("/api/healthchecker/startup")
+    assert response.status_code == 200
+    assert {"startup_seconds", "warmup_failures", "warmup_seconds"} <= response.json().keys()
@@ -0,0 +1,44 @@
+import asyncio
+from datetime import date
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from src.database.models import Base, Contact, User
+from src.repository.contacts import get_contacts, get_contacts_page
+
+
+@pytest.mark.parametrize("sort", ["birthday", "first_name"])
+def test_pages_keep_contacts_without_sort_value(tmp_path, sort):
+    engine = create_engine(f"sqlite:///{tmp_path / 'contacts.db'}")
+    Base.metadata.create_all(engine)
+    engine.dispose()
+    birthdays = [None, date(1990, 5, 1), None, date(1985, 1, 2), None, date(1990, 5, 1), None]
+    names = [None, "Bob", None, "Ann", None, "Bob", None]
+
+    async def scenario():
+        async_engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'contacts.db'}")
+        sessions = async_sessionmaker(async_engine, expire_on_commit=False)
+        try:
+            async with sessions() as db:
+                user = User(username="pager", email="pager@example.com", password="secret")
+                db.add(user)
+                await db.flush()
+                db.add_all([Contact(first_name=name, last_name="Last", email=f"c{number}@example.com",
+                                    birthday=birthday, user_id=user.id)
+                            for number, (name, birthday) in enumerate(zip(names, birthdays))])
+                await db.commit()
+                seen, cursor = [], ""
+                while cursor is not None:
+                    contacts, cursor = await get_contacts_page(2, cursor, user, db, sort)
+                    seen += [contact.id for contact in contacts]
+                return seen, [contact.id for contact in await get_contacts(10, 0, user, db, sort)]
+        finally:
+            await async_engine.dispose()
+
+    seen, listed = asyncio.run(scenario())
+    # every contact once, the ones without a value last, in the same order as offset pagination
+    assert seen == listed
+    assert sorted(seen) == list(range(1, 8))
+    assert seen[3:] == [1, 3, 5, 7]
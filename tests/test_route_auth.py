@@ -1,12 +1,15 @@
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
+import redis.asyncio as redis
 from fastapi import status
 
 
 from src.database.db import get_db
 from src.database.models import User
 from src.services.auth import auth_service
+from src.services.email_queue import email_queue
+from src.services.sessions import session_store
 
 from src.database.models import User
 
@@ -30,14 +33,17 @@ def token(client, user, session, monkeypatch):
 def test_create_user(client, user, monkeypatch):
     mock_send_email = MagicMock()
     monkeypatch.setattr("src.routes.auth.send_email", mock_send_email)
-    response = client.post(
-        "/api/auth/signup",
-        json=user,
-    )
-    assert response.status_code == 201, response.text
-    data = response.json()
-    assert data["user"]["email"] == user.get("email")
-    assert "id" in data["user"]
+    with patch.object(email_queue, "r", new_callable=AsyncMock) as r_mock:
+        response = client.post(
+            "/api/auth/signup",
+            json=user,
+        )
+        assert response.status_code == 201, response.text
+        data = response.json()
+        assert data["user"]["email"] == user.get("email")
+        assert "id" in data["user"]
+        r_mock.xadd.assert_awaited_once()
+        mock_send_email.assert_not_called()
 
 
 def test_repeat_create_user(client, user):
@@ -100,3 +106,55 @@ def test_not_get_refresh_token(client):
     data = response.json()
     assert response.status_code == status.HTTP_401_UNAUTHORIZED
     assert data["detail"] == "Could not validate credentials"
+
+
+def test_refresh_token_rotation(client, user, monkeypatch):
+    redis_mock = AsyncMock()
+    redis_mock.evalsha.side_effect = redis.ConnectionError("down")
+    monkeypatch.setattr(session_store, "r", redis_mock)
+    response = client.post(
+        "/api/auth/login",
+        data={"username": user.get('email'), "password": user.get('password')},
+    )
+    first = response.json()["refresh_token"]
+    response = client.get("api/auth/refresh_token", headers={"Authorization": f"Bearer {first}"})
+    assert response.status_code == 200, response.text
+    second = response.json()["refresh_token"]
+    assert second != first
+    response = client.get("api/auth/refresh_token", headers={"Authorization": f"Bearer {first}"})
+    assert response.status_code == 401, response.text
+    assert response.json()["detail"] == "Invalid refresh token"
+    response = client.get("api/auth/refresh_token", headers={"Authorization": f"Bearer {second}"})
+    assert response.status_code == 401, response.text
+
+
+def test_legacy_refresh_token_is_used_once(client, user, monkeypatch, fake_redis):
+    redis_mock = AsyncMock()
+    redis_mock.evalsha.side_effect = redis.ConnectionError("down")
+    monkeypatch.setattr(session_store, "r", redis_mock)
+    response = client.post(
+        "/api/auth/login",
+        data={"username": user.get('email'), "password": user.get('password')},
+    )
+    legacy = response.json()["refresh_token"]
+    monkeypatch.setattr(session_store, "r", fake_redis)
+    response = client.get("api/auth/refresh_token", headers={"Authorization": f"Bearer {legacy}"})
+    assert response.status_code == 200, response.text
+    response = client.get("api/auth/refresh_token", headers={"Authorization": f"Bearer {legacy}"})
+    assert response.status_code == 401, response.text
+    assert response.json()["detail"] == "Invalid refresh token"
+
+
+def test_logout_all_fails_while_redis_is_down(client, user, monkeypatch):
+    redis_mock = AsyncMock()
+    redis_mock.evalsha.side_effect = redis.ConnectionError("down")
+    redis_mock.incr.side_effect = redis.ConnectionError("down")
+    monkeypatch.setattr(session_store, "r", redis_mock)
+    response = client.post(
+        "/api/auth/login",
+        data={"username": user.get('email'), "password": user.get('password')},
+    )
+    access_token = response.json()["access_token"]
+    response = client.post("/api/auth/logout_all", headers={"Authorization": f"Bearer {access_token}"})
+    assert response.status_code == 503, response.text
+    assert response.json()["detail"] == "Session store unavailable"
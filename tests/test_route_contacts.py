@@ -1,10 +1,18 @@
+import base64
+import json
+import time
 from unittest.mock import MagicMock, patch, AsyncMock
 from datetime import date
 
 import pytest
+import redis.asyncio as redis
+from sqlalchemy import event
 
-from src.database.models import User
+from src.conf.config import settings
+from src.database.models import Contact, User
 from src.services.auth import auth_service
+from src.services.rate_limit import rate_limiter
+from src.services.response_cache import response_cache
 
 
 @pytest.fixture()
@@ -38,11 +46,9 @@ CONTACT = {
 
 
 def test_create_contact(client, token, monkeypatch):
-    with patch.object(auth_service, "r") as redis_mock:
+    with patch.object(auth_service, "r", new_callable=AsyncMock) as redis_mock:
         redis_mock.get.return_value = None
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.redis", AsyncMock())
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.identifier", AsyncMock())
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.http_callback", AsyncMock())
+        monkeypatch.setattr(settings, "rate_limit_enabled", False)
         response = client.post(
             "api/contacts", json=CONTACT, headers={"Authorization": f"Bearer {token}"}
         )
@@ -52,11 +58,9 @@ def test_create_contact(client, token, monkeypatch):
 
 
 def test_get_contact_by_id(client, token, monkeypatch):
-    with patch.object(auth_service, "r") as r_mock:
+    with patch.object(auth_service, "r", new_callable=AsyncMock) as r_mock:
         r_mock.get.return_value = None
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.redis", AsyncMock())
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.identifier", AsyncMock())
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.http_callback", AsyncMock())
+        monkeypatch.setattr(settings, "rate_limit_enabled", False)
         response = client.get(
             "/api/contacts/1", headers={"Authorization": f"Bearer {token}"}
         )
@@ -65,12 +69,24 @@ def test_get_contact_by_id(client, token, monkeypatch):
         assert "id" in data
 
 
+def test_get_contact_rate_limited(client, token, monkeypatch):
+    with patch.object(auth_service, "r", new_callable=AsyncMock) as r_mock:
+        r_mock.get.return_value = None
+        limiter_mock = AsyncMock()
+        limiter_mock.evalsha.return_value = [0, b"3.5"]
+        monkeypatch.setattr(rate_limiter, "r", limiter_mock)
+        response = client.get(
+            "/api/contacts/1", headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 429, response.text
+        assert response.headers["Retry-After"] == "4"
+        assert limiter_mock.evalsha.await_args.args[2] == f"ratelimit:read_contact:user:{auth_service.verify_access_token(token)}"
+
+
 def test_get_contact_by_id_not_found(client, token, monkeypatch):
-    with patch.object(auth_service, "r") as r_mock:
+    with patch.object(auth_service, "r", new_callable=AsyncMock) as r_mock:
         r_mock.get.return_value = None
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.redis", AsyncMock())
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.identifier", AsyncMock())
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.http_callback", AsyncMock())
+        monkeypatch.setattr(settings, "rate_limit_enabled", False)
         response = client.get(
             "/api/contacts/2", headers={"Authorization": f"Bearer {token}"}
         )
@@ -80,11 +96,9 @@ def test_get_contact_by_id_not_found(client, token, monkeypatch):
 
 
 def test_get_contact_by_email(client, token, monkeypatch):
-    with patch.object(auth_service, "r") as r_mock:
+    with patch.object(auth_service, "r", new_callable=AsyncMock) as r_mock:
         r_mock.get.return_value = None
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.redis", AsyncMock())
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.identifier", AsyncMock())
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.http_callback", AsyncMock())
+        monkeypatch.setattr(settings, "rate_limit_enabled", False)
         response = client.get(
             f"/api/contacts/email/email", headers={"Authorization": f"Bearer {token}"}
         )
@@ -98,11 +112,9 @@ def test_get_contact_by_email(client, token, monkeypatch):
 
 
 def test_get_contact_by_email_not_found(client, token, monkeypatch):
-    with patch.object(auth_service, "r") as r_mock:
+    with patch.object(auth_service, "r", new_callable=AsyncMock) as r_mock:
         r_mock.get.return_value = None
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.redis", AsyncMock())
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.identifier", AsyncMock())
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.http_callback", AsyncMock())
+        monkeypatch.setattr(settings, "rate_limit_enabled", False)
         response = client.get(
             "/api/contacts/email/example", headers={"Authorization": f"Bearer {token}"}
         )
@@ -112,11 +124,9 @@ def test_get_contact_by_email_not_found(client, token, monkeypatch):
 
 
 def test_get_contact_by_first_name(client, token, monkeypatch):
-    with patch.object(auth_service, "r") as r_mock:
+    with patch.object(auth_service, "r", new_callable=AsyncMock) as r_mock:
         r_mock.get.return_value = None
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.redis", AsyncMock())
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.identifier", AsyncMock())
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.http_callback", AsyncMock())
+        monkeypatch.setattr(settings, "rate_limit_enabled", False)
         response = client.get(
             f"/api/contacts/first_name/first", headers={"Authorization": f"Bearer {token}"}
         )
@@ -130,11 +140,9 @@ def test_get_contact_by_first_name(client, token, monkeypatch):
 
 
 def test_get_contact_by_first_name_not_found(client, token, monkeypatch):
-    with patch.object(auth_service, "r") as r_mock:
+    with patch.object(auth_service, "r", new_callable=AsyncMock) as r_mock:
         r_mock.get.return_value = None
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.redis", AsyncMock())
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.identifier", AsyncMock())
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.http_callback", AsyncMock())
+        monkeypatch.setattr(settings, "rate_limit_enabled", False)
         response = client.get(
             "/api/contacts/first_name/ogh", headers={"Authorization": f"Bearer {token}"}
         )
@@ -144,11 +152,9 @@ def test_get_contact_by_first_name_not_found(client, token, monkeypatch):
 
 
 def test_get_contact_by_last_name(client, token, monkeypatch):
-    with patch.object(auth_service, "r") as r_mock:
+    with patch.object(auth_service, "r", new_callable=AsyncMock) as r_mock:
         r_mock.get.return_value = None
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.redis", AsyncMock())
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.identifier", AsyncMock())
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.http_callback", AsyncMock())
+        monkeypatch.setattr(settings, "rate_limit_enabled", False)
         response = client.get(
             f"/api/contacts/last_name/last", headers={"Authorization": f"Bearer {token}"}
         )
@@ -162,11 +168,9 @@ def test_get_contact_by_last_name(client, token, monkeypatch):
 
 
 def test_get_contact_by_last_name_not_found(client, token, monkeypatch):
-    with patch.object(auth_service, "r") as r_mock:
+    with patch.object(auth_service, "r", new_callable=AsyncMock) as r_mock:
         r_mock.get.return_value = None
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.redis", AsyncMock())
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.identifier", AsyncMock())
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.http_callback", AsyncMock())
+        monkeypatch.setattr(settings, "rate_limit_enabled", False)
         response = client.get(
             "/api/contacts/last_name/ogh", headers={"Authorization": f"Bearer {token}"}
         )
@@ -176,11 +180,9 @@ def test_get_contact_by_last_name_not_found(client, token, monkeypatch):
 
 
 def test_get_contacts(client, token, monkeypatch):
-    with patch.object(auth_service, "r") as r_mock:
+    with patch.object(auth_service, "r", new_callable=AsyncMock) as r_mock:
         r_mock.get.return_value = None
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.redis", AsyncMock())
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.identifier", AsyncMock())
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.http_callback", AsyncMock())
+        monkeypatch.setattr(settings, "rate_limit_enabled", False)
         response = client.get(
             "/api/contacts", headers={"Authorization": f"Bearer {token}"}
         )
@@ -191,8 +193,79 @@ def test_get_contacts(client, token, monkeypatch):
         assert "id" in data[0]
 
 
+def test_get_contacts_cursor(client, token, monkeypatch):
+    with patch.object(auth_service, "r", new_callable=AsyncMock) as r_mock:
+        r_mock.get.return_value = None
+        monkeypatch.setattr(settings, "rate_limit_enabled", False)
+        response = client.get(
+            "/api/contacts", params={"cursor": "", "sort": "last_name"}, headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 200, response.text
+        data = response.json()
+        assert data["items"][0]["first_name"] == "First_name"
+        assert data["next_cursor"] is None
+
+
+def test_get_contacts_invalid_cursor(client, token, monkeypatch):
+    with patch.object(auth_service, "r", new_callable=AsyncMock) as r_mock:
+        r_mock.get.return_value = None
+        monkeypatch.setattr(settings, "rate_limit_enabled", False)
+        response = client.get(
+            "/api/contacts", params={"cursor": "garbage"}, headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 400, response.text
+        assert response.json()["detail"] == "Invalid cursor"
+
+
+@pytest.mark.parametrize("position", [["id", "1"], ["last_name", 5, 1], ["last_name", "Last_name", "1"],
+                                      ["id", True]])
+def test_get_contacts_cursor_wrong_types(client, token, monkeypatch, position):
+    with patch.object(auth_service, "r", new_callable=AsyncMock) as r_mock:
+        r_mock.get.return_value = None
+        monkeypatch.setattr(settings, "rate_limit_enabled", False)
+        cursor = base64.urlsafe_b64encode(json.dumps(position).encode()).decode().rstrip("=")
+        response = client.get(
+            "/api/contacts", params={"cursor": cursor}, headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 400, response.text
+        assert response.json()["detail"] == "Invalid cursor"
+
+
+def test_search_contacts(client, token):
+    with patch.object(auth_service, "r", new_callable=AsyncMock) as r_mock:
+        r_mock.get.return_value = None
+        for query in ("first", "NAME", "fi", "0631"):
+            response = client.get(
+                "/api/contacts/search", params={"q": query}, headers={"Authorization": f"Bearer {token}"}
+            )
+            assert response.status_code == 200, response.text
+            data = response.json()
+            assert data[0]["first_name"] == "First_name", query
+
+
+def test_search_contacts_no_match(client, token):
+    with patch.object(auth_service, "r", new_callable=AsyncMock) as r_mock:
+        r_mock.get.return_value = None
+        response = client.get(
+            "/api/contacts/search", params={"q": "nobody"}, headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 200, response.text
+        assert response.json() == []
+
+
+def test_get_contacts_with_birthday(client, token):
+    with patch.object(auth_service, "r", new_callable=AsyncMock) as r_mock:
+        r_mock.get.return_value = None
+        response = client.get(
+            "/api/contacts/birthdays/", params={"days": 366}, headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 200, response.text
+        data = response.json()
+        assert data[0]["birthday"] == CONTACT["birthday"]
+
+
 def test_update_contact(client, token):
-    with patch.object(auth_service, "r") as r_mock:
+    with patch.object(auth_service, "r", new_callable=AsyncMock) as r_mock:
         r_mock.get.return_value = None
         response = client.put(
             "/api/contacts/1",
@@ -215,7 +288,7 @@ def test_update_contact(client, token):
 
 
 def test_update_contact_not_found(client, token):
-    with patch.object(auth_service, "r") as r_mock:
+    with patch.object(auth_service, "r", new_callable=AsyncMock) as r_mock:
         r_mock.get.return_value = None
         response = client.put(
             "/api/contacts/2",
@@ -237,8 +310,111 @@ def test_update_contact_not_found(client, token):
 
 
 
+def test_cached_contact_is_invalidated_by_update(client, token, monkeypatch):
+    hits = response_cache.hits.get("contact", 0)
+    headers = {"Authorization": f"Bearer {token}"}
+    with patch.object(auth_service, "r", new_callable=AsyncMock) as r_mock:
+        r_mock.get.return_value = None
+        monkeypatch.setattr(settings, "rate_limit_enabled", False)
+        first = client.get("/api/contacts/1", headers=headers)
+        second = client.get("/api/contacts/1", headers=headers)
+        assert second.status_code == 200, second.text
+        assert second.json() == first.json()
+        assert response_cache.hits["contact"] == hits + 1
+        response = client.put("/api/contacts/1", json={**CONTACT, "first_name": "Cached"}, headers=headers)
+        assert response.status_code == 200, response.text
+        response = client.get("/api/contacts/1", headers=headers)
+        assert response.json()["first_name"] == "Cached"
+        assert response_cache.hits["contact"] == hits + 1
+
+
+def test_conditional_get_contact(client, token, monkeypatch):
+    headers = {"Authorization": f"Bearer {token}"}
+    with patch.object(auth_service, "r", new_callable=AsyncMock) as r_mock:
+        r_mock.get.return_value = None
+        monkeypatch.setattr(settings, "rate_limit_enabled", False)
+        response = client.get("/api/contacts/1", headers=headers)
+        etag = response.headers["ETag"]
+        list_etag = client.get("/api/contacts", headers=headers).headers["ETag"]
+        response = client.get("/api/contacts/1", headers={**headers, "If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.headers["ETag"] == etag
+        assert response.content == b""
+        response = client.get("/api/contacts", headers={**headers, "If-None-Match": list_etag})
+        assert response.status_code == 304
+        client.put("/api/contacts/1", json={**CONTACT, "first_name": "Tagged"}, headers=headers)
+        response = client.get("/api/contacts/1", headers={**headers, "If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etag
+        response = client.get("/api/contacts", headers={**headers, "If-None-Match": list_etag})
+        assert response.status_code == 200
+
+
+def test_list_etag_changes_when_older_contact_is_edited(client, token, monkeypatch):
+    # updated_at must come from one clock on insert and update, whatever the timezone of the app
+    headers = {"Authorization": f"Bearer {token}"}
+    monkeypatch.setenv("TZ", "America/New_York")
+    time.tzset()
+    try:
+        with patch.object(auth_service, "r", new_callable=AsyncMock) as r_mock:
+            r_mock.get.return_value = None
+            monkeypatch.setattr(settings, "rate_limit_enabled", False)
+            older = client.post("/api/contacts/", json={**CONTACT, "email": "older@email.ua"}, headers=headers).json()
+            newer = client.post("/api/contacts/", json={**CONTACT, "email": "newer@email.ua"}, headers=headers).json()
+            list_etag = client.get("/api/contacts", headers=headers).headers["ETag"]
+            response = client.put(f"/api/contacts/{older['id']}", json={**CONTACT, "email": "older@email.ua",
+                                                                      "first_name": "Edited"}, headers=headers)
+            assert response.status_code == 200, response.text
+            response = client.get("/api/contacts", headers={**headers, "If-None-Match": list_etag})
+            assert response.status_code == 200
+            assert response.headers["ETag"] != list_etag
+            for contact in (older, newer):
+                client.delete(f"/api/contacts/{contact['id']}", headers=headers)
+    finally:
+        monkeypatch.delenv("TZ")
+        time.tzset()
+
+
+def test_list_etag_comes_from_the_contacts_version(client, token, monkeypatch):
+    headers = {"Authorization": f"Bearer {token}"}
+    with patch.object(auth_service, "r", new_callable=AsyncMock) as r_mock:
+        r_mock.get.return_value = None
+        monkeypatch.setattr(settings, "rate_limit_enabled", False)
+        list_etag = client.get("/api/contacts", headers=headers).headers["ETag"]
+        with patch("src.routes.contacts.repository_contacts.get_contacts_version") as version_mock:
+            response = client.get("/api/contacts", headers={**headers, "If-None-Match": list_etag})
+            assert response.status_code == 304
+            assert response.headers["ETag"] == list_etag
+            version_mock.assert_not_called()
+        # without Redis the ETag summarizes the contacts in the database
+        redis_mock = AsyncMock()
+        redis_mock.get.side_effect = redis.ConnectionError("down")
+        monkeypatch.setattr(response_cache, "r", redis_mock)
+        fallback_etag = client.get("/api/contacts", headers=headers).headers["ETag"]
+        assert fallback_etag != list_etag
+        response = client.get("/api/contacts", headers={**headers, "If-None-Match": fallback_etag})
+        assert response.status_code == 304
+
+
+def test_get_contacts_fast_path(client, token, monkeypatch):
+    headers = {"Authorization": f"Bearer {token}"}
+    with patch.object(auth_service, "r", new_callable=AsyncMock) as r_mock:
+        r_mock.get.return_value = None
+        monkeypatch.setattr(settings, "rate_limit_enabled", False)
+        # the second response has to be produced again, not read back from the response cache
+        monkeypatch.setattr(settings, "response_cache_enabled", False)
+        expected = client.get("/api/contacts", params={"cursor": ""}, headers=headers).json()
+        monkeypatch.setattr(settings, "contacts_fast_path", True)
+        response = client.get("/api/contacts", params={"cursor": ""}, headers=headers)
+        assert response.status_code == 200, response.text
+        assert response.json() == expected
+        response = client.get("/api/contacts/last_name/", params={"contact_last_name": "last"}, headers=headers)
+        assert response.status_code == 200, response.text
+        assert response.json()[0].keys() == expected["items"][0].keys()
+
+
 def test_delete_contact(client, token):
-    with patch.object(auth_service, 'r') as r_mock:
+    with patch.object(auth_service, 'r', new_callable=AsyncMock) as r_mock:
         r_mock.get.return_value = None
         response = client.delete(
             "/api/contacts/1",
@@ -248,7 +424,7 @@ def test_delete_contact(client, token):
 
 
 def test_repeat_delete_contact(client, token):
-    with patch.object(auth_service, 'r') as r_mock:
+    with patch.object(auth_service, 'r', new_callable=AsyncMock) as r_mock:
         r_mock.get.return_value = None
         response = client.delete(
             "/api/contacts/1",
@@ -257,3 +433,132 @@ def test_repeat_delete_contact(client, token):
         assert response.status_code == 404, response.text
         data = response.json()
         assert data["detail"] == "Not found!"
+
+
+def test_contact_writes_filter_on_user_id(session, token):
+    # contacts is hash partitioned on user_id in Postgres, UPDATE and DELETE must name it to prune
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    owner = session.query(User).first()
+    event.listen(session.bind, "before_cursor_execute", record)
+    try:
+        contact = Contact(first_name="Partition", email="partition@email.ua", user_id=owner.id)
+        session.add(contact)
+        session.commit()
+        contact.first_name = "Pruned"
+        session.commit()
+        session.delete(contact)
+        session.commit()
+    finally:
+        event.remove(session.bind, "before_cursor_execute", record)
+    writes = [statement for statement in statements
+              if statement.startswith(("UPDATE contacts", "DELETE FROM contacts"))]
+    assert len(writes) == 2
+    assert all("contacts.user_id = ?" in statement for statement in writes)
+
+
+def test_import_contacts_ndjson(client, token, monkeypatch):
+    with patch.object(auth_service, "r", new_callable=AsyncMock) as r_mock:
+        r_mock.get.return_value = None
+        monkeypatch.setattr(settings, "rate_limit_enabled", False)
+        rows = [
+            {**CONTACT, "email": "bulk1@email.ua"},
+            {**CONTACT, "email": "bulk1@email.ua"},
+            {**CONTACT, "email": "bulk2@email.ua", "birthday": "not a date"},
+            {**CONTACT, "email": "bulk3@email.ua"},
+        ]
+        response = client.post(
+            "/api/contacts/bulk",
+            params={"batch_size": 2},
+            content="\n".join(json.dumps(row) for row in rows) + "\nnot json\n",
+            headers={"Authorization": f"Bearer {token}", "Content-Type": "application/x-ndjson"},
+        )
+        assert response.status_code == 200, response.text
+        data = response.json()
+        assert data["inserted"] == 2
+        assert data["failed"] == 3
+        assert [error["row"] for error in data["errors"]] == [2, 3, 5]
+
+
+def test_import_contacts_csv(client, token, monkeypatch):
+    with patch.object(auth_service, "r", new_callable=AsyncMock) as r_mock:
+        r_mock.get.return_value = None
+        monkeypatch.setattr(settings, "rate_limit_enabled", False)
+        body = ("first_name,last_name,email,phone,birthday,description\n"
+                'Csv_name,Last_name,csv@email.ua,0631234567,2000-02-29,"two\nlines"\n')
+        response = client.post(
+            "/api/contacts/bulk", content=body,
+            headers={"Authorization": f"Bearer {token}", "Content-Type": "text/csv"},
+        )
+        assert response.status_code == 200, response.text
+        assert response.json() == {"inserted": 1, "failed": 0, "errors": []}
+
+
+def test_import_contacts_unsupported_type(client, token, monkeypatch):
+    with patch.object(auth_service, "r", new_callable=AsyncMock) as r_mock:
+        r_mock.get.return_value = None
+        monkeypatch.setattr(settings, "rate_limit_enabled", False)
+        response = client.post(
+            "/api/contacts/bulk", content="<contacts/>",
+            headers={"Authorization": f"Bearer {token}", "Content-Type": "application/xml"},
+        )
+        assert response.status_code == 415, response.text
+
+
+def test_export_contacts(client, token):
+    with patch.object(auth_service, "r", new_callable=AsyncMock) as r_mock:
+        r_mock.get.return_value = None
+        response = client.get("/api/contacts/export", headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == 200, response.text
+        assert response.headers["content-type"] == "application/x-ndjson"
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        assert {row["email"] for row in rows} == {"bulk1@email.ua", "bulk3@email.ua", "csv@email.ua"}
+
+        response = client.get("/api/contacts/export", params={"format": "csv"},
+                              headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == 200, response.text
+        lines = response.text.splitlines()
+        assert lines[0] == "id,first_name,last_name,email,phone,birthday,description"
+        assert "Csv_name" in response.text
+
+
+def test_lookup_contacts(client, token, monkeypatch):
+    with patch.object(auth_service, "r", new_callable=AsyncMock) as r_mock:
+        r_mock.get.return_value = None
+        monkeypatch.setattr(settings, "rate_limit_enabled", False)
+        contact = {**CONTACT, "email": "Lookup@email.ua", "phone": "+380 63 1234567"}
+        response = client.post("/api/contacts/", json=contact, headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == 201, response.text
+
+        response = client.get("/api/contacts/lookup", params={"phone": "(063) 123-45-67"},
+                              headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == 200, response.text
+        assert {contact["email"] for contact in response.json()} == \
+               {"bulk1@email.ua", "bulk3@email.ua", "csv@email.ua", "Lookup@email.ua"}
+
+        response = client.get("/api/contacts/lookup", params={"email": "lookup@email.UA", "phone": "0631234567"},
+                              headers={"Authorization": f"Bearer {token}"})
+        assert [contact["email"] for contact in response.json()] == ["Lookup@email.ua"]
+
+        response = client.get("/api/contacts/lookup", headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == 400, response.text
+
+
+def test_get_duplicates(client, token):
+    with patch.object(auth_service, "r", new_callable=AsyncMock) as r_mock:
+        r_mock.get.return_value = None
+        response = client.get("/api/contacts/duplicates", headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == 200, response.text
+        groups = {(group["key"], group["value"]): [contact["email"] for contact in group["contacts"]]
+                  for group in response.json()}
+        assert groups[("phone", "+380631234567")] == ["bulk1@email.ua", "bulk3@email.ua", "csv@email.ua",
+                                                      "Lookup@email.ua"]
+        assert groups[("name", "first_name last_name")] == ["bulk1@email.ua", "bulk3@email.ua", "Lookup@email.ua"]
+        assert not any(key == "email" for key, _ in groups)
+
+        response = client.get("/api/contacts/duplicates", params={"key": "email"},
+                              headers={"Authorization": f"Bearer {token}"})
+        assert response.json() == []
@@ -1,9 +1,13 @@
+from io import BytesIO
 from unittest.mock import MagicMock, patch, AsyncMock
 
 import pytest
+from PIL import Image
 
 from src.database.models import User
+from src.conf.config import settings
 from src.services.auth import auth_service
+from src.services.storage import LocalStorage
 
 
 @pytest.fixture()
@@ -24,13 +28,44 @@ def token(client, user, session, monkeypatch):
 
 
 def test_get_me(client, token, monkeypatch):
-    with patch.object(auth_service, "r") as redis_mock:
+    with patch.object(auth_service, "r", new_callable=AsyncMock) as redis_mock:
         redis_mock.get.return_value = None
-        monkeypatch.setattr('fastapi_limiter.FastAPILimiter.redis', AsyncMock())
-        monkeypatch.setattr('fastapi_limiter.FastAPILimiter.identifier', AsyncMock())
-        monkeypatch.setattr('fastapi_limiter.FastAPILimiter.http_callback', AsyncMock())
+        monkeypatch.setattr(settings, "rate_limit_enabled", False)
         response = client.get("api/users/me/", headers={"Authorization": f"Bearer {token}"})
         assert response.status_code == 200, response.text
         data = response.json()
         assert "id" in data
-  
\ No newline at end of file
+  
+
+def avatar_request(client, token, content, content_type="image/png"):
+    return client.patch("api/users/avatar", headers={"Authorization": f"Bearer {token}"},
+                        files={"file": ("avatar.png", content, content_type)})
+
+
+def test_update_avatar(client, token, monkeypatch, tmp_path):
+    image = BytesIO()
+    Image.new("RGB", (600, 400), "red").save(image, format="PNG")
+    monkeypatch.setattr("src.routes.users.storage", LocalStorage(tmp_path, "/static/avatars"))
+    with patch.object(auth_service, "r", new_callable=AsyncMock) as redis_mock:
+        redis_mock.get.return_value = None
+        response = avatar_request(client, token, image.getvalue())
+        assert response.status_code == 200, response.text
+        avatar = response.json()["avatar"]
+        assert avatar.startswith("/static/avatars/ContactsApp/")
+    stored = Image.open(tmp_path / "ContactsApp" / avatar.split("/")[-1].split("?")[0])
+    assert stored.format == "JPEG"
+    assert stored.size == (250, 250)
+
+
+def test_update_avatar_not_an_image(client, token):
+    with patch.object(auth_service, "r", new_callable=AsyncMock) as redis_mock:
+        redis_mock.get.return_value = None
+        response = avatar_request(client, token, b"not an image")
+        assert response.status_code == 400, response.text
+
+
+def test_update_avatar_too_large(client, token):
+    with patch.object(auth_service, "r", new_callable=AsyncMock) as redis_mock:
+        redis_mock.get.return_value = None
+        response = avatar_request(client, token, b"0" * (settings.avatar_max_bytes + 1))
+        assert response.status_code == 413, response.text
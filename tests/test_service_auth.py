@@ -0,0 +1,104 @@
+import asyncio
+import threading
+from datetime import datetime
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from passlib.context import CryptContext
+
+from src.database.models import User
+from src.services.auth import auth_service
+from src.services.cache import TTLCache
+from src.services.workers import BoundedExecutor, PoolSaturated
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 1
+
+
+def test_ttl_cache_expires_entries():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1, ttl=0)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_user_record_round_trip():
+    user = User(id=7, username="deadpool", email="deadpool@example.com", password="hash",
+                avatar="avatar", confirmed=True, created_at=datetime(2023, 5, 28, 19, 22))
+    record = auth_service.dump_user(user)
+    assert "hash" not in record
+    restored = auth_service.load_user(record)
+    assert restored.id == 7
+    assert restored.email == user.email
+    assert restored.created_at == user.created_at
+
+
+def test_cached_user_is_served_from_process_after_redis_hit():
+    auth_service.user_cache.clear()
+    user = User(id=7, username="deadpool", email="deadpool@example.com", avatar=None, confirmed=True,
+                created_at=datetime(2023, 5, 28, 19, 22))
+    with patch.object(auth_service, "r", new_callable=AsyncMock) as r_mock:
+        r_mock.get.return_value = auth_service.dump_user(user)
+        first = asyncio.run(auth_service.get_cached_user(user.email))
+        second = asyncio.run(auth_service.get_cached_user(user.email))
+        assert first.id == second.id == 7
+        assert r_mock.get.await_count == 1
+    assert auth_service.user_cache_stats()["local"]["hits"] == 1
+    auth_service.user_cache.clear()
+
+
+def test_bounded_executor_rejects_when_saturated():
+    pool = BoundedExecutor("test", max_workers=1, max_queue=0)
+    release = threading.Event()
+
+    async def scenario():
+        blocked = asyncio.create_task(pool.run(release.wait))
+        await asyncio.sleep(0.05)
+        with pytest.raises(PoolSaturated):
+            await pool.run(lambda: None)
+        release.set()
+        await blocked
+
+    asyncio.run(scenario())
+    stats = pool.stats()
+    assert stats["rejected"] == 1
+    assert stats["pending"] == 0
+    assert stats["run_seconds"]["count"] == 1
+    pool.shutdown()
+
+
+def test_verify_and_update_password_rehashes_old_cost():
+    old_hash = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4).hash("123456789")
+    verified, new_hash = asyncio.run(auth_service.verify_and_update_password("123456789", old_hash))
+    assert verified
+    assert new_hash != old_hash
+    assert auth_service.pwd_context.verify("123456789", new_hash)
+    assert asyncio.run(auth_service.verify_and_update_password("wrong", old_hash)) == (False, None)
+
+
+def test_verified_token_is_cached_until_exp():
+    auth_service.token_cache.clear()
+    token = asyncio.run(auth_service.create_access_token({"sub": "deadpool@example.com"}))
+    assert auth_service.verify_access_token(token) == "deadpool@example.com"
+    with patch("src.services.auth.jwt.decode") as decode_mock:
+        assert auth_service.verify_access_token(token) == "deadpool@example.com"
+        decode_mock.assert_not_called()
+    assert auth_service.token_cache_stats()["hits"] == 1
+    auth_service.token_cache.clear()
+
+
+def test_bad_tokens_are_not_cached():
+    auth_service.token_cache.clear()
+    refresh_token = asyncio.run(auth_service.create_refresh_token({"sub": "deadpool@example.com"}))
+    assert auth_service.verify_access_token(refresh_token) is None
+    assert auth_service.verify_access_token("not.a.token") is None
+    assert len(auth_service.token_cache) == 0
@@ -0,0 +1,74 @@
+import asyncio
+import socket
+
+import pytest
+from aiosmtpd.controller import Controller
+
+from src.services.email import EmailDeliveryError, Mailer
+
+
+class Inbox:
+    def __init__(self):
+        self.messages = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        return "250 OK"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture()
+def smtp_server():
+    inbox = Inbox()
+    controller = Controller(inbox, hostname="127.0.0.1", port=free_port())
+    controller.start()
+    yield controller, inbox
+    controller.stop()
+
+
+def make_mailer(port, **kwargs):
+    return Mailer("127.0.0.1", port, use_tls=False, validate_certs=False, pool_size=1, **kwargs)
+
+
+def test_mailer_reuses_connection(smtp_server):
+    controller, inbox = smtp_server
+    mailer = make_mailer(controller.port)
+
+    async def scenario():
+        for name in ("alice", "bob", "carol"):
+            await mailer.send(f"{name}@example.com", "Confirm your email", "email_template.html",
+                              {"host": "http://testserver/", "username": name, "token": "token"})
+        await mailer.close()
+
+    asyncio.run(scenario())
+    assert len(inbox.messages) == 3
+    assert inbox.messages[0].rcpt_tos == ["alice@example.com"]
+    assert b"api/auth/confirmed_email/token" in inbox.messages[0].content
+    stats = mailer.stats()
+    assert stats["sent"] == 3
+    assert stats["connections_opened"] == 1
+    assert stats["send_seconds"]["count"] == 3
+
+
+def test_mailer_escapes_template_variables(smtp_server):
+    controller, inbox = smtp_server
+    mailer = make_mailer(controller.port)
+    asyncio.run(mailer.send("eve@example.com", "Confirm your email", "email_template.html",
+                            {"host": "http://testserver/", "username": "<b>eve</b>", "token": "token"}))
+    assert b"&lt;b&gt;eve&lt;/b&gt;" in inbox.messages[0].content
+
+
+def test_mailer_retries_then_fails():
+    mailer = make_mailer(free_port(), retries=2, backoff=0.01)
+    with pytest.raises(EmailDeliveryError):
+        asyncio.run(mailer.send("alice@example.com", "Confirm your email", "email_template.html",
+                                {"host": "http://testserver/", "username": "alice", "token": "token"}))
+    stats = mailer.stats()
+    assert stats["retried"] == 2
+    assert stats["failed"] == 1
+    assert stats["sent"] == 0
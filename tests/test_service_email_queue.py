@@ -0,0 +1,87 @@
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+import fakeredis
+import pytest
+import redis.asyncio as redis
+
+from src.conf.config import settings
+from src.services.email import EmailDeliveryError
+from src.services.email_queue import EmailQueue
+
+
+@pytest.fixture()
+def queue(monkeypatch):
+    monkeypatch.setattr(settings, "email_block_ms", None)
+    return EmailQueue()
+
+
+async def drain(queue, consumer="worker-1"):
+    await queue.ensure_group()
+    while await queue.process_batch(consumer, 4):
+        pass
+
+
+def test_jobs_are_sent_once(queue):
+    async def scenario():
+        queue.r = fakeredis.aioredis.FakeRedis(decode_responses=True)
+        assert await queue.enqueue("alice@example.com", "alice", "http://testserver/")
+        await drain(queue)
+        entries = await queue.r.xrange(settings.email_stream)
+        await queue.r.xadd(settings.email_stream, entries[0][1])
+        await drain(queue)
+
+    with patch("src.services.email_queue.send_confirmation", new_callable=AsyncMock) as send_mock:
+        asyncio.run(scenario())
+        send_mock.assert_awaited_once()
+        assert send_mock.await_args.args[:3] == ("alice@example.com", "alice", "http://testserver/")
+    assert queue.stats()["sent"] == 1
+    assert queue.stats()["duplicates"] == 1
+
+
+def test_failing_job_is_dead_lettered(queue, monkeypatch):
+    monkeypatch.setattr(settings, "email_max_attempts", 3)
+
+    async def scenario():
+        queue.r = fakeredis.aioredis.FakeRedis(decode_responses=True)
+        await queue.enqueue("bob@example.com", "bob", "http://testserver/")
+        await drain(queue)
+        pending = await queue.r.xpending(settings.email_stream, settings.email_group)
+        return await queue.r.xrange(settings.email_dead_stream), pending
+
+    with patch("src.services.email_queue.send_confirmation", new_callable=AsyncMock) as send_mock:
+        send_mock.side_effect = EmailDeliveryError("smtp down")
+        dead, pending = asyncio.run(scenario())
+        assert send_mock.await_count == 3
+    assert len(dead) == 1
+    assert dead[0][1]["email"] == "bob@example.com"
+    assert dead[0][1]["error"] == "smtp down"
+    assert pending["pending"] == 0
+    assert queue.stats()["retried"] == 2
+
+
+def test_poison_job_is_dead_lettered(queue):
+    async def scenario():
+        queue.r = fakeredis.aioredis.FakeRedis(server=fakeredis.FakeServer(), decode_responses=True)
+        await queue.ensure_group()
+        await queue.r.xadd(settings.email_stream, {"email": "eve@example.com", "attempts": 0})
+        await queue.enqueue("carol@example.com", "carol", "http://testserver/")
+        await drain(queue)
+        pending = await queue.r.xpending(settings.email_stream, settings.email_group)
+        return await queue.r.xrange(settings.email_dead_stream), pending
+
+    with patch("src.services.email_queue.send_confirmation", new_callable=AsyncMock) as send_mock:
+        dead, pending = asyncio.run(scenario())
+        send_mock.assert_awaited_once()
+    assert len(dead) == 1
+    assert dead[0][1]["email"] == "eve@example.com"
+    assert dead[0][1]["error"] == "KeyError: 'key'"
+    assert pending["pending"] == 0
+    assert queue.stats()["sent"] == 1
+    assert queue.stats()["dead"] == 1
+
+
+def test_enqueue_reports_redis_errors(queue):
+    with patch.object(queue, "r", new_callable=AsyncMock) as r_mock:
+        r_mock.xadd.side_effect = redis.ConnectionError("down")
+        assert not asyncio.run(queue.enqueue("carol@example.com", "carol", "http://testserver/"))
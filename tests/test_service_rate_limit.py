@@ -0,0 +1,56 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+import fakeredis
+import pytest
+import redis.asyncio as redis
+
+from src.conf.config import settings
+from src.services.rate_limit import RateLimiter
+
+
+@pytest.fixture()
+def limiter(monkeypatch):
+    monkeypatch.setattr(settings, "rate_limits", {"read_contacts": "3/60"})
+    return RateLimiter()
+
+
+def test_bucket_is_per_user(limiter):
+    async def scenario():
+        limiter.r = fakeredis.aioredis.FakeRedis(server=fakeredis.FakeServer())
+        results = [await limiter.check("read_contacts", "user:alice@example.com") for _ in range(4)]
+        other = await limiter.check("read_contacts", "user:bob@example.com")
+        return results, other
+
+    results, other = asyncio.run(scenario())
+    assert results[:3] == [None, None, None]
+    assert 0 < results[3] <= 20
+    assert other is None
+    assert limiter.stats()["read_contacts"] == {"allowed": 4, "limited": 1}
+
+
+def test_local_bucket_takes_tokens_in_batches(limiter, monkeypatch):
+    monkeypatch.setattr(settings, "rate_limit_local", True)
+    monkeypatch.setattr(settings, "rate_limit_sync_interval", 30)
+
+    async def scenario():
+        limiter.r = fakeredis.aioredis.FakeRedis(server=fakeredis.FakeServer())
+        return [await limiter.check("read_contacts", "user:alice@example.com") for _ in range(5)]
+
+    results = asyncio.run(scenario())
+    assert results[:3] == [None, None, None]
+    assert results[3] is not None and results[4] is not None
+    assert limiter.redis_calls == 2
+
+
+def test_redis_errors_let_requests_through(limiter):
+    limiter.r = AsyncMock()
+    limiter.r.evalsha.side_effect = redis.ConnectionError("down")
+    assert asyncio.run(limiter.check("read_contacts", "user:alice@example.com")) is None
+    assert limiter.stats()["errors"] == 1
+
+
+def test_unknown_policy_is_not_limited(limiter):
+    limiter.r = AsyncMock()
+    assert asyncio.run(limiter.check("export_contacts", "user:alice@example.com")) is None
+    limiter.r.evalsha.assert_not_awaited()
@@ -0,0 +1,140 @@
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+import fakeredis
+import pytest
+import redis.asyncio as redis
+from fastapi import HTTPException
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from src.conf.config import settings
+from src.database.models import Base, User
+from src.services.auth import auth_service
+from src.services.sessions import SessionStore
+
+USER = User(id=1, email="deadpool@example.com")
+
+
+@pytest.fixture()
+def store():
+    return SessionStore()
+
+
+def test_tokens_rotate_and_reuse_revokes_the_session(store):
+    async def scenario():
+        store.r = fakeredis.aioredis.FakeRedis(server=fakeredis.FakeServer())
+        first = await store.issue(USER, None, device="phone")
+        sid = (await auth_service.decode_refresh_payload(first))["sid"]
+        assert sid != "phone"
+        assert await store.r.hget(store.session_key(USER.email, sid), "device") == b"phone"
+        email, second = await store.rotate(first, None)
+        assert email == USER.email
+        _, third = await store.rotate(second, None)
+        with pytest.raises(HTTPException) as reused:
+            await store.rotate(first, None)
+        with pytest.raises(HTTPException) as revoked:
+            await store.rotate(third, None)
+        return reused.value.status_code, revoked.value.status_code
+
+    assert asyncio.run(scenario()) == (401, 401)
+    assert store.stats()["rotated"] == 2
+    assert store.stats()["reused"] == 1
+
+
+def test_revoke_all_ends_every_device(store):
+    async def scenario():
+        store.r = fakeredis.aioredis.FakeRedis(server=fakeredis.FakeServer())
+        phone = await store.issue(USER, None, device="phone")
+        laptop = await store.issue(USER, None, device="laptop")
+        with patch("src.services.sessions.repository_users.revoke_token", AsyncMock(return_value=False)):
+            await store.revoke_all(USER, None)
+        rejected = []
+        for token in (phone, laptop):
+            with pytest.raises(HTTPException) as err:
+                await store.rotate(token, None)
+            rejected.append(err.value.status_code)
+        after = await store.issue(USER, None, device="phone")
+        await store.rotate(after, None)
+        return rejected
+
+    assert asyncio.run(scenario()) == [401, 401]
+
+
+def test_tokens_fall_back_to_the_users_table(store):
+    store.r = AsyncMock()
+    store.r.evalsha.side_effect = redis.ConnectionError("down")
+    user = User(id=1, email="deadpool@example.com")
+
+    async def update_token(user, token, db):
+        user.refresh_token = token
+
+    async def revoke_token(email, db, token=None):
+        if user.refresh_token is None or token not in (None, user.refresh_token):
+            return False
+        user.refresh_token = None
+        return True
+
+    with patch("src.services.sessions.repository_users") as repository_mock:
+        repository_mock.update_token.side_effect = update_token
+        repository_mock.revoke_token.side_effect = revoke_token
+        repository_mock.get_user_by_email = AsyncMock(return_value=user)
+        token = asyncio.run(store.issue(user, None))
+        assert user.refresh_token == token
+        assert "sid" not in asyncio.run(auth_service.decode_refresh_payload(token))
+        _, rotated = asyncio.run(store.rotate(token, None))
+        assert user.refresh_token == rotated
+        with pytest.raises(HTTPException):
+            asyncio.run(store.rotate(token, None))
+        assert user.refresh_token is None
+    assert store.stats()["fallbacks"] == 2
+
+
+def test_revocation_fails_without_redis(store, monkeypatch):
+    monkeypatch.setattr(settings, "refresh_token_db_fallback", True)
+
+    async def scenario():
+        store.r = fakeredis.aioredis.FakeRedis(server=fakeredis.FakeServer())
+        token = await store.issue(USER, None, device="phone")
+        store.r = AsyncMock()
+        store.r.incr.side_effect = redis.ConnectionError("down")
+        store.r.delete.side_effect = redis.ConnectionError("down")
+        statuses = []
+        with patch("src.services.sessions.repository_users.revoke_token", AsyncMock(return_value=False)):
+            for revocation in (store.revoke_all(USER, None), store.revoke(token, None)):
+                with pytest.raises(HTTPException) as err:
+                    await revocation
+                statuses.append(err.value.status_code)
+        return statuses
+
+    assert asyncio.run(scenario()) == [503, 503]
+
+
+def test_legacy_token_is_rotated_once_under_concurrency(store, tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'users.db'}")
+    Base.metadata.create_all(engine)
+    engine.dispose()
+
+    async def scenario():
+        store.r = fakeredis.aioredis.FakeRedis(server=fakeredis.FakeServer())
+        async_engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'users.db'}")
+        sessions = async_sessionmaker(async_engine, expire_on_commit=False)
+        token = await auth_service.create_refresh_token({"sub": USER.email, "jti": "legacy"})
+        try:
+            async with sessions() as db:
+                db.add(User(username="deadpool", email=USER.email, password="secret", refresh_token=token))
+                await db.commit()
+
+            async def rotate():
+                async with sessions() as db:
+                    try:
+                        await store.rotate(token, db)
+                        return 200
+                    except HTTPException as err:
+                        return err.status_code
+
+            return sorted(await asyncio.gather(rotate(), rotate()))
+        finally:
+            await async_engine.dispose()
+
+    assert asyncio.run(scenario()) == [200, 401]